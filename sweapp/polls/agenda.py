@@ -0,0 +1,103 @@
+"""
+Per-User Agenda Cache
+
+The "upcoming events" boxes on the feed and profile pages show the next
+events a user hosts and the next ones they're going to. Both pages read
+them from one cache entry per user, so a warm page load runs no event
+queries at all.
+
+The entry holds up to AGENDA_SIZE of each, as plain dicts with the host's
+username, and goes stale in two ways:
+- Something changes which events are on it. The views that do that drop
+  the affected users' entries once their transaction commits:
+  create_event_view (the host), delete_event (the host and everyone
+  going), and event_rsvp through polls/rsvp.py (the user, and anyone
+  promoted off a waitlist)
+- Time passes: the soonest event on it starts. The entry's timeout ends
+  exactly then (and at most AGENDA_CACHE_TIMEOUT), so the next read
+  rebuilds it without that event
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Event, EventRSVP
+
+AGENDA_SIZE = 5
+
+# Longest an agenda is kept, however far off its events are; bounds
+# staleness from changes that don't invalidate it (e.g. editing an event in
+# the admin)
+AGENDA_CACHE_TIMEOUT = 3600
+
+
+def agenda_cache_key(user_id):
+    return f'agenda:{user_id}'
+
+
+def _entry(event, role):
+    host = event.hosted_by_user
+    return {
+        'event_id': event.event_id,
+        'title': event.title,
+        'date': event.date,
+        'location': event.location,
+        'role': role,
+        'host_id': host.id if host else None,
+        'host_username': host.username if host else '',
+    }
+
+
+def build_agenda(user_id):
+    now = timezone.now()
+    hosted = (
+        Event.objects
+        .filter(date__gte=now, hosted_by_user_id=user_id)
+        .select_related('hosted_by_user')
+        .order_by('date')[:AGENDA_SIZE]
+    )
+    going = EventRSVP.objects.filter(user_id=user_id, rsvp_status='going').values('event_id')
+    attending = (
+        Event.objects
+        .filter(date__gte=now, event_id__in=going)
+        .exclude(hosted_by_user_id=user_id)
+        .select_related('hosted_by_user')
+        .order_by('date')[:AGENDA_SIZE]
+    )
+    return {
+        'hosted': [_entry(event, 'host') for event in hosted],
+        'attending': [_entry(event, 'going') for event in attending],
+    }
+
+
+def get_agenda(user):
+    """
+    {'hosted': [...], 'attending': [...]}: the user's next AGENDA_SIZE
+    hosted events and next AGENDA_SIZE they're going to (not hosting),
+    soonest first, each a dict with event_id, title, date, location, role
+    ('host' or 'going'), host_id and host_username.
+    """
+    key = agenda_cache_key(user.id)
+    agenda = cache.get(key)
+    if agenda is None:
+        agenda = build_agenda(user.id)
+        timeout = AGENDA_CACHE_TIMEOUT
+        dates = [entry['date'] for entry in agenda['hosted'] + agenda['attending']]
+        if dates:
+            until_next = (min(dates) - timezone.now()).total_seconds()
+            timeout = max(1, min(timeout, int(until_next) + 1))
+        cache.set(key, agenda, timeout)
+    return agenda
+
+
+def upcoming(agenda, limit):
+    """The agenda's hosted and attending events merged, soonest first"""
+    return sorted(agenda['hosted'] + agenda['attending'], key=lambda entry: entry['date'])[:limit]
+
+
+def invalidate_agendas(user_ids):
+    """Drop the users' cached agendas once the current transaction commits"""
+    keys = [agenda_cache_key(user_id) for user_id in set(user_ids) if user_id is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
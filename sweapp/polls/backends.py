@@ -0,0 +1,75 @@
+"""
+Email Authentication and User Cache
+
+EmailBackend logs people in by email in a single query on the unique
+auth_user.email index (migration 0012), instead of looking the user up by
+email and then authenticating by username.
+
+It also answers the per-request get_user() that AuthenticationMiddleware
+makes, from the cache when it can: the User is cached together with its
+UserProfile, so `request.user` and `request.user.profile` cost no queries
+on a warm request. Combined with cached_db sessions (settings.py), a warm
+request doesn't touch the database to work out who is asking.
+
+Saving or deleting a User or UserProfile drops the cached copy once the
+transaction commits (signals in polls/signals.py), wherever it happens:
+views, the admin, password resets. QuerySet.update() sends no signals, so
+code that updates those rows that way calls invalidate_user() itself.
+"""
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+# Cached users are dropped on change; this just bounds staleness for
+# changes that bypass signals (raw SQL, .update() without invalidate_user)
+USER_CACHE_TIMEOUT = 300
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_user(user_id):
+    """Forget the cached User (and profile) so the next request reloads it"""
+    cache.delete(user_cache_key(user_id))
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticates with email + password; serves get_user() from the cache.
+    """
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if not email or password is None:
+            return None
+
+        User = get_user_model()
+        # email > '' repeats the partial index's condition so SQLite can
+        # use it; blank emails aren't unique and never log anyone in
+        user = User.objects.filter(email=email, email__gt='').first()
+        if user is None:
+            # Spend the same time hashing as a real check, so response
+            # times don't reveal which emails have accounts
+            User().set_password(password)
+            return None
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            User = get_user_model()
+            user = User._default_manager.select_related('profile').filter(pk=user_id).first()
+            if user is None:
+                return None
+            try:
+                user.profile
+            except User.profile.RelatedObjectDoesNotExist:
+                # Not cached: the first page that needs one creates it
+                return user if self.user_can_authenticate(user) else None
+            cache.set(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
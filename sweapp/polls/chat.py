@@ -0,0 +1,72 @@
+"""
+Chat History
+
+Helpers shared by messages_view and ChatConsumer for reading a
+conversation one page at a time. Pages are keyed by message_id and read
+newest-first from the (pair_key, message_id) index, then flipped so
+callers always get them in display (oldest-first) order.
+
+save_message() is the consumer's write path. It takes plain ids, so a
+connection that resolved both users once at connect time never looks a
+User up again per message.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Conversation, Message
+from .notifications import notify_unread
+
+CHAT_PAGE_SIZE = 50
+
+
+def get_history(user_id, other_id, before=None, limit=CHAT_PAGE_SIZE):
+    """
+    Return (messages, has_more) for the page of a conversation before a message.
+
+    With before=None this is the most recent page. has_more tells the client
+    whether a "load older" request can return anything.
+    """
+    messages = (
+        Message.objects
+        .filter(pair_key=Message.make_pair_key(user_id, other_id))
+        .select_related('sender')
+        .order_by('-message_id')
+    )
+    if before is not None:
+        messages = messages.filter(message_id__lt=before)
+
+    page = list(messages[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    page.reverse()
+    return page, has_more
+
+
+def save_message(sender_id, receiver_id, content):
+    """Save a chat message and fold it into the pair's Conversation"""
+    with transaction.atomic():
+        message = Message.objects.create(
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            content=content
+        )
+        Conversation.record_message(message)
+        notify_unread([message])
+    return message
+
+
+def format_timestamp(timestamp):
+    """Match the `date:"M d, h:i A"` format used in messages.html"""
+    return timezone.localtime(timestamp).strftime('%b %d, %I:%M %p')
+
+
+def serialize_message(message):
+    """JSON shape of a chat message as sent over the WebSocket"""
+    return {
+        'message_id': message.message_id,
+        'message': message.content,
+        'sender_username': message.sender.username,
+        'sender_id': message.sender_id,
+        'timestamp': format_timestamp(message.timestamp),
+    }
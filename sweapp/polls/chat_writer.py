@@ -0,0 +1,170 @@
+"""
+Write-Behind Chat Persistence
+
+When settings.CHAT_WRITE_BEHIND is on, ChatConsumer broadcasts a message to
+the room straight away with a provisional id and hands it to this writer
+instead of awaiting its own INSERT. A background thread collects queued
+messages and saves them with one bulk_create per batch.
+
+How it works:
+1. submit() puts an unsaved Message on a thread-safe queue (no DB work)
+2. The writer thread waits for the first message, then keeps collecting
+   until CHAT_WRITE_BATCH_SIZE messages or CHAT_WRITE_FLUSH_INTERVAL seconds
+3. The batch is inserted in one transaction and folded into Conversation
+4. A failed batch is retried until it succeeds (at-least-once); the unique
+   client_id makes a retry skip rows that already made it in
+5. At interpreter exit the queue is drained and flushed before returning
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MessageWriter:
+    """
+    Background thread that batches Message INSERTs.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.05, retry_delay=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, message):
+        """Queue an unsaved Message; returns immediately"""
+        self._ensure_started()
+        self._queue.put(message)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout=30):
+        """Flush everything queued so far and stop the writer thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+
+            # Keep collecting until the batch is full or the window closes
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush_with_retry(batch)
+
+        # Drain anything that raced in behind the stop marker
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftovers.append(item)
+        for start in range(0, len(leftovers), self.batch_size):
+            self._flush_with_retry(leftovers[start:start + self.batch_size])
+        connection.close()
+
+    def _flush_with_retry(self, batch):
+        while True:
+            close_old_connections()
+            try:
+                self.flush(batch)
+                return
+            except IntegrityError:
+                # Something in the batch can never be saved (e.g. the
+                # receiver was deleted); save the rest one at a time
+                self._flush_individually(batch)
+                return
+            except DatabaseError as e:
+                logger.warning('batch failed, retrying', extra={'size': len(batch), 'error': str(e)})
+                time.sleep(self.retry_delay)
+
+    def _flush_individually(self, batch):
+        for message in batch:
+            while True:
+                try:
+                    self.flush([message])
+                    break
+                except IntegrityError as e:
+                    logger.error('dropping message', extra={'client_id': message.client_id, 'error': str(e)})
+                    break
+                except DatabaseError as e:
+                    logger.warning('message failed, retrying', extra={'client_id': message.client_id, 'error': str(e)})
+                    time.sleep(self.retry_delay)
+
+    def flush(self, batch):
+        """Insert a batch of Messages that aren't in the database yet"""
+        from .models import Conversation, Message
+        from .notifications import notify_unread
+
+        with transaction.atomic():
+            # A retry after an ambiguous failure may find some rows already in
+            already_saved = set(
+                Message.objects.filter(client_id__in=[m.client_id for m in batch])
+                .values_list('client_id', flat=True)
+            )
+            pending = [m for m in batch if m.client_id not in already_saved]
+            if not pending:
+                return []
+            for message in pending:
+                # A rolled-back attempt leaves its ids behind; insert afresh
+                message.message_id = None
+                message.pair_key = Message.make_pair_key(message.sender_id, message.receiver_id)
+            saved = Message.objects.bulk_create(pending)
+            Conversation.record_messages(saved)
+            notify_unread(saved)
+        return saved
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """The process-wide MessageWriter, configured from settings"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = MessageWriter(
+                    batch_size=settings.CHAT_WRITE_BATCH_SIZE,
+                    flush_interval=settings.CHAT_WRITE_FLUSH_INTERVAL,
+                )
+    return _writer
@@ -7,14 +7,77 @@ It handles:
 2. Receiving messages from the client (browser)
 3. Sending messages to the client
 4. Disconnection cleanup
+
+Every consumer here also keeps the user's presence up to date (see
+presence.py); none of that touches the database. MetricsConsumerMixin
+times each event they handle and counts open sockets (see metrics.py).
 """
 
+import asyncio
 import json
+import logging
+import uuid
+
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 
+from .live_feed import FEED_PUSH_INTERVAL
+from .metrics import MetricsConsumerMixin
+from .notifications import NOTIFY_COALESCE_INTERVAL, coalesce, notification_group
+from .presence import MAX_WATCHED_USERS, TypingThrottle, presence_group, registry
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceMixin:
+    """
+    Online/offline bookkeeping shared by the consumers.
+    
+    join_presence() / leave_presence() go in connect() / disconnect(), and
+    a {"type": "heartbeat"} from the client goes to heartbeat(). Changes are
+    broadcast to presence_<user_id>; whoever joined that group receives them
+    in presence_update().
+    """
+    
+    async def join_presence(self):
+        if registry.connect(self.user.id, self.channel_name):
+            await self.announce_presence(self.user.id, True)
+    
+    async def leave_presence(self):
+        if registry.disconnect(self.user.id, self.channel_name):
+            await self.announce_presence(self.user.id, False)
+    
+    async def heartbeat(self):
+        if registry.heartbeat(self.user.id, self.channel_name):
+            await self.announce_presence(self.user.id, True)
+        # Piggyback the sweep for connections that went silent
+        for user_id in registry.expire():
+            await self.announce_presence(user_id, False)
+    
+    async def announce_presence(self, user_id, online):
+        await self.channel_layer.group_send(
+            presence_group(user_id),
+            {
+                'type': 'presence_update',
+                'user_id': user_id,
+                'online': online
+            }
+        )
+    
+    async def presence_update(self, event):
+        """A watched user came online or went offline"""
+        registry.observe(event['user_id'], event['online'])
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'user_id': event['user_id'],
+            # The registry may know better, e.g. the user is still
+            # connected to this process through another tab
+            'online': registry.is_online(event['user_id'])
+        }))
+
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(MetricsConsumerMixin, PresenceMixin, AsyncWebsocketConsumer):
     """
     Handles real-time chat between two users.
     
@@ -29,12 +92,26 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """
         Called when the WebSocket connection is established.
         This happens when a user opens the chat page.
+        
+        Both participants are resolved here, once, and kept for the life of
+        the connection. Anonymous users and unknown peers are turned away
+        before accept(), so the handshake fails and nothing joins a room.
         """
         self.user = self.scope['user']
+        self.other_user = None
+        self.room_group_name = None
+        self.typing = TypingThrottle()
+        
+        if not self.user.is_authenticated:
+            await self.close()
+            return
         
-        self.other_user_id = self.scope['url_route']['kwargs']['user_id']
+        self.other_user = await self.get_peer(self.scope['url_route']['kwargs']['user_id'])
+        if self.other_user is None:
+            await self.close()
+            return
         
-        user_ids = sorted([self.user.id, int(self.other_user_id)])
+        user_ids = sorted([self.user.id, self.other_user.id])
         self.room_name = f'chat_{user_ids[0]}_{user_ids[1]}'
         self.room_group_name = f'chat_{self.room_name}'
         
@@ -44,48 +121,75 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        await self.join_presence()
         
-        print(f"[WebSocket] User {self.user.username} connected to room {self.room_name}")
+        logger.info('chat connected', extra={'user_id': self.user.id, 'room': self.room_name})
     
     async def disconnect(self, close_code):
         """
         Called when the WebSocket connection is closed.
         This happens when user closes the browser or navigates away.
         """
+        if self.room_group_name is None:
+            # Rejected in connect(); never joined a room
+            return
     
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await self.leave_presence()
         
-        print(f"[WebSocket] User {self.user.username} disconnected from room {self.room_name}")
+        logger.info('chat disconnected', extra={'user_id': self.user.id, 'room': self.room_name, 'code': close_code})
     
     async def receive(self, text_data):
         """
         Called when we receive a message from the client (browser).
-        This happens when a user types a message and clicks Send.
+        This happens when a user types a message and clicks Send, or
+        scrolls up and asks for older history.
         """
     
         data = json.loads(text_data)
+        
+        if data.get('type') == 'history':
+            await self.send_history(data.get('before'))
+            return
+        
+        if data.get('type') == 'typing':
+            await self.send_typing(bool(data.get('active', True)))
+            return
+        
+        if data.get('type') == 'heartbeat':
+            await self.heartbeat()
+            return
+        
+        # The receiver is whoever this room was opened with; any
+        # receiver_id the client sends along is ignored
         message_content = data['message']
-        receiver_id = data['receiver_id']
         
-        print(f"[WebSocket] Received message from {self.user.username}: {message_content}")
+        # Length only: message text stays out of the logs
+        logger.debug('chat message', extra={'user_id': self.user.id, 'room': self.room_name, 'length': len(message_content)})
         
-        message = await self.save_message(
-            sender=self.user,
-            receiver_id=receiver_id,
-            content=message_content
-        )
+        # The message itself tells the other side we stopped typing
+        self.typing.stopped()
+        
+        if settings.CHAT_WRITE_BEHIND:
+            # Broadcast now; the background writer saves it shortly after
+            message = self.queue_message(message_content)
+        else:
+            message = await self.save_message(message_content)
         
+        from .chat import format_timestamp
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message', 
+                'message_id': message.message_id,
+                'provisional_id': message.client_id,
                 'message': message_content,
                 'sender_username': self.user.username,
                 'sender_id': self.user.id,
-                'timestamp': message.timestamp.strftime('%b %d, %I:%M %p')
+                'timestamp': format_timestamp(message.timestamp)
             }
         )
     
@@ -95,14 +199,82 @@ class ChatConsumer(AsyncWebsocketConsumer):
         This sends the message to the client (browser).
         """
         await self.send(text_data=json.dumps({
+            'type': 'message',
+            'message_id': event['message_id'],
+            'provisional_id': event['provisional_id'],
             'message': event['message'],
             'sender_username': event['sender_username'],
             'sender_id': event['sender_id'],
             'timestamp': event['timestamp']
         }))
     
+    async def send_typing(self, active):
+        """
+        Tell the room this user is (or stopped) typing.
+        
+        Clients report every keystroke; the throttle lets through at most
+        one "typing" per TYPING_INTERVAL and a "stopped" only after a
+        "typing", so bursts never reach the channel layer.
+        """
+        if not (self.typing.typing() if active else self.typing.stopped()):
+            return
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_typing',
+                'user_id': self.user.id,
+                'username': self.user.username,
+                'active': active
+            }
+        )
+    
+    async def chat_typing(self, event):
+        """Forward the other participant's typing state to the client"""
+        if event['user_id'] == self.user.id:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'typing',
+            'user_id': event['user_id'],
+            'username': event['username'],
+            'active': event['active']
+        }))
+    
+    async def send_history(self, before):
+        """
+        Send the page of messages older than `before` (a message_id) back to
+        this client only, so it can lazily load history as the user scrolls up.
+        """
+        try:
+            before = int(before)
+        except (TypeError, ValueError):
+            return
+        
+        from .chat import serialize_message
+        
+        messages, has_more = await self.load_history(before)
+        await self.send(text_data=json.dumps({
+            'type': 'history',
+            'messages': [serialize_message(message) for message in messages],
+            'has_more': has_more,
+        }))
+    
+    @database_sync_to_async
+    def load_history(self, before):
+        from .chat import get_history
+        return get_history(self.user.id, self.other_user.id, before=before)
+    
+    @database_sync_to_async
+    def get_peer(self, user_id):
+        """The user on the other end of the chat, or None if there isn't one"""
+        from django.contrib.auth.models import User
+        
+        try:
+            return User.objects.only('id', 'username').filter(id=int(user_id)).first()
+        except ValueError:
+            return None
+    
     @database_sync_to_async
-    def save_message(self, sender, receiver_id, content):
+    def save_message(self, content):
         """
         Save the message to the database.
         We use @database_sync_to_async because Django ORM is synchronous
@@ -110,13 +282,205 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         We import models here (not at top) to avoid Django setup issues.
         """
-        from django.contrib.auth.models import User
+        from .chat import save_message
+        return save_message(self.user.id, self.other_user.id, content)
+    
+    def queue_message(self, content):
+        """
+        Hand a message to the write-behind writer without touching the DB.
+        
+        It has no message_id yet; its client_id is broadcast as a
+        provisional id and becomes the row's unique key once saved.
+        """
+        from django.utils import timezone
+        from .chat_writer import get_writer
         from .models import Message
         
-        receiver = User.objects.get(id=receiver_id)
-        message = Message.objects.create(
-            sender=sender,
-            receiver=receiver,
-            content=content
+        message = Message(
+            sender_id=self.user.id,
+            receiver_id=self.other_user.id,
+            content=content,
+            client_id=uuid.uuid4().hex,
+            timestamp=timezone.now()
         )
+        # The writer thread fills in message_id later; broadcast a copy
+        # so the event we send doesn't depend on how fast that happens
+        get_writer().submit(Message(
+            sender_id=message.sender_id,
+            receiver_id=message.receiver_id,
+            content=message.content,
+            client_id=message.client_id
+        ))
         return message
+
+
+class PresenceConsumer(MetricsConsumerMixin, PresenceMixin, AsyncWebsocketConsumer):
+    """
+    Live online/offline status for the people listed on a page.
+    
+    Connecting marks the user online. The client then sends
+    {"type": "watch", "user_ids": [...]} with the users it shows; it gets a
+    snapshot of who among them is online and afterwards a "presence" event
+    whenever one of them comes or goes.
+    """
+    
+    async def connect(self):
+        self.user = self.scope['user']
+        self.watching = set()
+        
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        await self.accept()
+        await self.join_presence()
+    
+    async def disconnect(self, close_code):
+        if not self.user.is_authenticated:
+            return
+        
+        for user_id in self.watching:
+            await self.channel_layer.group_discard(presence_group(user_id), self.channel_name)
+        await self.leave_presence()
+    
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        
+        if data.get('type') == 'watch':
+            await self.watch(data.get('user_ids') or [])
+        elif data.get('type') == 'heartbeat':
+            await self.heartbeat()
+    
+    async def watch(self, user_ids):
+        """Replace the set of watched users and send a snapshot"""
+        try:
+            wanted = {int(user_id) for user_id in user_ids[:MAX_WATCHED_USERS]}
+        except (TypeError, ValueError):
+            return
+        
+        for user_id in self.watching - wanted:
+            await self.channel_layer.group_discard(presence_group(user_id), self.channel_name)
+        for user_id in wanted - self.watching:
+            await self.channel_layer.group_add(presence_group(user_id), self.channel_name)
+        self.watching = wanted
+        
+        # This process's view only; see the limit noted in polls/presence.py
+        await self.send(text_data=json.dumps({
+            'type': 'presence_snapshot',
+            'online': sorted(registry.online(wanted))
+        }))
+
+
+class CoalescingMixin:
+    """
+    Buffers events for a short window and sends them as one frame.
+    
+    Call coalesce_event() from a handler; once `coalesce_interval` seconds
+    have passed since the first buffered event, send_batch() gets all of
+    them. So a burst costs one frame, and frames are at least that far apart.
+    """
+    
+    coalesce_interval = 0.5
+    
+    def coalesce_event(self, event):
+        self.pending.append(event)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+    
+    def cancel_flush(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+    
+    async def flush_later(self):
+        await asyncio.sleep(self.coalesce_interval)
+        events, self.pending = self.pending, []
+        self.flush_task = None
+        await self.send_batch(events)
+
+
+class NotificationConsumer(MetricsConsumerMixin, CoalescingMixin, AsyncWebsocketConsumer):
+    """
+    One per logged-in page: pushes unread bumps, friend requests and RSVPs.
+    
+    Events arrive one by one in notify() (see notifications.py) and are
+    held for NOTIFY_COALESCE_INTERVAL, so a burst reaches the browser as a
+    single merged "notifications" frame.
+    """
+    
+    coalesce_interval = NOTIFY_COALESCE_INTERVAL
+    
+    async def connect(self):
+        self.user = self.scope['user']
+        self.pending = []
+        self.flush_task = None
+        
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        self.group_name = notification_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+    
+    async def disconnect(self, close_code):
+        if not self.user.is_authenticated:
+            return
+        
+        self.cancel_flush()
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+    
+    async def notify(self, event):
+        self.coalesce_event(event)
+    
+    async def send_batch(self, events):
+        await self.send(text_data=json.dumps(coalesce(events)))
+
+
+class FeedConsumer(MetricsConsumerMixin, CoalescingMixin, AsyncWebsocketConsumer):
+    """
+    Pushes new posts to an open feed page.
+    
+    Subscribes to the authors and groups the user's timeline is built from
+    (see live_feed.py) and sends {"type": "posts", "posts": [...]}, newest
+    first, at most once per FEED_PUSH_INTERVAL.
+    """
+    
+    coalesce_interval = FEED_PUSH_INTERVAL
+    
+    async def connect(self):
+        self.user = self.scope['user']
+        self.pending = []
+        self.flush_task = None
+        self.groups_joined = []
+        
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        for group in await self.get_subscriptions():
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.groups_joined.append(group)
+        await self.accept()
+    
+    async def disconnect(self, close_code):
+        self.cancel_flush()
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+    
+    @database_sync_to_async
+    def get_subscriptions(self):
+        from .live_feed import subscriptions
+        return subscriptions(self.user.id)
+    
+    async def feed_post(self, event):
+        self.coalesce_event(event['post'])
+    
+    async def send_batch(self, posts):
+        # A post can reach us through both its author and its group
+        unique = {post['post_id']: post for post in posts}
+        newest_first = sorted(unique.values(), key=lambda post: post['post_id'], reverse=True)
+        await self.send(text_data=json.dumps({
+            'type': 'posts',
+            'posts': newest_first
+        }))
@@ -0,0 +1,234 @@
+"""
+Event Listings and Calendar Export
+
+Listings (the events page and /polls/events/api/):
+- A date window, from `start` (default: now, so only upcoming events) up
+  to `end` if given. Both take a date (2026-10-18, the whole day in the
+  site's time zone) or an ISO datetime
+- Any number of `category` filters
+- Paged with a keyset cursor over (date, event_id), like the feed (see
+  polls/feed.py), so every page is one range scan on event_date_idx or
+  event_category_date_idx however far in it is
+
+Calendar export:
+Each user has a secret calendar URL (signed, so calendar apps can
+subscribe without a session) serving their hosted events and those
+they've RSVP'd going or maybe to as iCalendar (RFC 5545). The response is
+an async generator that reads ICAL_CHUNK_SIZE events per query, so under
+daphne a large calendar streams out chunk by chunk instead of being built
+in memory.
+"""
+
+import base64
+import binascii
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.db.models import OuterRef, Q, Subquery
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .feed import InvalidCursor
+from .models import Event, EventRSVP
+
+EVENT_PAGE_SIZE = 20
+EVENT_MAX_PAGE_SIZE = 100
+
+CATEGORIES = dict(Event.CATEGORY_CHOICES)
+
+ICAL_CHUNK_SIZE = 500
+
+# Lines longer than this many octets are folded (RFC 5545 3.1)
+ICAL_LINE_OCTETS = 75
+
+CALENDAR_SALT = 'polls.calendar'
+
+
+class InvalidEventFilter(ValueError):
+    """Raised for a start, end or category we can't filter by"""
+
+
+def parse_moment(value, end=False):
+    """
+    An aware datetime for a date or ISO datetime from the query string. A
+    bare date means the start of that day, or with end=True the start of
+    the next, so an end date includes the whole day.
+    """
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        raise InvalidEventFilter(value)
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    if moment is None:
+        raise InvalidEventFilter(value)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def event_filters(params):
+    """
+    (start, end, categories) from a QueryDict; start defaults to now and
+    end to None (no limit). Raises InvalidEventFilter.
+    """
+    start = parse_moment(params['start']) if params.get('start') else timezone.now()
+    end = parse_moment(params['end'], end=True) if params.get('end') else None
+    categories = [category for category in params.getlist('category') if category]
+    for category in categories:
+        if category not in CATEGORIES:
+            raise InvalidEventFilter(category)
+    return start, end, categories
+
+
+def encode_cursor(event):
+    raw = f'{event.date.isoformat()}|{event.event_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        date, event_id = raw.rsplit('|', 1)
+        date = parse_datetime(date)
+        event_id = int(event_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if date is None:
+        raise InvalidCursor(cursor)
+    return date, event_id
+
+
+def get_events_page(start, end=None, categories=(), cursor=None, limit=EVENT_PAGE_SIZE):
+    """
+    (events, next_cursor) for one page of the window, soonest first, with
+    hosts and their profiles loaded. Raises InvalidCursor.
+    """
+    events = Event.objects.select_related('hosted_by_user__profile').filter(date__gte=start)
+    if end is not None:
+        events = events.filter(date__lt=end)
+    if categories:
+        events = events.filter(category__in=categories)
+    if cursor:
+        date, event_id = decode_cursor(cursor)
+        # date__gte is redundant logically but keeps it an index range scan
+        events = events.filter(Q(date__gte=date) & (Q(date__gt=date) | Q(event_id__gt=event_id)))
+    page = list(events.order_by('date', 'event_id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def event_url(event):
+    """Link to the event on the events page, from its day on so it's listed"""
+    return f"{reverse('events')}?start={timezone.localdate(event.date).isoformat()}#event-{event.event_id}"
+
+
+def serialize_event(event, user_rsvp=None):
+    """JSON shape of an event in /polls/events/api/"""
+    host = event.hosted_by_user
+    return {
+        'event_id': event.event_id,
+        'title': event.title,
+        'description': event.description,
+        'location': event.location,
+        'category': event.category,
+        'date': event.date.isoformat(),
+        'host': {'id': host.id, 'username': host.username} if host else None,
+        'going_count': event.going_count,
+        'user_rsvp': user_rsvp,
+        'url': event_url(event),
+    }
+
+
+def calendar_token(user):
+    return signing.Signer(salt=CALENDAR_SALT).sign(str(user.id))
+
+
+def calendar_user_id(token):
+    """The user id a calendar token was issued for, or None if it's forged"""
+    try:
+        return int(signing.Signer(salt=CALENDAR_SALT).unsign(token))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def _escape(text):
+    return (
+        text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+    )
+
+
+def _fold(line):
+    """The content line, folded into CRLF-terminated lines of at most 75 octets"""
+    folded = []
+    current, size = [], 0
+    for char in line:
+        octets = len(char.encode())
+        # Continuation lines begin with a space, which counts
+        if size + octets > ICAL_LINE_OCTETS:
+            folded.append(''.join(current))
+            current, size = [' '], 1
+        current.append(char)
+        size += octets
+    folded.append(''.join(current))
+    return ''.join(part + '\r\n' for part in folded)
+
+
+def _ical_time(moment):
+    return moment.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def ical_event(event, base_url, domain, stamp):
+    """One VEVENT; `event` carries the user's rsvp_status (None if hosting)"""
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:event-{event.event_id}@{domain}',
+        f'DTSTAMP:{stamp}',
+        f'DTSTART:{_ical_time(event.date)}',
+        f'SUMMARY:{_escape(event.title)}',
+        f'DESCRIPTION:{_escape(event.description)}',
+        f'CATEGORIES:{_escape(CATEGORIES.get(event.category, event.category))}',
+        f'URL:{base_url}{event_url(event)}',
+        f"STATUS:{'TENTATIVE' if event.rsvp_status == 'maybe' else 'CONFIRMED'}",
+    ]
+    if event.location:
+        lines.append(f'LOCATION:{_escape(event.location)}')
+    lines.append('END:VEVENT')
+    return ''.join(_fold(line) for line in lines)
+
+
+def calendar_events(user_id, after=0, limit=ICAL_CHUNK_SIZE):
+    """The next `limit` of the user's calendar events by event_id"""
+    rsvps = EventRSVP.objects.filter(user_id=user_id, rsvp_status__in=['going', 'maybe'])
+    return list(
+        Event.objects
+        .filter(Q(hosted_by_user_id=user_id) | Q(event_id__in=rsvps.values('event_id')), event_id__gt=after)
+        .annotate(rsvp_status=Subquery(rsvps.filter(event=OuterRef('pk')).values('rsvp_status')[:1]))
+        .only('event_id', 'title', 'description', 'location', 'category', 'date')
+        .order_by('event_id')[:limit]
+    )
+
+
+async def stream_calendar(user_id, base_url, domain):
+    """The user's calendar as an async iterator of text chunks"""
+    stamp = _ical_time(timezone.now())
+    yield ''.join(_fold(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:-//{domain}//Campus Events//EN',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:My Campus Events',
+    ])
+    after = 0
+    while True:
+        events = await sync_to_async(calendar_events)(user_id, after, ICAL_CHUNK_SIZE)
+        if not events:
+            break
+        yield ''.join(ical_event(event, base_url, domain, stamp) for event in events)
+        after = events[-1].event_id
+    yield _fold('END:VCALENDAR')
@@ -0,0 +1,77 @@
+"""
+Feed Pagination
+
+The feed is paged with a keyset cursor over (timestamp, post_id) instead of
+OFFSET, so fetching page 1000 costs the same index range scan as page 1.
+The cursor handed to the browser is an opaque base64 string of the last
+post's timestamp and id. Pages themselves come from polls/timeline.py.
+"""
+
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.timesince import timesince
+
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we didn't issue"""
+
+
+def encode_cursor(post):
+    raw = f'{post.timestamp.isoformat()}|{post.post_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        timestamp, post_id = raw.rsplit('|', 1)
+        timestamp = parse_datetime(timestamp)
+        post_id = int(post_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if timestamp is None:
+        raise InvalidCursor(cursor)
+    return timestamp, post_id
+
+
+def after_cursor(cursor):
+    """
+    Filter for rows strictly after the cursor in (-timestamp, -post_id) order.
+
+    Works for any model with timestamp and post_id columns (Post and
+    TimelineEntry). The leading timestamp__lte bound is redundant logically
+    but lets SQLite turn the lookup into an index range scan.
+    """
+    timestamp, post_id = decode_cursor(cursor)
+    return Q(timestamp__lte=timestamp) & (
+        Q(timestamp__lt=timestamp) | Q(post_id__lt=post_id)
+    )
+
+
+def serialize_post(post):
+    """JSON shape of a post as consumed by feed.js"""
+    from .thumbnails import thumbnail_url
+
+    author = post.created_by
+    profile = getattr(author, 'profile', None)
+    return {
+        'post_id': post.post_id,
+        'content': post.content,
+        'timestamp': post.timestamp.isoformat(),
+        'timesince': timesince(post.timestamp, timezone.now()),
+        'author': {
+            'id': author.id,
+            'username': author.username,
+            # Avatars render at 40px; 96px covers 2x screens
+            'profile_picture': thumbnail_url(profile, 96),
+            'profile_picture_webp': thumbnail_url(profile, 96, 'webp'),
+        },
+    }
@@ -0,0 +1,293 @@
+"""
+Friend Graph
+
+Mutual friends and "people you may know" (friends of friends, most mutual
+friends first), answered from memory instead of self-joins on Friendship.
+
+How it works:
+1. Each process keeps a FriendGraph: for every user, the ids of the users
+   they've accepted as friends, as a sorted int64 NumPy array. Accepting a
+   request writes a row each way, so these are the directed accepted rows,
+   the same set timeline.friend_ids() reads
+2. Mutual friends of a and b: the intersection of their two arrays
+3. Suggestions for a: every friend's array concatenated, counted with
+   np.unique (how many of a's friends know each candidate = mutual
+   friends), less a, a's friends and anyone a already has a request with
+Arrays are replaced rather than modified, so a reader holding one is never
+affected by a concurrent edit.
+
+Keeping it current:
+- Saving or deleting a Friendship (the friend request views) updates this
+  process's graph on commit (signals in polls/signals.py)
+- Other processes pick changes up from Friendship.updated_at, re-reading
+  rows changed since their last sync at most once per
+  FRIEND_GRAPH_SYNC_INTERVAL seconds, as the matching index does
+- Deleted rows (deleting a user deletes theirs) are dropped here by
+  signal, but can't be seen by other processes, which keep those edges
+  until they restart. Only deleted users' rows are ever deleted, and
+  suggested users that no longer exist are skipped when they're loaded
+The first use in a process loads every accepted row; sweapp/asgi.py does it
+at server startup.
+
+`manage.py recompute_friend_suggestions` stores each user's top
+suggestions in FriendSuggestion (nightly); suggestions_for() reads those,
+re-checking them against the graph, and computes them live for users
+with none stored yet.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import FriendSuggestion, Friendship
+
+FRIEND_SUGGESTION_LIMIT = 20
+FRIEND_SUGGESTION_MAX_LIMIT = 100
+
+# Users whose stored suggestions are replaced per transaction
+FRIEND_SUGGESTION_BATCH_USERS = 1000
+
+# Seconds between checks for friendships changed in other processes
+FRIEND_GRAPH_SYNC_INTERVAL = 5.0
+
+# Re-read changes this far behind the newest one seen (see matching.py)
+FRIEND_GRAPH_SYNC_OVERLAP = timedelta(seconds=30)
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+class Suggestion:
+    __slots__ = ('user', 'mutual_friends')
+
+    def __init__(self, user, mutual_friends):
+        self.user = user
+        self.mutual_friends = mutual_friends
+
+    def as_dict(self):
+        profile = getattr(self.user, 'profile', None)
+        return {
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'name': self.user.get_full_name(),
+            'major': profile.major if profile else '',
+            'year': profile.year if profile else '',
+            'mutual_friends': self.mutual_friends,
+        }
+
+
+class FriendGraph:
+    """
+    Accepted friendships as sorted id arrays (see the module docstring).
+    Thread-safe: views run on daphne's thread pool.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.adjacency = {}
+        self.loaded = False
+        self.synced_to = None
+        self.checked_at = 0.0
+
+    def add(self, user_id, friend_id):
+        with self.lock:
+            friends = self.adjacency.get(user_id, _EMPTY)
+            at = np.searchsorted(friends, friend_id)
+            if at == len(friends) or friends[at] != friend_id:
+                self.adjacency[user_id] = np.insert(friends, at, friend_id)
+
+    def discard(self, user_id, friend_id):
+        with self.lock:
+            friends = self.adjacency.get(user_id, _EMPTY)
+            at = np.searchsorted(friends, friend_id)
+            if at < len(friends) and friends[at] == friend_id:
+                self.adjacency[user_id] = np.delete(friends, at)
+
+    def apply(self, user_id, friend_id, status, updated_at=None):
+        """Apply one Friendship row as saved"""
+        with self.lock:
+            if status == 'accepted':
+                self.add(user_id, friend_id)
+            else:
+                self.discard(user_id, friend_id)
+            if updated_at is not None and (self.synced_to is None or updated_at > self.synced_to):
+                self.synced_to = updated_at
+
+    def sync(self):
+        """Load every accepted friendship the first time, then only changes"""
+        with self.lock:
+            now = time.monotonic()
+            if self.loaded and now - self.checked_at < FRIEND_GRAPH_SYNC_INTERVAL:
+                return
+            rows = Friendship.objects.order_by()
+            if not self.loaded:
+                self.load(rows.filter(status='accepted'))
+            else:
+                if self.synced_to is not None:
+                    rows = rows.filter(updated_at__gte=self.synced_to - FRIEND_GRAPH_SYNC_OVERLAP)
+                for values in rows.values_list('user_id', 'friend_id', 'status', 'updated_at'):
+                    self.apply(*values)
+            self.loaded = True
+            self.checked_at = now
+
+    def load(self, rows):
+        """Build every array at once from (user_id, friend_id) pairs, sorted"""
+        pairs = np.array(list(rows.values_list('user_id', 'friend_id').iterator(chunk_size=10000)), dtype=np.int64)
+        latest = rows.order_by('-updated_at').values_list('updated_at', flat=True).first()
+        adjacency = {}
+        if len(pairs):
+            pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+            users, starts = np.unique(pairs[:, 0], return_index=True)
+            for user_id, friends in zip(users.tolist(), np.split(pairs[:, 1], starts[1:])):
+                adjacency[user_id] = friends
+        self.adjacency = adjacency
+        self.synced_to = latest
+
+    def friends(self, user_id):
+        """Sorted ids of the user's friends; don't modify the array"""
+        with self.lock:
+            return self.adjacency.get(user_id, _EMPTY)
+
+    def friend_count(self, user_id):
+        return len(self.friends(user_id))
+
+    def mutual_count(self, user_id, other_id):
+        return len(np.intersect1d(self.friends(user_id), self.friends(other_id), assume_unique=True))
+
+    def mutual_counts(self, user_id, other_ids):
+        """{other_id: number of friends in common with user_id}"""
+        return {other_id: self.mutual_count(user_id, other_id) for other_id in other_ids}
+
+    def suggestions(self, user_id, limit=FRIEND_SUGGESTION_LIMIT, exclude=()):
+        """[(user_id, mutual friends)] most mutual friends first"""
+        with self.lock:
+            friends = self.friends(user_id)
+            if not len(friends):
+                return []
+            reachable = [self.adjacency.get(friend_id, _EMPTY) for friend_id in friends.tolist()]
+        candidates, counts = np.unique(np.concatenate(reachable), return_counts=True)
+        skip = np.concatenate([friends, np.array([user_id, *exclude], dtype=np.int64)])
+        keep = ~np.isin(candidates, skip)
+        candidates, counts = candidates[keep], counts[keep]
+        if len(candidates) > limit:
+            best = np.argpartition(-counts, limit - 1)[:limit]
+            candidates, counts = candidates[best], counts[best]
+        # Most mutual friends first; ties by user id so results are stable
+        order = np.lexsort((candidates, -counts))
+        return [(int(candidates[i]), int(counts[i])) for i in order]
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """This process's graph, synced"""
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = FriendGraph()
+        graph = _graph
+    graph.sync()
+    return graph
+
+
+def reset_graph():
+    """Forget this process's graph; the next use reloads every friendship"""
+    global _graph
+    with _graph_lock:
+        _graph = None
+
+
+def apply_friendship(friendship):
+    """Apply one saved Friendship to this process's graph, if it's loaded"""
+    graph = _graph
+    if graph is not None and graph.loaded:
+        graph.apply(friendship.user_id, friendship.friend_id, friendship.status, friendship.updated_at)
+
+
+def remove_friendship(friendship):
+    graph = _graph
+    if graph is not None:
+        graph.discard(friendship.user_id, friendship.friend_id)
+
+
+def connected_user_ids(user_id):
+    """Everyone the user has a Friendship row with, in either direction and any status"""
+    pairs = Friendship.objects.filter(Q(user_id=user_id) | Q(friend_id=user_id)).values_list('user_id', 'friend_id')
+    return {other for pair in pairs for other in pair if other != user_id}
+
+
+def suggestions_for(user, limit=FRIEND_SUGGESTION_LIMIT):
+    """
+    [Suggestion] for the user, with the suggested users (and profiles)
+    loaded. Stored suggestions are used if there are any, less anyone the
+    user has since sent, received or accepted a request from, with mutual
+    counts as of now; if none are left they're computed from the graph.
+    """
+    graph = get_graph()
+    connected = connected_user_ids(user.id)
+    stored = (
+        FriendSuggestion.objects
+        .filter(user=user)
+        .exclude(suggested_id__in=connected)
+        .select_related('suggested__profile')
+        .order_by('-mutual_friends', 'suggested_id')[:limit]
+    )
+    # Friends may have come and gone since; keep only those still related
+    suggestions = [
+        Suggestion(row.suggested, mutual)
+        for row in stored
+        if (mutual := graph.mutual_count(user.id, row.suggested_id))
+    ]
+    if suggestions:
+        suggestions.sort(key=lambda suggestion: (-suggestion.mutual_friends, suggestion.user.id))
+        return suggestions
+
+    found = graph.suggestions(user.id, limit, exclude=connected)
+    users = User.objects.select_related('profile').in_bulk([user_id for user_id, _ in found]) if found else {}
+    return [Suggestion(users[user_id], mutual) for user_id, mutual in found if user_id in users]
+
+
+def recompute_suggestions(limit=FRIEND_SUGGESTION_LIMIT, batch_size=FRIEND_SUGGESTION_BATCH_USERS):
+    """
+    Replace every user's stored suggestions with their current top `limit`,
+    from a freshly loaded graph. Returns (users, suggestions stored).
+    """
+    graph = FriendGraph()
+    graph.sync()
+    # Pending and rejected requests, either way; accepted ones are the graph
+    requested = defaultdict(set)
+    for user_id, friend_id in Friendship.objects.exclude(status='accepted').values_list('user_id', 'friend_id').iterator():
+        requested[user_id].add(friend_id)
+        requested[friend_id].add(user_id)
+
+    using = router.db_for_write(FriendSuggestion)
+    connection = connections[using]
+    # Plain tuples: for a million rows bulk_create spends longer building
+    # model instances than SQLite spends inserting them
+    insert = (
+        f'INSERT INTO {FriendSuggestion._meta.db_table} (user_id, suggested_id, mutual_friends, computed_at) '
+        'VALUES (%s, %s, %s, %s)'
+    )
+    computed_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    stored = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        rows = [
+            (user_id, suggested_id, mutual, computed_at)
+            for user_id in batch
+            for suggested_id, mutual in graph.suggestions(user_id, limit, exclude=requested.get(user_id, ()))
+        ]
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            FriendSuggestion.objects.using(using).filter(user_id__in=batch).delete()
+            cursor.executemany(insert, rows)
+        stored += len(rows)
+    return len(user_ids), stored
@@ -0,0 +1,350 @@
+"""
+SQLite Channel Layer
+
+A channel layer that lets several daphne processes on the same machine talk
+to each other without Redis. Every process opens the same SQLite file (in
+WAL mode) and uses it as a shared queue:
+
+1. send() / group_send() insert rows into the `messages` table
+2. Each process polls for rows addressed to its own channels, deletes them
+   and hands them to the waiting consumer
+3. Group membership lives in the `groups` table, so a group_send from one
+   process reaches consumers connected to any other process
+
+Supports the "groups" and "flush" extensions, per-message expiry, group
+expiry and per-channel capacity, like the in-memory layer it replaces.
+
+Cost: the poller in step 2 is one indexed DELETE on the executor thread,
+every min_poll_interval (2ms) while messages are arriving, backing off to
+poll_interval (50ms, ~20 queries a second) when idle. It starts with the
+first receive() in a process and stops once none of the process's
+channels has been received from for `expiry` seconds, so a process with
+no connected consumers doesn't poll at all.
+
+Configure it in settings.CHANNEL_LAYERS:
+
+    'BACKEND': 'polls.layers.SQLiteChannelLayer',
+    'CONFIG': {'path': BASE_DIR / 'channels.sqlite3'},
+"""
+
+import asyncio
+import concurrent.futures
+import random
+import sqlite3
+import string
+import threading
+import time
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    body BLOB NOT NULL,
+    expiry REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_channel_idx ON messages (channel, id);
+CREATE INDEX IF NOT EXISTS messages_expiry_idx ON messages (expiry);
+CREATE TABLE IF NOT EXISTS groups (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expiry REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+);
+CREATE INDEX IF NOT EXISTS groups_channel_idx ON groups (channel);
+"""
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    Channel layer backed by a SQLite file shared between local processes.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path='channels.sqlite3',
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.05,
+        min_poll_interval=0.002,
+        cleanup_interval=1.0,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.min_poll_interval = min_poll_interval
+        self.cleanup_interval = cleanup_interval
+
+        # Unique per process; every channel this process hands out starts
+        # with it so the poller can fetch all of them with one range query
+        self.client_prefix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+
+        # SQLite connections are bound to a thread, so all database work
+        # runs on one dedicated thread per layer
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+        self._local = threading.local()
+
+        self._receive_buffers = {}
+        self._waiting = {}
+        self._last_receive = {}
+        self._poller = None
+        self._poller_loop = None
+        self._last_cleanup = 0.0
+
+    # Database helpers (run on the executor thread)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Messages are ephemeral; losing the last few on power loss is fine
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _insert(self, conn, channel, body, now):
+        """Queue one message unless the channel is at capacity"""
+        cursor = conn.execute(
+            'INSERT INTO messages (channel, body, expiry) '
+            'SELECT ?, ?, ? WHERE (SELECT COUNT(*) FROM messages WHERE channel = ? AND expiry > ?) < ?',
+            (channel, body, now + self.expiry, channel, now, self.get_capacity(channel)),
+        )
+        return cursor.rowcount == 1
+
+    def _send_sync(self, channel, body):
+        conn = self._connection()
+        return self._insert(conn, channel, body, time.time())
+
+    def _group_send_sync(self, group, body):
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            channels = [
+                row[0] for row in conn.execute(
+                    'SELECT channel FROM groups WHERE group_name = ? AND expiry > ?', (group, now)
+                )
+            ]
+            for channel in channels:
+                # A full channel just misses this message, like in-memory
+                self._insert(conn, channel, body, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _pop_sync(self, low, high, limit):
+        """Atomically claim the oldest live messages whose channel is in [low, high)"""
+        conn = self._connection()
+        rows = conn.execute(
+            'DELETE FROM messages WHERE id IN ('
+            '  SELECT id FROM messages WHERE channel >= ? AND channel < ? ORDER BY id LIMIT ?'
+            ') RETURNING id, channel, body, expiry',
+            (low, high, limit),
+        ).fetchall()
+        now = time.time()
+        # RETURNING order isn't guaranteed, so restore send order by id
+        return [(channel, body) for _, channel, body, expiry in sorted(rows) if expiry > now]
+
+    def _cleanup_sync(self):
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # A channel that let a message expire has gone away; drop it
+            # from its groups so group_send stops filling it up
+            conn.execute(
+                'DELETE FROM groups WHERE channel IN (SELECT DISTINCT channel FROM messages WHERE expiry <= ?)',
+                (now,),
+            )
+            conn.execute('DELETE FROM messages WHERE expiry <= ?', (now,))
+            conn.execute('DELETE FROM groups WHERE expiry <= ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _group_add_sync(self, group, channel):
+        self._connection().execute(
+            'INSERT INTO groups (group_name, channel, expiry) VALUES (?, ?, ?) '
+            'ON CONFLICT (group_name, channel) DO UPDATE SET expiry = excluded.expiry',
+            (group, channel, time.time() + self.group_expiry),
+        )
+
+    def _group_discard_sync(self, group, channel):
+        self._connection().execute(
+            'DELETE FROM groups WHERE group_name = ? AND channel = ?', (group, channel)
+        )
+
+    def _flush_sync(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM messages')
+        conn.execute('DELETE FROM groups')
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """
+        Send a message onto a (general or specific) channel.
+        """
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+
+        body = msgpack.packb(message, use_bin_type=True)
+        if not await self._run(self._send_sync, channel, body):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        """
+        Receive the first message that arrives on the channel.
+
+        Channels created by this process are served from a local buffer that
+        one background poller fills; anything else is polled directly.
+        """
+        self.require_valid_channel_name(channel)
+
+        if channel.startswith(self._local_prefix()):
+            self._ensure_poller()
+            queue = self._buffer(channel)
+            self._waiting[channel] = self._waiting.get(channel, 0) + 1
+            try:
+                return await queue.get()
+            finally:
+                self._waiting[channel] -= 1
+                if not self._waiting[channel]:
+                    del self._waiting[channel]
+                self._last_receive[channel] = time.monotonic()
+
+        interval = self.min_poll_interval
+        while True:
+            rows = await self._run(self._pop_sync, channel, channel + '\0', 1)
+            if rows:
+                return msgpack.unpackb(rows[0][1], raw=False)
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.poll_interval)
+
+    async def new_channel(self, prefix='specific'):
+        """
+        Returns a new channel name that can be used by something in our
+        process as a specific channel.
+        """
+        local = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{prefix}.{self.client_prefix}!{local}'
+
+    def _local_prefix(self):
+        return f'specific.{self.client_prefix}!'
+
+    def _buffer(self, channel):
+        queue = self._receive_buffers.get(channel)
+        if queue is None:
+            queue = self._receive_buffers[channel] = asyncio.Queue()
+            self._last_receive[channel] = time.monotonic()
+        return queue
+
+    def _drop_idle_buffers(self):
+        """
+        Forget buffers nobody has received from for longer than the message
+        expiry. Those belong to consumers that have disconnected.
+        """
+        cutoff = time.monotonic() - self.expiry
+        for channel in list(self._receive_buffers):
+            if channel not in self._waiting and self._last_receive.get(channel, 0) < cutoff:
+                self._receive_buffers.pop(channel, None)
+                self._last_receive.pop(channel, None)
+
+    # Background poller
+
+    def _ensure_poller(self):
+        loop = asyncio.get_running_loop()
+        if self._poller_loop is not loop:
+            # First receive, or the previous event loop has gone away (tests)
+            self._receive_buffers = {}
+            self._waiting = {}
+            self._last_receive = {}
+            self._poller_loop = loop
+            self._poller = None
+        # Not started yet, or stopped after its channels went idle
+        if self._poller is None or self._poller.done():
+            self._poller = loop.create_task(self._poll())
+
+    async def _poll(self):
+        """
+        Move messages for this process's channels into the local buffers.
+
+        Polls quickly while messages are flowing and backs off to
+        poll_interval when idle. Returns once there are no local buffers
+        left, i.e. every consumer has gone; the next receive() restarts it.
+        """
+        low = self._local_prefix()
+        high = low[:-1] + chr(ord('!') + 1)
+        interval = self.min_poll_interval
+        while True:
+            rows = await self._run(self._pop_sync, low, high, 500)
+            for channel, body in rows:
+                # Buffer even if nobody is waiting right now: the consumer
+                # may be between two receive() calls
+                self._buffer(channel).put_nowait(msgpack.unpackb(body, raw=False))
+
+            now = time.time()
+            if now - self._last_cleanup > self.cleanup_interval:
+                self._last_cleanup = now
+                self._drop_idle_buffers()
+                await self._run(self._cleanup_sync)
+                if not self._receive_buffers:
+                    return
+
+            if rows:
+                interval = self.min_poll_interval
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, self.poll_interval)
+
+    # Flush extension
+
+    async def flush(self):
+        await self._run(self._flush_sync)
+        self._receive_buffers = {}
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        """
+        Adds the channel name to a group.
+        """
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_add_sync, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        await self._run(self._group_discard_sync, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        body = msgpack.packb(message, use_bin_type=True)
+        await self._run(self._group_send_sync, group, body)
@@ -0,0 +1,52 @@
+"""
+Live Feed
+
+Pushes new posts to people who have the feed open, so they appear without a
+reload.
+
+How it works:
+1. A FeedConsumer joins one channel layer group per source of posts its
+   user reads: feed_author_<id> for themselves and each accepted friend,
+   and feed_group_<id> for each of their groups (the same audience
+   publish() fans posts out to)
+2. broadcast_post() sends each new post once, to its author's group and
+   its group's group, after the transaction that created it commits
+3. The consumer buffers posts and sends the browser at most one frame per
+   FEED_PUSH_INTERVAL, however many posts arrived meanwhile
+
+A connection's subscriptions are fixed when it connects; friends made or
+groups joined afterwards show up on the next page load.
+"""
+
+from .feed import serialize_post
+from .notifications import group_send_on_commit
+
+# At most one frame of new posts per client this often (seconds)
+FEED_PUSH_INTERVAL = 0.25
+
+
+def author_group(user_id):
+    return f'feed_author_{user_id}'
+
+
+def post_group(group_id):
+    return f'feed_group_{group_id}'
+
+
+def subscriptions(user_id):
+    """Every channel layer group whose posts belong in this user's feed"""
+    # Imported here so consumers.py can import this module before apps load
+    from .timeline import friend_ids, group_ids
+
+    groups = [author_group(user_id)]
+    groups.extend(author_group(friend_id) for friend_id in friend_ids(user_id))
+    groups.extend(post_group(group_id) for group_id in group_ids(user_id))
+    return groups
+
+
+def broadcast_post(post):
+    """Send a freshly created post to everyone watching its author or group"""
+    event = {'type': 'feed_post', 'post': serialize_post(post)}
+    group_send_on_commit(author_group(post.created_by_id), event)
+    if post.group_id:
+        group_send_on_commit(post_group(post.group_id), event)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import UserProfile
+from polls.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Generate avatar thumbnails for profiles whose picture has none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate thumbnails for every profile picture')
+
+    def handle(self, *args, **options):
+        profiles = UserProfile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        if not options['force']:
+            profiles = profiles.filter(thumbnail_key='')
+
+        done = failed = 0
+        for profile_id in profiles.values_list('pk', flat=True).iterator():
+            try:
+                generate_thumbnails(profile_id, force=options['force'])
+                done += 1
+            except Exception as e:
+                # A missing or corrupt upload shouldn't stop the rest
+                failed += 1
+                self.stderr.write(f'Profile {profile_id}: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'Generated thumbnails for {done} profiles ({failed} failed)'))
@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from polls.timeline import TIMELINE_BACKFILL_SIZE, rebuild_timeline, trim_timeline
+
+
+class Command(BaseCommand):
+    help = 'Backfill (or just trim) the materialized per-user feed timelines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Only process this user id (can be repeated). Defaults to every user.',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=TIMELINE_BACKFILL_SIZE,
+            help='Recent posts to copy from each friend and group.',
+        )
+        parser.add_argument(
+            '--trim-only', action='store_true',
+            help='Skip backfilling and only trim timelines to their maximum length.',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            user_ids = User.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=2000)
+
+        processed = copied = trimmed = 0
+        for user_id in user_ids:
+            if options['trim_only']:
+                trimmed += trim_timeline(user_id)
+            else:
+                copied += rebuild_timeline(user_id, limit=options['limit'])
+            processed += 1
+
+        if options['trim_only']:
+            self.stdout.write(self.style.SUCCESS(f'Trimmed {trimmed} entries across {processed} timelines'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Backfilled {copied} entries across {processed} timelines'))
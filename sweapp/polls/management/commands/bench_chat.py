@@ -0,0 +1,340 @@
+import asyncio
+import base64
+import json
+import os
+import time
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.models import Message, UserProfile
+
+USERNAME_PREFIX = 'bench_ws_'
+
+
+def percentiles(values):
+    """p50/p95/p99/max of a list of seconds, in milliseconds"""
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {
+        'p50': round(pick(0.50), 3),
+        'p95': round(pick(0.95), 3),
+        'p99': round(pick(0.99), 3),
+        'max': round(values[-1] * 1000, 3),
+        'count': len(values),
+    }
+
+
+class InProcessClient:
+    """Drives sweapp.asgi.application directly, as the test suite does"""
+
+    def __init__(self, user, path):
+        from channels.testing import WebsocketCommunicator
+        from sweapp.asgi import application
+
+        self.communicator = WebsocketCommunicator(application, path)
+        self.communicator.scope['user'] = user
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        return connected
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self, timeout):
+        # Raises TimeoutError (and stops the consumer) if nothing arrives
+        return await self.communicator.receive_from(timeout)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class LiveClient:
+    """
+    A real WebSocket to a running daphne, authenticated by session cookie.
+
+    Minimal RFC 6455 client on asyncio streams (text frames, ping/pong,
+    close); autobahn can't be used here because importing daphne has
+    already bound it to Twisted.
+    """
+
+    def __init__(self, base_url, path, session_key):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'wss' else 80)
+        self.ssl = parts.scheme == 'wss'
+        self.path = parts.path.rstrip('/') + path
+        self.session_key = session_key
+        self.frames = asyncio.Queue()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            f'GET {self.path} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.port}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            f'Cookie: {settings.SESSION_COOKIE_NAME}={self.session_key}\r\n'
+            '\r\n'
+        ).encode())
+        response = await self.reader.readuntil(b'\r\n\r\n')
+        if not response.startswith(b'HTTP/1.1 101'):
+            self.writer.close()
+            return False
+        self.reading = asyncio.create_task(self.read_frames())
+        return True
+
+    async def read_frames(self):
+        message = b''
+        try:
+            while True:
+                head = await self.reader.readexactly(2)
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await self.reader.readexactly(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(await self.reader.readexactly(8), 'big')
+                payload = await self.reader.readexactly(length)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    self.write_frame(0xA, payload)
+                elif opcode in (0x0, 0x1):
+                    message += payload
+                    if head[0] & 0x80:
+                        self.frames.put_nowait(message.decode())
+                        message = b''
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        self.frames.put_nowait(None)
+
+    def write_frame(self, opcode, payload):
+        # Client frames must be masked
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, 0x80 | length])
+        elif length < 1 << 16:
+            header = bytes([0x80 | opcode, 0x80 | 126]) + length.to_bytes(2, 'big')
+        else:
+            header = bytes([0x80 | opcode, 0x80 | 127]) + length.to_bytes(8, 'big')
+        repeated = (mask * (length // 4 + 1))[:length]
+        masked = (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+        self.writer.write(header + mask + masked)
+
+    async def send(self, text):
+        self.write_frame(0x1, text.encode())
+        await self.writer.drain()
+
+    async def receive(self, timeout):
+        frame = await asyncio.wait_for(self.frames.get(), timeout)
+        if frame is None:
+            raise ConnectionError('closed by server')
+        return frame
+
+    async def close(self):
+        if not self.writer.is_closing():
+            self.write_frame(0x8, (1000).to_bytes(2, 'big'))
+            await self.writer.drain()
+            self.writer.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test ChatConsumer: connect many users in pairs (one chat_<a>_<b> room per pair), '
+        'exchange messages and report connect latency, round-trip and delivery latency '
+        'percentiles, throughput and DB write rate as JSON. Runs the ASGI application '
+        'in-process by default, or against a live server with --url.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Simulated users (two per room)')
+        parser.add_argument('--messages', type=int, default=10, help='Messages sent by each user')
+        parser.add_argument(
+            '--rate', type=float, default=1.0,
+            help='Messages per second per user; 0 sends as fast as replies come back',
+        )
+        parser.add_argument('--connect-concurrency', type=int, default=100, help='Handshakes in flight at once')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for any one frame')
+        parser.add_argument('--url', help='Base ws:// URL of a running daphne, e.g. ws://127.0.0.1:8000')
+        parser.add_argument('--output', help='Also write the JSON result to this file')
+        parser.add_argument('--keep-users', action='store_true', help="Don't delete the benchmark users afterwards")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['users'] % 2:
+            raise CommandError('--users must be an even number of at least 2')
+        if User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError(f'Users named {USERNAME_PREFIX}* already exist; a previous run was interrupted')
+
+        users = self.create_users(options['users'])
+        sessions = {}
+        try:
+            if options['url']:
+                sessions = self.create_sessions(users)
+                make_client = lambda user, path: LiveClient(options['url'], path, sessions[user.id])
+            else:
+                make_client = InProcessClient
+            first_message = (Message.objects.order_by('-pk').values_list('pk', flat=True).first() or 0)
+            result = asyncio.run(self.run(users, make_client, options))
+            result['db_writes'] = self.count_writes(users, first_message, result['messages_sent'])
+            result['db_writes_per_s'] = round(result['db_writes'] / result['duration_s'], 1) if result['duration_s'] else None
+        finally:
+            if not options['keep_users']:
+                self.delete_users(users, sessions)
+
+        result = {
+            'mode': 'live' if options['url'] else 'in-process',
+            'url': options['url'],
+            'chat_write_behind': settings.CHAT_WRITE_BEHIND,
+            'users': options['users'],
+            'rooms': options['users'] // 2,
+            'messages_per_user': options['messages'],
+            'rate_per_user': options['rate'],
+            **result,
+        }
+        output = json.dumps(result, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+    def create_users(self, count):
+        users = User.objects.bulk_create([User(username=f'{USERNAME_PREFIX}{i}') for i in range(count)])
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in users])
+        return users
+
+    def create_sessions(self, users):
+        """Logged-in sessions the live server will accept, keyed by user id"""
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        sessions = {}
+        for user in users:
+            session = store()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            sessions[user.id] = session.session_key
+        return sessions
+
+    def count_writes(self, users, first_message, expected):
+        """Messages the run saved, waiting briefly for a write-behind queue to drain"""
+        bench = Message.objects.filter(pk__gt=first_message, sender__in=[user.id for user in users])
+        deadline = time.monotonic() + 10
+        while (saved := bench.count()) < expected and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return saved
+
+    def delete_users(self, users, sessions):
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        for session_key in sessions.values():
+            store(session_key).delete()
+        ids = [user.id for user in users]
+        for start in range(0, len(ids), 200):
+            User.objects.filter(id__in=ids[start:start + 200]).delete()
+
+    async def run(self, users, make_client, options):
+        pairs = [(users[i], users[i + 1]) for i in range(0, len(users), 2)]
+        clients = {}
+        connect_times = []
+        errors = []
+        gate = asyncio.Semaphore(options['connect_concurrency'])
+
+        async def connect(user, peer):
+            client = make_client(user, f'/ws/chat/{peer.id}/')
+            async with gate:
+                start = time.perf_counter()
+                try:
+                    connected = await client.connect()
+                except Exception as e:
+                    errors.append(f'connect {user.id}: {e!r}')
+                    return
+            if not connected:
+                errors.append(f'connect {user.id}: rejected')
+                return
+            connect_times.append(time.perf_counter() - start)
+            clients[user.id] = client
+
+        await asyncio.gather(*(
+            connect(user, peer) for a, b in pairs for user, peer in ((a, b), (b, a))
+        ))
+
+        round_trips = []
+        deliveries = []
+        received = 0
+        count = options['messages']
+        interval = 1 / options['rate'] if options['rate'] > 0 else 0
+
+        async def chat(user, peer):
+            """Send `count` messages and read until ours and the peer's are all back"""
+            nonlocal received
+            client = clients[user.id]
+            echoed = asyncio.Event()
+
+            async def reader():
+                nonlocal received
+                pending = {'own': count, 'peer': count if peer.id in clients else 0}
+                while pending['own'] or pending['peer']:
+                    try:
+                        frame = json.loads(await client.receive(options['timeout']))
+                    except Exception as e:
+                        errors.append(f'receive {user.id}: {e!r} with {pending} outstanding')
+                        return
+                    if frame.get('type') != 'message' or not frame['message'].startswith('bench '):
+                        continue
+                    sent_at = float(frame['message'].split()[2])
+                    elapsed = time.perf_counter() - sent_at
+                    received += 1
+                    if frame['sender_id'] == user.id:
+                        round_trips.append(elapsed)
+                        pending['own'] -= 1
+                        echoed.set()
+                    else:
+                        deliveries.append(elapsed)
+                        pending['peer'] -= 1
+
+            reading = asyncio.create_task(reader())
+            for seq in range(count):
+                echoed.clear()
+                await client.send(json.dumps({'message': f'bench {seq} {time.perf_counter()!r}'}))
+                if interval:
+                    await asyncio.sleep(interval)
+                else:
+                    # Closed loop: next message once this one came back
+                    try:
+                        await asyncio.wait_for(echoed.wait(), options['timeout'])
+                    except asyncio.TimeoutError:
+                        break
+            await reading
+
+        active = [(a, b) for a, b in pairs if a.id in clients and b.id in clients]
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            chat(user, peer) for a, b in active for user, peer in ((a, b), (b, a))
+        ))
+        duration = time.perf_counter() - start
+
+        await asyncio.gather(*(client.close() for client in clients.values()), return_exceptions=True)
+
+        sent = len(active) * 2 * count
+        return {
+            'connected': len(clients),
+            'messages_sent': sent,
+            'frames_received': received,
+            'duration_s': round(duration, 3),
+            'throughput_msgs_per_s': round(sent / duration, 1) if duration else None,
+            'connect_ms': percentiles(connect_times),
+            'round_trip_ms': percentiles(round_trips),
+            'delivery_ms': percentiles(deliveries),
+            'errors': len(errors),
+            'error_samples': errors[:10],
+        }
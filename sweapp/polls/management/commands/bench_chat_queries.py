@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from polls.chat import save_message
+from polls.models import Conversation, Message
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare DB round-trips per chat message for the old consumer write path '
+        '(receiver looked up on every message) and the current one (peer resolved '
+        'once at connect). Runs inside a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=200, help='Messages to send per path')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        try:
+            with transaction.atomic():
+                sender = User.objects.create_user('bench_chat_sender')
+                receiver = User.objects.create_user('bench_chat_receiver')
+
+                def legacy():
+                    # What ChatConsumer.save_message did before: trust the
+                    # payload's receiver_id and fetch the User every time
+                    peer = User.objects.get(id=receiver.id)
+                    with transaction.atomic():
+                        message = Message.objects.create(sender=sender, receiver=peer, content='benchmark')
+                        Conversation.record_message(message)
+
+                with CaptureQueriesContext(connection) as connect_queries:
+                    # ChatConsumer.get_peer, run once per connection
+                    peer = User.objects.only('id', 'username').filter(id=receiver.id).first()
+
+                def current():
+                    save_message(sender.id, peer.id, 'benchmark')
+
+                # First message of each path creates the Conversation row;
+                # warm up so both measure the steady state
+                legacy()
+                results = [
+                    ('before (lookup per message)', self.measure(legacy, count)),
+                    ('after (peer cached at connect)', self.measure(current, count)),
+                ]
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{count} messages per path; connect-time peer lookup: {len(connect_queries)} query\n')
+        self.stdout.write(f'{"path":<32}{"queries/msg":>12}{"user lookups/msg":>18}{"ms/msg":>10}')
+        for label, (queries, lookups, elapsed) in results:
+            self.stdout.write(
+                f'{label:<32}{queries / count:>12.2f}{lookups / count:>18.2f}{elapsed * 1000 / count:>10.3f}'
+            )
+
+    def measure(self, send, count):
+        """(total queries, auth_user queries, seconds) for `count` sends"""
+        user_table = connection.ops.quote_name(User._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(count):
+                send()
+            elapsed = time.perf_counter() - start
+        lookups = sum(1 for q in queries.captured_queries if f'FROM {user_table}' in q['sql'])
+        return len(queries), lookups, elapsed
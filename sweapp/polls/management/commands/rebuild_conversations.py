@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import Greatest, Least
+
+from polls.models import Conversation, Message
+
+
+def build_conversations(message_model, conversation_model):
+    """
+    Recompute every Conversation row from the Message table.
+
+    Takes the model classes as arguments so data migrations can run the
+    same logic against historical models.
+    """
+    pairs = (
+        message_model.objects
+        .annotate(a=Least('sender_id', 'receiver_id'), b=Greatest('sender_id', 'receiver_id'))
+        .order_by()
+        .values('a', 'b')
+        .annotate(last_id=Max('message_id'))
+    )
+    last_ids = {(row['a'], row['b']): row['last_id'] for row in pairs}
+    timestamps = dict(
+        message_model.objects.filter(message_id__in=last_ids.values()).values_list('message_id', 'timestamp')
+    )
+
+    unread = {}
+    for row in (
+        message_model.objects.filter(is_read=False)
+        .order_by()
+        .values('sender_id', 'receiver_id')
+        .annotate(total=Count('pk'))
+    ):
+        unread[(row['receiver_id'], row['sender_id'])] = row['total']
+
+    rows = [
+        conversation_model(
+            user_a_id=a,
+            user_b_id=b,
+            last_message_id=last_id,
+            last_message_at=timestamps.get(last_id),
+            unread_a=unread.get((a, b), 0),
+            unread_b=unread.get((b, a), 0),
+        )
+        for (a, b), last_id in last_ids.items()
+    ]
+    with transaction.atomic():
+        conversation_model.objects.all().delete()
+        conversation_model.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Conversation inbox summaries from the Message table'
+
+    def handle(self, *args, **options):
+        total = build_conversations(Message, Conversation)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} conversations'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from polls.models import Event, EventRSVP, RSVP_COUNT_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Recompute the going/maybe/not_going/waitlisted counters on every Event from EventRSVP'
+
+    def handle(self, *args, **options):
+        counters = {}
+        for status, field in RSVP_COUNT_FIELDS.items():
+            tally = (
+                EventRSVP.objects
+                .filter(event=OuterRef('pk'), rsvp_status=status)
+                .order_by()
+                .values('event')
+                .annotate(total=Count('pk'))
+                .values('total')
+            )
+            counters[field] = Coalesce(Subquery(tally), 0)
+
+        updated = Event.objects.update(**counters)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt RSVP counters for {updated} events'))
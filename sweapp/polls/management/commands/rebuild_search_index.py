@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+
+from polls.models import Post
+from polls.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from every post, event and user'
+
+    def handle(self, *args, **options):
+        using = router.db_for_write(Post)
+        start = time.perf_counter()
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            counts = rebuild_index(cursor)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {counts['post']} posts, {counts['event']} events and {counts['person']} people "
+            f'in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.friend_graph import FRIEND_SUGGESTION_BATCH_USERS, FRIEND_SUGGESTION_LIMIT, recompute_suggestions
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored "people you may know" suggestions of every user (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=FRIEND_SUGGESTION_LIMIT,
+            help='Suggestions to store per user.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=FRIEND_SUGGESTION_BATCH_USERS,
+            help='Users whose suggestions are replaced per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        users, stored = recompute_suggestions(limit=options['limit'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored {stored} suggestions for {users} users in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,405 @@
+import bisect
+import itertools
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+
+from polls.management.commands.rebuild_conversations import build_conversations
+from polls.models import (
+    Conversation, Event, EventRSVP, Friendship, Group, GroupMembership, Message, Post, UserProfile,
+)
+
+MAJORS = [
+    'Computer Science', 'Mathematics', 'Biology', 'Chemistry', 'Physics', 'Economics', 'Psychology',
+    'History', 'English', 'Mechanical Engineering', 'Electrical Engineering', 'Nursing', 'Finance',
+]
+# Course prefix of each major, in the same order as MAJORS
+DEPARTMENTS = ['CSCI', 'MATH', 'BIOL', 'CHEM', 'PHYS', 'ECON', 'PSYC', 'HIST', 'ENGL', 'MECE', 'ELEE', 'NURS', 'FINA']
+COURSE_NUMBERS = [1301, 1302, 1370, 2320, 2344, 2413, 3326, 3333, 3340, 3341, 4325, 4390]
+INTERESTS = (
+    'hiking, gaming, guitar, soccer, basketball, cooking, photography, anime, reading, chess, running, '
+    'movies, drawing, dancing, coding, volunteering, fishing, camping, yoga, piano, board games, baking, '
+    'podcasts, poetry, robotics, skateboarding, swimming, theater, thrifting, travel, weightlifting, writing'
+).split(', ')
+YEARS = ['Freshman', 'Sophomore', 'Junior', 'Senior', 'Graduate']
+HOMETOWNS = ['Chicago', 'Houston', 'Austin', 'Denver', 'Seattle', 'Atlanta', 'Boston', 'Phoenix', 'Miami']
+WORDS = (
+    'study exam library coffee lecture project team lab notes campus game weekend party quiz '
+    'homework deadline club meeting free pizza tonight tomorrow anyone join help review final'
+).split()
+EVENT_KINDS = [
+    ('Study Session', 'academic'), ('Club Meeting', 'clubs'), ('Game Night', 'social'), ('Career Fair', 'career'),
+    ('Hackathon', 'academic'), ('Concert', 'arts'), ('Workshop', 'academic'), ('Intramural Game', 'sports'),
+]
+RSVP_STATUSES = ['going'] * 6 + ['maybe'] * 3 + ['not_going']
+
+
+class WeightedSampler:
+    """
+    Draws indices 0..n-1 with Zipf-like weights (rank ** -exponent), with
+    ranks shuffled so the popular ids are spread over the table.
+    """
+
+    def __init__(self, rng, n, exponent):
+        ranks = list(range(1, n + 1))
+        rng.shuffle(ranks)
+        self.cumulative = list(itertools.accumulate(rank ** -exponent for rank in ranks))
+        self.total = self.cumulative[-1]
+        self.rng = rng
+
+    def draw(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+def skewed_counts(rng, n, mean, exponent, cap):
+    """n counts with the given mean, heavy-tailed (Pareto), each <= cap"""
+    shape = 1 + 1 / exponent
+    raw = [rng.paretovariate(shape) for _ in range(n)]
+    scale = mean / (sum(raw) / n) if n else 0
+    return [min(cap, int(value * scale)) for value in raw]
+
+
+class Sentences:
+    """
+    Filler text. Building a fresh sentence per row costs more than the
+    INSERT, so rows pick from a fixed pool of pre-built sentences per length.
+    """
+
+    POOL_SIZE = 256
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.pools = {}
+
+    def __call__(self, words):
+        pool = self.pools.get(words)
+        if pool is None:
+            pool = self.pools[words] = [
+                ' '.join(self.rng.choices(WORDS, k=words)).capitalize() + '.' for _ in range(self.POOL_SIZE)
+            ]
+        return pool[int(self.rng.random() * self.POOL_SIZE)]
+
+
+class TableWriter:
+    """
+    Plain executemany INSERTs into a model's table, for rows given as
+    tuples of `fields`. Skips model instantiation, signals and per-row
+    default handling, which is most of bulk_create's cost at this scale.
+    Other columns get the field default (or now() for auto timestamps).
+
+    Datetimes must be naive UTC, which is how Django stores them in SQLite,
+    so they only need str().
+    """
+
+    def __init__(self, model, fields, batch_size):
+        self.batch_size = batch_size
+        given = [model._meta.get_field(name) for name in fields]
+        filled = [
+            field for field in model._meta.concrete_fields
+            if field not in given and not (field.primary_key and isinstance(field, models.AutoField))
+        ]
+        now = datetime.now(dt_timezone.utc)
+        self.extra = tuple(
+            self.adapt(field, now if getattr(field, 'auto_now_add', False) or getattr(field, 'auto_now', False)
+                       else field.get_default())
+            for field in filled
+        )
+        self.datetime_columns = [i for i, field in enumerate(given) if isinstance(field, models.DateTimeField)]
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in given + filled)
+        placeholders = ', '.join(['%s'] * (len(given) + len(filled)))
+        self.sql = f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+
+    @staticmethod
+    def adapt(field, value):
+        return field.get_db_prep_save(value, connection)
+
+    def write(self, rows):
+        """Insert an iterable of tuples; returns how many"""
+        total = 0
+        rows = iter(rows)
+        with connection.cursor() as cursor:
+            while batch := list(itertools.islice(rows, self.batch_size)):
+                if self.datetime_columns:
+                    batch = [list(row) for row in batch]
+                    for row in batch:
+                        for i in self.datetime_columns:
+                            row[i] = str(row[i])
+                cursor.executemany(self.sql, [tuple(row) + self.extra for row in batch])
+                total += len(batch)
+        return total
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with deterministic synthetic data: users with profiles, power-law '
+        'friendships, groups, posts, hot and cold events with RSVPs, and chatty conversations. '
+        'The same options always produce the same rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--friends', type=float, default=20, help='Average friends per user (power-law)')
+        parser.add_argument('--posts', type=float, default=10, help='Average posts per user (power-law)')
+        parser.add_argument('--groups', type=int, help='Defaults to one per 50 users')
+        parser.add_argument('--memberships', type=float, default=3, help='Average groups per user')
+        parser.add_argument('--events', type=int, help='Defaults to one per 20 users')
+        parser.add_argument('--rsvps', type=float, default=15, help='Average RSVPs per event (hot events get most)')
+        parser.add_argument('--messages', type=float, default=20, help='Average messages sent per user')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--anchor', type=datetime.fromisoformat,
+            help='Date the generated history is centered on (YYYY-MM-DD); defaults to today',
+        )
+        parser.add_argument('--prefix', default='seed', help='Username / email prefix of generated users')
+        parser.add_argument('--password', default='password', help='Password of every generated user')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--timelines', action='store_true',
+            help='Also materialize every feed timeline (slow for big runs; see backfill_timelines)',
+        )
+
+    def handle(self, *args, **options):
+        users = options['users']
+        if users < 2:
+            raise CommandError('--users must be at least 2')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(
+                f"Users named {options['prefix']}* already exist; use another --prefix or flush the database"
+            )
+
+        self.batch_size = options['batch_size']
+        self.seed = options['seed']
+        self.prefix = options['prefix']
+        anchor = options['anchor'] or datetime.now(dt_timezone.utc)
+        # Naive UTC; see TableWriter
+        self.anchor = datetime(anchor.year, anchor.month, anchor.day)
+        groups = options['groups'] if options['groups'] is not None else max(1, users // 50)
+        events = options['events'] if options['events'] is not None else max(1, users // 20)
+
+        started = time.perf_counter()
+        user_ids = self.step('users', self.create_users, users, options['password'])
+        # Who is popular / active is fixed per run and shared by every table
+        self.popularity = WeightedSampler(self.rng('popularity'), users, exponent=0.8)
+        friendships = self.step('friendships', self.create_friendships, user_ids, options['friends'])
+        group_ids = self.step('groups', self.create_groups, user_ids, groups, options['memberships'])
+        self.step('posts', self.create_posts, user_ids, group_ids, options['posts'])
+        self.step('events', self.create_events, user_ids, events, options['rsvps'])
+        self.step('messages', self.create_messages, user_ids, friendships, options['messages'])
+
+        self.step('conversations', build_conversations, Message, Conversation)
+        call_command('rebuild_rsvp_counts', stdout=self.stdout)
+        # Rows went in with raw SQL, so no signal indexed them
+        call_command('rebuild_search_index', stdout=self.stdout)
+        if options['timelines']:
+            call_command('backfill_timelines', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {time.perf_counter() - started:.1f}s'))
+
+    def rng(self, table):
+        # One stream per table, so changing one count doesn't reshuffle the rest
+        return random.Random(f'{self.seed}:{table}')
+
+    def step(self, label, func, *args):
+        start = time.perf_counter()
+        with transaction.atomic():
+            result = func(*args)
+        rows = result if isinstance(result, int) else len(result)
+        self.stdout.write(f'{label:<14}{rows:>12,} rows {time.perf_counter() - start:>8.1f}s')
+        return result
+
+    def writer(self, model, *fields):
+        return TableWriter(model, fields, self.batch_size)
+
+    def next_ids(self, model, count):
+        """Primary keys for `count` new rows, so children can refer to them without reading back"""
+        first = (model.objects.aggregate(last=models.Max('pk'))['last'] or 0) + 1
+        return list(range(first, first + count))
+
+    def past(self, rng, days=180):
+        """A timestamp in the `days` before the anchor, favoring recent ones"""
+        return self.anchor - timedelta(seconds=days * 86400 * rng.random() ** 2)
+
+    def create_users(self, count, password):
+        rng = self.rng('users')
+        sentence = Sentences(rng)
+        user_ids = self.next_ids(User, count)
+        # Hashing is deliberately slow; every seeded user shares one hash
+        password = make_password(password)
+        self.writer(User, 'id', 'username', 'email', 'first_name', 'password', 'date_joined').write(
+            (user_id, f'{self.prefix}{i}', f'{self.prefix}{i}@example.edu', f'Student{i}', password, self.past(rng, 900))
+            for i, user_id in enumerate(user_ids)
+        )
+        majors = [rng.choice(MAJORS) for _ in user_ids]
+        classes, interests = self.matching_profiles(majors)
+        self.writer(UserProfile, 'user', 'major', 'year', 'hometown', 'bio', 'classes', 'interests').write(
+            (user_id, major, rng.choice(YEARS), rng.choice(HOMETOWNS), sentence(12), next(classes), next(interests))
+            for user_id, major in zip(user_ids, majors)
+        )
+        return user_ids
+
+    def matching_profiles(self, majors):
+        """
+        Iterators of each profile's classes (mostly in their major's
+        department, some popular courses more than others) and interests
+        """
+        rng = self.rng('matching')
+        numbers = WeightedSampler(rng, len(COURSE_NUMBERS), 1.0)
+        departments = WeightedSampler(rng, len(DEPARTMENTS), 1.0)
+        hobbies = WeightedSampler(rng, len(INTERESTS), 1.0)
+
+        def classes():
+            for major in majors:
+                own = DEPARTMENTS[MAJORS.index(major)]
+                picked = {f'{own} {COURSE_NUMBERS[numbers.draw()]}' for _ in range(rng.randint(3, 5))}
+                picked.update(
+                    f'{DEPARTMENTS[departments.draw()]} {COURSE_NUMBERS[numbers.draw()]}' for _ in range(rng.randint(1, 2))
+                )
+                yield ', '.join(sorted(picked))
+
+        def interests():
+            for _ in majors:
+                yield ', '.join(sorted({INTERESTS[hobbies.draw()] for _ in range(rng.randint(2, 6))}))
+
+        return classes(), interests()
+
+    def create_friendships(self, user_ids, mean):
+        """
+        Power-law degrees: most students have a handful of friends, a few
+        have hundreds. Partners are picked by popularity, so well-connected
+        students attract more requests. Accepted pairs get both rows, as
+        respond_friend_request creates them; a few requests stay pending.
+        """
+        rng = self.rng('friendships')
+        n = len(user_ids)
+        pairs = set()
+        for index, degree in enumerate(skewed_counts(rng, n, mean / 2, 1.2, n - 1)):
+            for _ in range(degree):
+                other = self.popularity.draw()
+                if other != index:
+                    pairs.add((index, other) if index < other else (other, index))
+
+        accepted = []
+
+        def rows():
+            for a, b in sorted(pairs):
+                if rng.random() < 0.05:
+                    yield user_ids[a], user_ids[b], 'pending'
+                else:
+                    accepted.append((a, b))
+                    yield user_ids[a], user_ids[b], 'accepted'
+                    yield user_ids[b], user_ids[a], 'accepted'
+
+        self.writer(Friendship, 'user', 'friend', 'status').write(rows())
+        return accepted
+
+    def create_groups(self, user_ids, count, mean_memberships):
+        rng = self.rng('groups')
+        sentence = Sentences(rng)
+        group_ids = self.next_ids(Group, count)
+        self.writer(Group, 'group_id', 'name', 'description', 'created_by').write(
+            (
+                group_id,
+                f'{rng.choice(MAJORS)} {rng.choice(["Club", "Society", "Study Group", "Team"])} {i}',
+                sentence(10),
+                user_ids[self.popularity.draw()],
+            )
+            for i, group_id in enumerate(group_ids)
+        )
+
+        # A few huge groups, a long tail of small ones
+        group_sampler = WeightedSampler(rng, count, exponent=1.0)
+
+        def memberships():
+            for user_id in user_ids:
+                joined = {group_sampler.draw() for _ in range(int(rng.expovariate(1 / mean_memberships)))}
+                for group in sorted(joined):
+                    yield user_id, group_ids[group]
+
+        self.writer(GroupMembership, 'user', 'group').write(memberships())
+        return group_ids
+
+    def create_posts(self, user_ids, group_ids, mean):
+        rng = self.rng('posts')
+        sentence = Sentences(rng)
+        counts = skewed_counts(rng, len(user_ids), mean, 1.0, 2000)
+
+        def posts():
+            for user_id, count in zip(user_ids, counts):
+                for _ in range(count):
+                    group = rng.choice(group_ids) if rng.random() < 0.2 else None
+                    yield sentence(rng.randint(4, 30)), user_id, group, self.past(rng)
+
+        return self.writer(Post, 'content', 'created_by', 'group', 'timestamp').write(posts())
+
+    def create_events(self, user_ids, count, mean_rsvps):
+        """
+        Events spread from 90 days ago to 60 days ahead. RSVPs follow a
+        power law over events (a few hot events draw crowds) and over
+        users (active students RSVP more).
+        """
+        rng = self.rng('events')
+        sentence = Sentences(rng)
+        event_ids = self.next_ids(Event, count)
+        kinds = [rng.choice(EVENT_KINDS) for _ in event_ids]
+        self.writer(Event, 'event_id', 'title', 'category', 'description', 'location', 'date', 'hosted_by_user').write(
+            (
+                event_id,
+                f'{kind} #{i}',
+                category,
+                sentence(20),
+                f'{rng.choice(["Library", "Student Union", "Gym", "Hall"])} {rng.randint(1, 300)}',
+                self.anchor + timedelta(days=rng.uniform(-90, 60), hours=rng.randint(8, 22)),
+                user_ids[self.popularity.draw()],
+            )
+            for i, (event_id, (kind, category)) in enumerate(zip(event_ids, kinds))
+        )
+
+        sizes = skewed_counts(rng, count, mean_rsvps, 1.5, len(user_ids))
+
+        def rsvps():
+            for event_id, size in zip(event_ids, sizes):
+                for user in sorted({self.popularity.draw() for _ in range(size)}):
+                    yield user_ids[user], event_id, rng.choice(RSVP_STATUSES)
+
+        total = self.writer(EventRSVP, 'user', 'event', 'rsvp_status').write(rsvps())
+        self.stdout.write(f'{"rsvps":<14}{total:>12,} rows')
+        return event_ids
+
+    def create_messages(self, user_ids, friendships, mean):
+        """
+        Messages go between friends. Conversations are heavily skewed: a few
+        pairs chat constantly, most exchange a couple of messages. Each
+        conversation is a run of back-and-forth replies, the last two unread.
+        """
+        rng = self.rng('messages')
+        sentence = Sentences(rng)
+        if not friendships:
+            return 0
+        pair_sampler = WeightedSampler(rng, len(friendships), exponent=1.1)
+        per_pair = {}
+        for _ in range(int(mean * len(user_ids))):
+            pair = pair_sampler.draw()
+            per_pair[pair] = per_pair.get(pair, 0) + 1
+
+        def messages():
+            for pair in sorted(per_pair):
+                a, b = friendships[pair]
+                sender, receiver = user_ids[a], user_ids[b]
+                count = per_pair[pair]
+                pair_key = Message.make_pair_key(sender, receiver)
+                moment = self.past(rng, days=60)
+                for i in range(count):
+                    if rng.random() < 0.6:
+                        sender, receiver = receiver, sender
+                    moment += timedelta(seconds=rng.expovariate(1 / 600))
+                    yield sender, receiver, sentence(rng.randint(2, 15)), pair_key, moment, i < count - 2
+
+        return self.writer(Message, 'sender', 'receiver', 'content', 'pair_key', 'timestamp', 'is_read').write(
+            messages()
+        )
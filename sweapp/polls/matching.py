@@ -0,0 +1,381 @@
+"""
+Study and Friend Matching
+
+The two matching modes from the README, each a toggle on the profile:
+- study: students who share classes, a little higher for the same major
+  and year
+- friend: students with shared interests, a little higher for the same
+  hometown, workplace, major and year
+Only sharing at least one class (interest) makes a match; the rest only
+orders them. Someone with a mode turned off gets no matches in it and is
+never suggested to anyone else in it.
+
+How it works:
+1. Each process keeps a MatchIndex: one row per profile in NumPy arrays
+   - classes and interests as bitsets, one bit per distinct class or
+     interest seen so far (uint64 words, widened as new ones appear)
+   - major, year, hometown and workplace as int32 codes (0 = blank)
+   - the two toggles as bool columns
+   50k students with a few hundred distinct classes is a few MB
+2. A query scores every row against the user's row with vectorized
+   AND + popcount and equality tests, in batches of MATCH_BATCH_ROWS so
+   the temporaries stay small, then takes the top k with argpartition
+3. Shared sets are scored as cosine similarity (shared / sqrt(|a| * |b|)),
+   so someone who lists every class doesn't match everyone
+
+Keeping it current without recomputing:
+- Saving a UserProfile (edit_profile) rewrites that one row in this
+  process right away (signal in polls/signals.py)
+- Other processes pick edits up from UserProfile.updated_at: before
+  answering, an index re-reads profiles changed since its last sync, at
+  most once per MATCH_SYNC_INTERVAL seconds (an index range scan)
+- Deleted users are dropped here by signal, and skipped elsewhere when
+  the matched users are loaded
+The first query in a process loads every profile.
+"""
+
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.models import User
+
+from .friend_graph import connected_user_ids
+from .models import UserProfile
+
+MODES = ('study', 'friend')
+
+MATCH_LIMIT = 20
+MATCH_MAX_LIMIT = 100
+
+# Rows scored per vectorized batch
+MATCH_BATCH_ROWS = 8192
+
+# Seconds between checks for profiles edited in other processes
+MATCH_SYNC_INTERVAL = 5.0
+
+# Re-read edits this far behind the newest one seen, in case a transaction
+# committed after a later one had already been synced
+MATCH_SYNC_OVERLAP = timedelta(seconds=30)
+
+# Classes or interests kept per profile
+MAX_TAGS = 20
+
+STUDY_WEIGHTS = {'classes': 1.0, 'major': 0.2, 'year': 0.1}
+FRIEND_WEIGHTS = {'interests': 1.0, 'hometown': 0.2, 'workplace': 0.15, 'major': 0.1, 'year': 0.1}
+
+PROFILE_FIELDS = (
+    'user_id', 'classes', 'interests', 'major', 'year', 'hometown', 'workplace',
+    'study_matching', 'friend_matching', 'updated_at',
+)
+
+CATEGORIES = ('major', 'year', 'hometown', 'workplace')
+
+
+def _parse_tags(text, normalize):
+    tags = []
+    for tag in text.split(','):
+        tag = normalize(' '.join(tag.split()))
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags[:MAX_TAGS]
+
+
+def parse_classes(text):
+    """'csci 3340, Math 2413' -> ['CSCI 3340', 'MATH 2413']"""
+    return _parse_tags(text, str.upper)
+
+
+def parse_interests(text):
+    """'Hiking,  board games' -> ['hiking', 'board games']"""
+    return _parse_tags(text, str.lower)
+
+
+class Vocabulary:
+    """Gives each distinct value a small int, in order of first use"""
+
+    def __init__(self, first=0):
+        self.first = first
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = self.first + len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class Bitsets:
+    """One growable bitset per row; bit i is the i-th value of `vocabulary`"""
+
+    def __init__(self, rows):
+        self.vocabulary = Vocabulary()
+        self.words = np.zeros((rows, 1), dtype=np.uint64)
+        # Set sizes, as floats for the cosine denominators
+        self.counts = np.zeros(rows, dtype=np.float32)
+
+    def resize(self, rows):
+        words = np.zeros((rows, self.words.shape[1]), dtype=np.uint64)
+        words[:len(self.words)] = self.words
+        counts = np.zeros(rows, dtype=np.float32)
+        counts[:len(self.counts)] = self.counts
+        self.words, self.counts = words, counts
+
+    def encode(self, tags):
+        """The bitset for `tags`, as a row of words, widening if needed"""
+        bits = [self.vocabulary.code(tag) for tag in tags]
+        needed = len(self.vocabulary) // 64 + 1
+        if needed > self.words.shape[1]:
+            # Double, so a stream of new values widens O(log n) times
+            width = max(needed, self.words.shape[1] * 2)
+            self.words = np.hstack([self.words, np.zeros((len(self.words), width - self.words.shape[1]), np.uint64)])
+        row = np.zeros(self.words.shape[1], dtype=np.uint64)
+        for bit in bits:
+            row[bit >> 6] |= np.uint64(1 << (bit & 63))
+        return row
+
+    def set(self, index, tags):
+        self.words[index] = self.encode(tags)
+        self.counts[index] = len(tags)
+
+    def shared(self, start, stop, query):
+        """Number of bits each row in [start, stop) has in common with `query`"""
+        return np.bitwise_count(self.words[start:stop] & query).sum(axis=1, dtype=np.float32)
+
+    def decode(self, words):
+        bits = np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little'))
+        return [self.vocabulary.values[bit] for bit in bits]
+
+
+class Match:
+    __slots__ = ('user', 'score', 'shared')
+
+    def __init__(self, user, score, shared):
+        self.user = user
+        self.score = score
+        self.shared = shared
+
+    def as_dict(self):
+        profile = getattr(self.user, 'profile', None)
+        return {
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'name': self.user.get_full_name(),
+            'major': profile.major if profile else '',
+            'year': profile.year if profile else '',
+            'score': round(self.score, 4),
+            'shared': self.shared,
+        }
+
+
+class MatchIndex:
+    """
+    The profiles of every student as NumPy columns (see the module
+    docstring). Thread-safe: views run on daphne's thread pool.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.rows = {}
+        self.size = 0
+        self.loaded = False
+        self.synced_to = None
+        self.checked_at = 0.0
+        self.allocate(1024)
+
+    def allocate(self, capacity):
+        self.user_ids = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.study = np.zeros(capacity, dtype=bool)
+        self.friend = np.zeros(capacity, dtype=bool)
+        self.codes = {name: np.zeros(capacity, dtype=np.int32) for name in CATEGORIES}
+        self.vocabularies = {name: Vocabulary(first=1) for name in CATEGORIES}
+        self.classes = Bitsets(capacity)
+        self.interests = Bitsets(capacity)
+
+    def grow(self):
+        capacity = len(self.user_ids) * 2
+        for name in ('user_ids', 'alive', 'study', 'friend'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+        for name, column in self.codes.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            self.codes[name] = grown
+        self.classes.resize(capacity)
+        self.interests.resize(capacity)
+
+    def upsert(self, user_id, classes, interests, major, year, hometown, workplace,
+               study_matching, friend_matching, updated_at=None):
+        with self.lock:
+            index = self.rows.get(user_id)
+            if index is None:
+                if self.size == len(self.user_ids):
+                    self.grow()
+                index = self.rows[user_id] = self.size
+                self.size += 1
+                self.user_ids[index] = user_id
+            self.alive[index] = True
+            self.study[index] = study_matching
+            self.friend[index] = friend_matching
+            for name, value in zip(CATEGORIES, (major, year, hometown, workplace)):
+                value = ' '.join(value.split()).lower()
+                self.codes[name][index] = self.vocabularies[name].code(value) if value else 0
+            self.classes.set(index, parse_classes(classes))
+            self.interests.set(index, parse_interests(interests))
+            if updated_at is not None and (self.synced_to is None or updated_at > self.synced_to):
+                self.synced_to = updated_at
+
+    def update_profile(self, profile):
+        self.upsert(
+            profile.user_id, profile.classes, profile.interests, profile.major, profile.year,
+            profile.hometown, profile.workplace, profile.study_matching, profile.friend_matching,
+            profile.updated_at,
+        )
+
+    def remove(self, user_id):
+        with self.lock:
+            index = self.rows.get(user_id)
+            if index is not None:
+                self.alive[index] = False
+
+    def sync(self):
+        """Load every profile the first time, then only those edited since"""
+        with self.lock:
+            now = time.monotonic()
+            if self.loaded and now - self.checked_at < MATCH_SYNC_INTERVAL:
+                return
+            profiles = UserProfile.objects.order_by()
+            if self.loaded and self.synced_to is not None:
+                profiles = profiles.filter(updated_at__gte=self.synced_to - MATCH_SYNC_OVERLAP)
+            for values in profiles.values_list(*PROFILE_FIELDS).iterator(chunk_size=5000):
+                self.upsert(*values)
+            self.loaded = True
+            self.checked_at = now
+
+    def scores(self, index, mode):
+        """Every row's score against row `index` in `mode`; 0 = no match"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        if mode == 'study':
+            weights, weight, bitsets, enabled = STUDY_WEIGHTS, STUDY_WEIGHTS['classes'], self.classes, self.study
+        else:
+            weights, weight, bitsets, enabled = FRIEND_WEIGHTS, FRIEND_WEIGHTS['interests'], self.interests, self.friend
+        query = bitsets.words[index]
+        query_count = max(bitsets.counts[index], 1)
+        categories = [
+            (self.codes[name], self.codes[name][index], weights[name])
+            for name in CATEGORIES if name in weights and self.codes[name][index]
+        ]
+
+        for start in range(0, self.size, MATCH_BATCH_ROWS):
+            stop = min(start + MATCH_BATCH_ROWS, self.size)
+            shared = bitsets.shared(start, stop, query)
+            batch = weight * shared / np.sqrt(np.maximum(bitsets.counts[start:stop], 1) * query_count)
+            for codes, code, bonus in categories:
+                batch += bonus * (codes[start:stop] == code)
+            eligible = self.alive[start:stop] & enabled[start:stop] & (shared > 0)
+            scores[start:stop] = np.where(eligible, batch, 0)
+        scores[index] = 0
+        return scores
+
+    def enabled(self, user_id, mode):
+        """Whether the user has a profile with `mode` turned on"""
+        with self.lock:
+            index = self.rows.get(user_id)
+            column = self.study if mode == 'study' else self.friend
+            return index is not None and bool(self.alive[index] and column[index])
+
+    def top(self, user_id, mode, limit=MATCH_LIMIT, exclude=()):
+        """
+        [(user_id, score, shared classes or interests)] best first, or []
+        if the user has no profile or has turned `mode` off.
+        """
+        with self.lock:
+            if not self.enabled(user_id, mode):
+                return []
+            index = self.rows[user_id]
+            scores = self.scores(index, mode)
+            for other in exclude:
+                row = self.rows.get(other)
+                if row is not None:
+                    scores[row] = 0
+
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > limit:
+                candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            # Best first; ties by user id so results are stable
+            candidates = candidates[np.lexsort((self.user_ids[candidates], -scores[candidates]))]
+
+            bitsets = self.classes if mode == 'study' else self.interests
+            query = bitsets.words[index]
+            return [
+                (int(self.user_ids[row]), float(scores[row]), bitsets.decode(bitsets.words[row] & query))
+                for row in candidates
+            ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = MatchIndex()
+        return _index
+
+
+def reset_index():
+    """Forget this process's index; the next query reloads every profile"""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def update_profile(profile):
+    """Apply one saved profile to this process's index, if it's loaded"""
+    index = _index
+    if index is not None and index.loaded:
+        index.update_profile(profile)
+
+
+def remove_user(user_id):
+    index = _index
+    if index is not None:
+        index.remove(user_id)
+
+
+def find_matches(user, modes=MODES, limit=MATCH_LIMIT):
+    """
+    {mode: [Match]} for each of `modes`, with the matched users (and
+    profiles) loaded in one query. Friend matching leaves out anyone the
+    user is already friends with or has a request pending with.
+    """
+    index = get_index()
+    index.sync()
+
+    found = {}
+    for mode in modes:
+        exclude = ()
+        if mode == 'friend' and index.enabled(user.id, mode):
+            exclude = connected_user_ids(user.id)
+        found[mode] = index.top(user.id, mode, limit, exclude)
+
+    ids = {user_id for matches in found.values() for user_id, _, _ in matches}
+    users = User.objects.select_related('profile').in_bulk(ids) if ids else {}
+    return {
+        mode: [
+            Match(users[user_id], score, shared)
+            for user_id, score, shared in matches if user_id in users
+        ]
+        for mode, matches in found.items()
+    }
@@ -0,0 +1,166 @@
+"""
+Media Serving
+
+Serves MEDIA_ROOT from daphne without tying up the event loop, with the
+HTTP caching that django.views.static.serve leaves out:
+
+- ETag / If-None-Match and Last-Modified / If-Modified-Since (304s)
+- Range requests (206) for a single byte range, honoring If-Range
+- Cache-Control: immutable for content-addressed files, whose name can
+  never point at different bytes (see storage.py and thumbnails.py);
+  everything else is revalidated on every use
+
+The view is async: file system calls run in a thread and the body is
+streamed in MEDIA_CHUNK_SIZE pieces, so a big download doesn't block other
+connections or sit in memory.
+"""
+
+import mimetypes
+import os
+import posixpath
+import stat
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import is_content_addressed
+from .thumbnails import THUMBNAIL_DIR
+
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+
+def is_immutable(path):
+    return is_content_addressed(path) or path.startswith(THUMBNAIL_DIR + '/')
+
+
+def make_etag(path, file_stat):
+    if is_content_addressed(path):
+        # The name is the content hash
+        return '"%s"' % posixpath.splitext(posixpath.basename(path))[0]
+    return 'W/"%x-%x"' % (file_stat.st_size, int(file_stat.st_mtime))
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single "bytes=" range, None to serve the
+    whole file, or False if the range can't be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        # Multiple ranges aren't worth a multipart body for avatars
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            # An empty file has no last N bytes to send
+            if length <= 0 or size == 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    # Weak comparison, as If-None-Match requires
+    strip = lambda tag: tag.strip().removeprefix('W/')
+    return strip(etag) in (strip(tag) for tag in header.split(','))
+
+
+async def read_chunks(path, start, length):
+    f = await sync_to_async(open, thread_sensitive=False)(path, 'rb')
+    try:
+        await sync_to_async(f.seek, thread_sensitive=False)(start)
+        while length > 0:
+            chunk = await sync_to_async(f.read, thread_sensitive=False)(min(MEDIA_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def serve_media(request, path):
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except (ValueError, SuspiciousFileOperation):
+        raise Http404('Not found')
+
+    try:
+        file_stat = await sync_to_async(os.stat, thread_sensitive=False)(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found')
+    # Directories and in-progress uploads (.upload-*) aren't served
+    if not stat.S_ISREG(file_stat.st_mode) or posixpath.basename(path).startswith('.'):
+        raise Http404('Not found')
+
+    etag = make_etag(path, file_stat)
+    last_modified = http_date(file_stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_immutable(path) else REVALIDATE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    if (if_none_match and etag_matches(if_none_match, etag)) or (
+        not if_none_match and if_modified_since and int(file_stat.st_mtime) <= if_modified_since
+    ):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    size = file_stat.st_size
+    byte_range = parse_range(request.headers.get('Range'), size)
+    if_range = request.headers.get('If-Range')
+    # If-Range only accepts strong validators: the date, or a hash ETag
+    strong_validators = {last_modified}
+    if not etag.startswith('W/'):
+        strong_validators.add(etag)
+    if byte_range is not None and if_range and if_range.strip() not in strong_validators:
+        # The client's partial copy is stale; send the whole file, even if
+        # the range doesn't fit it (RFC 9110 13.1.5: If-Range is checked
+        # before the range is)
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    content_type, encoding = mimetypes.guess_type(full_path)
+
+    response = StreamingHttpResponse(
+        read_chunks(full_path, start, length),
+        status=206 if byte_range else 200,
+        content_type=content_type or 'application/octet-stream',
+    )
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Content-Length'] = str(length)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    for header, value in headers.items():
+        response[header] = value
+    return response
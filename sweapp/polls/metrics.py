@@ -0,0 +1,278 @@
+"""
+Metrics
+
+In-process counters, gauges and histograms, exposed in the Prometheus text
+format at /metrics.
+
+What is recorded:
+- http_request_duration_seconds{view,method,status}: per-view latency
+  (MetricsMiddleware)
+- consumer_event_duration_seconds{consumer,event}: per-consumer-event
+  latency (MetricsConsumerMixin wraps every handler dispatch)
+- db_queries{source} and db_query_duration_seconds{source}: queries and
+  the time spent in them per request / consumer event, where source is
+  the view or consumer name
+- websocket_connections{consumer}: currently open WebSockets
+
+Queries are counted by one execute_wrapper installed on every new database
+connection. It only adds to the QueryStats of whatever request or event is
+running (tracked with a ContextVar, which asgiref carries into
+database_sync_to_async threads), so the cost is a clock read per query.
+
+Each process keeps its own numbers; with several daphne processes, scrape
+each one (the process label tells them apart).
+"""
+
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Seconds; roughly doubling from 1ms to 10s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{format_labels(key)} {value}'
+
+
+class Gauge(Counter):
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        lines = super().collect()
+        yield next(lines)
+        next(lines)
+        yield f'# TYPE {self.name} gauge'
+        yield from lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{format_labels(key + (("le", le),))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(key)} {total}'
+            yield f'{self.name}_count{format_labels(key)} {count}'
+
+
+def format_labels(key):
+    if not key:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in key
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+http_request_duration = Histogram('http_request_duration_seconds', 'Time to produce a response, by view')
+consumer_event_duration = Histogram('consumer_event_duration_seconds', 'Time to handle a consumer event')
+db_queries = Histogram('db_queries', 'Database queries per request or consumer event', QUERY_COUNT_BUCKETS)
+db_query_duration = Counter('db_query_duration_seconds', 'Total time spent in database queries')
+websocket_connections = Gauge('websocket_connections', 'Open WebSocket connections')
+
+REGISTRY = [http_request_duration, consumer_event_duration, db_queries, db_query_duration, websocket_connections]
+
+
+# Query counting
+
+class QueryStats:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+_current_stats = contextvars.ContextVar('query_stats', default=None)
+
+
+def record_queries(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class measure:
+    """
+    Context manager timing one unit of work and the queries it makes.
+
+        with measure() as m:
+            ...
+        m.elapsed, m.queries.count, m.queries.duration
+    """
+
+    def __enter__(self):
+        self.queries = QueryStats()
+        self._token = _current_stats.set(self.queries)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self._start
+        _current_stats.reset(self._token)
+        return False
+
+
+def record_db(source, queries):
+    db_queries.observe(queries.count, source=source)
+    if queries.count:
+        db_query_duration.inc(queries.duration, source=source)
+
+
+# HTTP
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """
+    Records latency and DB usage of every request, labelled by view name.
+
+    Works under both WSGI and ASGI without adapting the rest of the stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with measure() as m:
+            response = self.get_response(request)
+        self.record(request, response, m)
+        return response
+
+    async def __acall__(self, request):
+        with measure() as m:
+            response = await self.get_response(request)
+        self.record(request, response, m)
+        return response
+
+    def record(self, request, response, m):
+        view = view_label(request)
+        http_request_duration.observe(m.elapsed, view=view, method=request.method, status=response.status_code)
+        record_db(view, m.queries)
+
+
+# Channels
+
+class MetricsConsumerMixin:
+    """
+    Put first in a consumer's bases to time every event it handles and
+    count its open WebSockets.
+    """
+
+    async def dispatch(self, message):
+        consumer = type(self).__name__
+        event = message['type']
+        if event == 'websocket.connect':
+            websocket_connections.inc(consumer=consumer)
+        elif event == 'websocket.disconnect':
+            websocket_connections.dec(consumer=consumer)
+
+        m = measure()
+        try:
+            with m:
+                await super().dispatch(message)
+        finally:
+            # Also when the handler raised, e.g. StopConsumer on disconnect
+            consumer_event_duration.observe(m.elapsed, consumer=consumer, event=event)
+            record_db(consumer, m.queries)
+
+
+# Endpoint
+
+PROCESS_LABEL = f'{os.uname().nodename}:{os.getpid()}' if hasattr(os, 'uname') else str(os.getpid())
+
+
+def render_metrics():
+    lines = [f'# process {PROCESS_LABEL}']
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; local addresses and staff only"""
+    allowed = request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+    if not allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
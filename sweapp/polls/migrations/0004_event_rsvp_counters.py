@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_rsvp_counts(apps, schema_editor):
+    Event = apps.get_model('polls', 'Event')
+    EventRSVP = apps.get_model('polls', 'EventRSVP')
+    fields = {'going': 'going_count', 'maybe': 'maybe_count', 'not_going': 'not_going_count'}
+    tallies = (
+        EventRSVP.objects
+        .order_by()
+        .values('event_id', 'rsvp_status')
+        .annotate(total=Count('pk'))
+    )
+    for row in tallies:
+        field = fields.get(row['rsvp_status'])
+        if field:
+            Event.objects.filter(event_id=row['event_id']).update(**{field: row['total']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_alter_event_location_eventrsvp_event_attendees_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='going_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='maybe_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='not_going_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_rsvp_counts, migrations.RunPython.noop),
+    ]
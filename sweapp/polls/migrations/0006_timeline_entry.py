@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    # Same as `manage.py backfill_timelines`, so existing feeds aren't empty
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Friendship = apps.get_model('polls', 'Friendship')
+    GroupMembership = apps.get_model('polls', 'GroupMembership')
+    Post = apps.get_model('polls', 'Post')
+    TimelineEntry = apps.get_model('polls', 'TimelineEntry')
+
+    for user_id in User.objects.values_list('id', flat=True).iterator():
+        authors = [user_id, *Friendship.objects.filter(user_id=user_id, status='accepted').values_list('friend_id', flat=True)]
+        groups = list(GroupMembership.objects.filter(user_id=user_id).values_list('group_id', flat=True))
+        recent = (
+            Post.objects.filter(models.Q(created_by_id__in=authors) | models.Q(group_id__in=groups))
+            .order_by('-timestamp', '-post_id')
+            .values_list('post_id', 'timestamp')[:200]
+        )
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post_id, timestamp=timestamp) for post_id, timestamp in recent],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_post_feed_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='post',
+            name='post_feed_idx',
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='fanout_on_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['created_by', '-timestamp', '-post_id'], name='post_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', '-timestamp', '-post_id'], name='post_group_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('fanout_on_read', True)), fields=['created_by', '-timestamp', '-post_id'], name='post_fanout_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('fanout_on_read', True)), fields=['group', '-timestamp', '-post_id'], name='post_fanout_group_idx'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='polls.post'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-timestamp', '-post'], name='timeline_user_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='timelineentry',
+            unique_together={('user', 'post')},
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_conversations(apps, schema_editor):
+    from polls.management.commands.rebuild_conversations import build_conversations
+    build_conversations(apps.get_model('polls', 'Message'), apps.get_model('polls', 'Conversation'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_timeline_entry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_a', models.IntegerField(default=0)),
+                ('unread_b', models.IntegerField(default=0)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='polls.message')),
+                ('user_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_a', '-last_message_at'], name='conversation_a_recent_idx'), models.Index(fields=['user_b', '-last_message_at'], name='conversation_b_recent_idx')],
+                'unique_together': {('user_a', 'user_b')},
+            },
+        ),
+        migrations.RunPython(populate_conversations, migrations.RunPython.noop),
+    ]
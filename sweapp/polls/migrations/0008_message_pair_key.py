@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, Greatest, Least
+
+
+def populate_pair_keys(apps, schema_editor):
+    Message = apps.get_model('polls', 'Message')
+    Message.objects.update(pair_key=Concat(
+        Cast(Least('sender_id', 'receiver_id'), CharField()),
+        Value('_'),
+        Cast(Greatest('sender_id', 'receiver_id'), CharField()),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_conversation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='pair_key',
+            field=models.CharField(default='', editable=False, max_length=41),
+        ),
+        migrations.RunPython(populate_pair_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['pair_key', '-message_id'], name='message_pair_idx'),
+        ),
+    ]
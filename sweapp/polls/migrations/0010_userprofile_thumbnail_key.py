@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_message_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='thumbnail_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
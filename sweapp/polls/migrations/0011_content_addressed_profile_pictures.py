@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:13
+
+import polls.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_userprofile_thumbnail_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, storage=polls.storage.media_storage, upload_to='profile_pics/'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def check_duplicate_emails(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    duplicates = list(
+        User.objects.exclude(email='')
+        .values('email')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('email', flat=True)[:10]
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Cannot add a unique index on auth_user.email; these emails belong to '
+            'more than one account: ' + ', '.join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_content_addressed_profile_pictures'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        # Partial: accounts created without an email (e.g. createsuperuser)
+        # all have '' and are left out. EmailBackend filters on email > ''
+        # so SQLite can match the query to this index.
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX auth_user_email_uniq ON auth_user (email) WHERE email > ''",
+            'DROP INDEX auth_user_email_uniq',
+        ),
+    ]
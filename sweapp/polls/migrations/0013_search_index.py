@@ -0,0 +1,52 @@
+from django.db import migrations
+
+# The SQL as it was when this migration was written, not polls/search.py's
+# current CREATE_SQL/REBUILD_SQL: a migration has to keep working against
+# the schema of its own point in history. Row ids are (kind << 40) + pk,
+# with kinds post 0, event 1, person 2.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE search_index USING fts5(
+        title, body, kind UNINDEXED,
+        tokenize = 'porter unicode61 remove_diacritics 2',
+        prefix = '2 3 4 5 6'
+    )
+    """,
+    "INSERT INTO search_index(search_index, rank) VALUES ('rank', 'bm25(10.0, 1.0, 0.0)')",
+]
+
+# Same as `manage.py rebuild_search_index` did, so existing data is searchable
+FILL_SQL = [
+    """
+    INSERT INTO search_index(rowid, title, body, kind)
+    SELECT (0 << 40) + post_id, '', content, 'post'
+    FROM polls_post
+    """,
+    """
+    INSERT INTO search_index(rowid, title, body, kind)
+    SELECT (1 << 40) + event_id, title,
+           description || ' ' || location, 'event'
+    FROM polls_event
+    """,
+    """
+    INSERT INTO search_index(rowid, title, body, kind)
+    SELECT (2 << 40) + u.id,
+           u.username || ' ' || u.first_name || ' ' || u.last_name,
+           COALESCE(p.major || ' ' || p.year || ' ' || p.bio || ' ' || p.hometown || ' ' || p.workplace, ''),
+           'person'
+    FROM auth_user u LEFT JOIN polls_userprofile p ON p.user_id = u.id
+    """,
+    "INSERT INTO search_index(search_index) VALUES ('optimize')",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_auth_user_email_index'),
+    ]
+
+    operations = [
+        # An FTS5 virtual table isn't a model; see polls/search.py
+        migrations.RunSQL(CREATE_SQL + FILL_SQL, 'DROP TABLE IF EXISTS search_index'),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0015_friend_suggestions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='category',
+            field=models.CharField(choices=[('academic', 'Academic'), ('social', 'Social'), ('sports', 'Sports'), ('arts', 'Arts & Music'), ('career', 'Career'), ('clubs', 'Clubs'), ('other', 'Other')], default='other', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['date', 'event_id'], name='event_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['category', 'date', 'event_id'], name='event_category_date_idx'),
+        ),
+    ]
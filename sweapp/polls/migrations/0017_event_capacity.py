@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0016_event_category'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='waitlist_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='eventrsvp',
+            name='waitlisted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='eventrsvp',
+            name='rsvp_status',
+            field=models.CharField(choices=[('going', 'Going'), ('maybe', 'Maybe'), ('not_going', 'Not Going'), ('waitlisted', 'Waitlisted')], default='going', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='eventrsvp',
+            index=models.Index(fields=['event', 'rsvp_status', 'waitlisted_at', 'id'], name='rsvp_waitlist_idx'),
+        ),
+    ]
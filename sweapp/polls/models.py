@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
 
+from .storage import media_storage
+
 
 class UserProfile(models.Model):
     """Extended user profile with additional fields"""
@@ -11,7 +13,19 @@ class UserProfile(models.Model):
     year = models.CharField(max_length=20, blank=True, default='')
     workplace = models.CharField(max_length=200, blank=True, default='')
     hometown = models.CharField(max_length=200, blank=True, default='')
-    profile_picture = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
+    # Stored under a hash of the content, so identical uploads share a file
+    profile_picture = models.ImageField(upload_to='profile_pics/', storage=media_storage, null=True, blank=True)
+    # Set once the resized copies of profile_picture exist (see thumbnails.py)
+    thumbnail_key = models.CharField(max_length=64, blank=True, default='', editable=False)
+    # Comma-separated, normalized by matching.parse_classes/parse_interests
+    classes = models.CharField(max_length=500, blank=True, default='')
+    interests = models.CharField(max_length=500, blank=True, default='')
+    # The matching toggles: Study Matching (shared classes) and Friend
+    # Matching (interests and hobbies)
+    study_matching = models.BooleanField(default=True)
+    friend_matching = models.BooleanField(default=True)
+    # Lets every process's matching index pick up edits (see matching.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return f"Profile of {self.user.username}"
@@ -50,14 +64,50 @@ class Post(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='posts', null=True, blank=True)
+    # Set when the audience was too large to push into timelines; readers
+    # merge these posts in at read time instead (see polls/timeline.py)
+    fanout_on_read = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Timeline backfill reads an author's / group's newest posts
+            models.Index(fields=['created_by', '-timestamp', '-post_id'], name='post_author_idx'),
+            models.Index(fields=['group', '-timestamp', '-post_id'], name='post_group_idx'),
+            # Small partial indexes for the fan-out-on-read side of a timeline
+            models.Index(
+                fields=['created_by', '-timestamp', '-post_id'],
+                condition=models.Q(fanout_on_read=True),
+                name='post_fanout_author_idx',
+            ),
+            models.Index(
+                fields=['group', '-timestamp', '-post_id'],
+                condition=models.Q(fanout_on_read=True),
+                name='post_fanout_group_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"Post by {self.created_by.username} at {self.timestamp}"
 
 
+class TimelineEntry(models.Model):
+    """A post delivered into one user's materialized feed"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copy of post.timestamp so a timeline page is a range scan on one index
+    timestamp = models.DateTimeField()
+    
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-post'], name='timeline_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Post {self.post_id} in {self.user_id}'s timeline"
+
+
 class Message(models.Model):
     """Represents a message sent between users"""
     message_id = models.AutoField(primary_key=True)
@@ -66,47 +116,239 @@ class Message(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # "<lower user id>_<higher user id>", the same for both directions so a
+    # conversation's history is one range scan on message_pair_idx
+    pair_key = models.CharField(max_length=41, editable=False, default='')
+    # Provisional id broadcast before a write-behind save; unique so a
+    # retried batch can't insert the same message twice
+    client_id = models.CharField(max_length=32, unique=True, null=True, blank=True, editable=False)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['pair_key', '-message_id'], name='message_pair_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username} to {self.receiver.username}"
+    
+    @staticmethod
+    def make_pair_key(user_id, other_id):
+        low, high = sorted((int(user_id), int(other_id)))
+        return f"{low}_{high}"
+    
+    def save(self, *args, **kwargs):
+        if not self.pair_key:
+            self.pair_key = self.make_pair_key(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
+
+
+class Conversation(models.Model):
+    """Inbox summary for one pair of users; user_a always has the lower id"""
+    user_a = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_b = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Messages not yet read by user_a / user_b respectively
+    unread_a = models.IntegerField(default=0)
+    unread_b = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('user_a', 'user_b')
+        indexes = [
+            models.Index(fields=['user_a', '-last_message_at'], name='conversation_a_recent_idx'),
+            models.Index(fields=['user_b', '-last_message_at'], name='conversation_b_recent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Conversation between {self.user_a_id} and {self.user_b_id}"
+    
+    @staticmethod
+    def pair(user_id, other_id):
+        """Canonical (user_a, user_b) ordering for two user ids"""
+        return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+    
+    @classmethod
+    def for_user(cls, user):
+        """A user's conversations, most recent first"""
+        return cls.objects.filter(
+            models.Q(user_a=user) | models.Q(user_b=user)
+        ).order_by('-last_message_at')
+    
+    def other_user(self, user):
+        return self.user_b if self.user_a_id == user.id else self.user_a
+    
+    def unread_for(self, user):
+        return self.unread_a if self.user_a_id == user.id else self.unread_b
+    
+    @classmethod
+    def record_message(cls, message):
+        """Fold a newly saved Message into its pair's summary row"""
+        cls.record_messages([message])
+    
+    @classmethod
+    def record_messages(cls, messages):
+        """
+        Fold newly saved Messages into their pairs' summary rows.
+        
+        One UPDATE per pair bumps the receivers' unread counts and moves
+        last_message forward, never backwards, so out-of-order saves can't
+        show an older preview.
+        """
+        summaries = {}
+        for message in messages:
+            pair = cls.pair(message.sender_id, message.receiver_id)
+            summary = summaries.setdefault(pair, {'unread_a': 0, 'unread_b': 0, 'last': message})
+            summary['unread_a' if message.receiver_id == pair[0] else 'unread_b'] += 1
+            if message.message_id > summary['last'].message_id:
+                summary['last'] = message
+        
+        for (user_a, user_b), summary in summaries.items():
+            last = summary['last']
+            is_newer = models.Q(last_message_at__isnull=True) | models.Q(last_message_at__lte=last.timestamp)
+            changes = {
+                'unread_a': models.F('unread_a') + summary['unread_a'],
+                'unread_b': models.F('unread_b') + summary['unread_b'],
+                'last_message_id': models.Case(
+                    models.When(is_newer, then=models.Value(last.message_id)),
+                    default=models.F('last_message_id'),
+                    output_field=models.IntegerField(),
+                ),
+                'last_message_at': models.Case(
+                    models.When(is_newer, then=models.Value(last.timestamp)),
+                    default=models.F('last_message_at'),
+                    output_field=models.DateTimeField(),
+                ),
+            }
+            
+            if cls.objects.filter(user_a_id=user_a, user_b_id=user_b).update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        user_a_id=user_a,
+                        user_b_id=user_b,
+                        last_message=last,
+                        last_message_at=last.timestamp,
+                        unread_a=summary['unread_a'],
+                        unread_b=summary['unread_b'],
+                    )
+            except IntegrityError:
+                # Someone else created the row first; apply our update to theirs
+                cls.objects.filter(user_a_id=user_a, user_b_id=user_b).update(**changes)
+    
+    @classmethod
+    def mark_read(cls, reader_id, other_id):
+        """Zero the reader's unread count for their conversation with other_id"""
+        user_a, user_b = cls.pair(reader_id, other_id)
+        unread_field = 'unread_a' if reader_id == user_a else 'unread_b'
+        cls.objects.filter(user_a_id=user_a, user_b_id=user_b).update(**{unread_field: 0})
+
+
+# Maps an EventRSVP.rsvp_status to the Event counter column that tallies it
+RSVP_COUNT_FIELDS = {
+    'going': 'going_count',
+    'maybe': 'maybe_count',
+    'not_going': 'not_going_count',
+    'waitlisted': 'waitlist_count',
+}
 
 
 class Event(models.Model):
     """Represents an event hosted by either a user or a group"""
+    CATEGORY_CHOICES = [
+        ('academic', 'Academic'),
+        ('social', 'Social'),
+        ('sports', 'Sports'),
+        ('arts', 'Arts & Music'),
+        ('career', 'Career'),
+        ('clubs', 'Clubs'),
+        ('other', 'Other'),
+    ]
+    
     event_id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=200)
     description = models.TextField()
     date = models.DateTimeField()
     location = models.CharField(max_length=200, blank=True, default='')
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES, default='other')
     hosted_by_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='hosted_events', null=True, blank=True)
     hosted_by_group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='hosted_events', null=True, blank=True)
     attendees = models.ManyToManyField(User, related_name='attending_events', through='EventRSVP', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized RSVP tallies, kept in step with EventRSVP by event_rsvp and
+    # the delete signals; `manage.py rebuild_rsvp_counts` recomputes them.
+    going_count = models.IntegerField(default=0)
+    maybe_count = models.IntegerField(default=0)
+    not_going_count = models.IntegerField(default=0)
+    waitlist_count = models.IntegerField(default=0)
+    # Most people who can be going; None for no limit (see polls/rsvp.py)
+    capacity = models.PositiveIntegerField(null=True, blank=True)
     
     class Meta:
         ordering = ['date']
+        # Listing pages are (date, event_id) keyset range scans, with or
+        # without a category filter (see polls/events.py)
+        indexes = [
+            models.Index(fields=['date', 'event_id'], name='event_date_idx'),
+            models.Index(fields=['category', 'date', 'event_id'], name='event_category_date_idx'),
+        ]
     
     def __str__(self):
         host = self.hosted_by_user.username if self.hosted_by_user else self.hosted_by_group.name
         return f"{self.title} hosted by {host}"
+    
+    @property
+    def is_full(self):
+        return self.capacity is not None and self.going_count >= self.capacity
+    
+    @classmethod
+    def adjust_rsvp_counts(cls, event_id, old_status=None, new_status=None, claim_seat=False):
+        """
+        Move one RSVP from old_status to new_status in a single UPDATE.
+        
+        With claim_seat, the UPDATE only happens if the event has a seat
+        left (going_count < capacity), so concurrent claims can't oversell
+        it; returns whether it happened.
+        """
+        if old_status == new_status:
+            return True
+        changes = {}
+        if old_status in RSVP_COUNT_FIELDS:
+            field = RSVP_COUNT_FIELDS[old_status]
+            changes[field] = models.F(field) - 1
+        if new_status in RSVP_COUNT_FIELDS:
+            field = RSVP_COUNT_FIELDS[new_status]
+            changes[field] = models.F(field) + 1
+        if not changes:
+            return True
+        events = cls.objects.filter(event_id=event_id)
+        if claim_seat:
+            events = events.filter(models.Q(capacity__isnull=True) | models.Q(going_count__lt=models.F('capacity')))
+        return events.update(**changes) > 0
 
 
 class EventRSVP(models.Model):
     """Tracks user RSVPs for events"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    event = models.ForeignKey(Event, on_delete=models.CASCADE)
-    rsvp_status = models.CharField(max_length=20, choices=[
+    STATUS_CHOICES = [
         ('going', 'Going'),
         ('maybe', 'Maybe'),
-        ('not_going', 'Not Going')
-    ], default='going')
+        ('not_going', 'Not Going'),
+        ('waitlisted', 'Waitlisted'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    rsvp_status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='going')
     rsvp_at = models.DateTimeField(auto_now_add=True)
+    # When a full event's waitlist was joined; first come, first promoted
+    waitlisted_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         unique_together = ('user', 'event')
+        indexes = [
+            models.Index(fields=['event', 'rsvp_status', 'waitlisted_at', 'id'], name='rsvp_waitlist_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.event.title}: {self.rsvp_status}"
@@ -122,9 +364,31 @@ class Friendship(models.Model):
         ('rejected', 'Rejected')
     ], default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Lets every process's friend graph pick up changes (see friend_graph.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     class Meta:
         unique_together = ('user', 'friend')
     
     def __str__(self):
         return f"{self.user.username} -> {self.friend.username}: {self.status}"
+
+
+class FriendSuggestion(models.Model):
+    """
+    "People you may know": friends of friends ranked by mutual friends,
+    recomputed in bulk by `manage.py recompute_friend_suggestions`
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friend_suggestions')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    mutual_friends = models.IntegerField()
+    computed_at = models.DateTimeField()
+    
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [
+            models.Index(fields=['user', '-mutual_friends', 'suggested'], name='suggestion_rank_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} -> {self.suggested_id}: {self.mutual_friends} mutual"
@@ -0,0 +1,136 @@
+"""
+Live Notifications
+
+Small delta events pushed to a user's NotificationConsumer so pages update
+without reloading: unread message bumps, incoming friend requests and RSVPs
+to events they host.
+
+How it works:
+1. Views and the chat write path call the notify_* helpers below
+2. Each helper waits for the surrounding transaction to commit, then
+   group_sends one event to notify_<user_id>
+3. NotificationConsumer buffers what arrives and sends the browser one
+   merged frame per NOTIFY_COALESCE_INTERVAL (see coalesce())
+
+Notifications are best effort: if the channel layer is down the write that
+triggered them still succeeds, and the next page load shows the truth.
+"""
+
+import logging
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# A burst of events (e.g. someone sending ten messages in a row) reaches the
+# browser as one frame at most this often (seconds)
+NOTIFY_COALESCE_INTERVAL = 0.5
+
+
+def notification_group(user_id):
+    """Channel layer group for one user's notification sockets"""
+    return f'notify_{user_id}'
+
+
+def notify(user_id, kind, **payload):
+    """Push an event to a user once the current transaction commits"""
+    group_send_on_commit(notification_group(user_id), {'type': 'notify', 'kind': kind, **payload})
+
+
+def group_send_on_commit(group, event):
+    """
+    group_send from sync code once the current transaction commits.
+
+    Failures are logged, never raised: whatever triggered the event has
+    already been saved.
+    """
+    transaction.on_commit(lambda: _send(group, event))
+
+
+def _send(group, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(group, event)
+    except Exception as e:
+        logger.warning('could not send', extra={'group': group, 'error': str(e)})
+
+
+def notify_unread(messages):
+    """One unread bump per (receiver, sender) pair for newly saved Messages"""
+    bumps = Counter((message.receiver_id, message.sender_id) for message in messages)
+    for (receiver_id, sender_id), count in bumps.items():
+        if receiver_id != sender_id:
+            notify(receiver_id, 'unread', sender_id=sender_id, count=count)
+
+
+def notify_friend_request(friendship):
+    notify(
+        friendship.friend_id,
+        'friend_request',
+        friendship_id=friendship.id,
+        from_user_id=friendship.user_id,
+        from_username=friendship.user.username,
+    )
+
+
+def notify_rsvp(event, user, old_status, new_status):
+    """Tell the host someone changed their RSVP; old_status is None for a new one"""
+    # Group-hosted events have no host to tell
+    if event.hosted_by_user_id is None or event.hosted_by_user_id == user.id:
+        return
+    notify(
+        event.hosted_by_user_id,
+        'rsvp',
+        event_id=event.event_id,
+        title=event.title,
+        from_user_id=user.id,
+        from_username=user.username,
+        old_status=old_status,
+        new_status=new_status,
+    )
+
+
+def coalesce(events):
+    """
+    Merge buffered notify events into one frame for the browser.
+
+    Unread bumps add up per sender, and each person's RSVP changes to an
+    event collapse into one net change (dropped if they changed back).
+    """
+    unread = Counter()
+    rsvps = {}
+    friend_requests = []
+    for event in events:
+        if event['kind'] == 'unread':
+            unread[event['sender_id']] += event['count']
+        elif event['kind'] == 'friend_request':
+            friend_requests.append({
+                'friendship_id': event['friendship_id'],
+                'user_id': event['from_user_id'],
+                'username': event['from_username'],
+            })
+        elif event['kind'] == 'rsvp':
+            key = (event['event_id'], event['from_user_id'])
+            if key in rsvps:
+                rsvps[key]['new_status'] = event['new_status']
+            else:
+                rsvps[key] = {
+                    'event_id': event['event_id'],
+                    'title': event['title'],
+                    'user_id': event['from_user_id'],
+                    'username': event['from_username'],
+                    'old_status': event['old_status'],
+                    'new_status': event['new_status'],
+                }
+
+    return {
+        'type': 'notifications',
+        'unread': [{'sender_id': sender_id, 'count': count} for sender_id, count in unread.items()],
+        'friend_requests': friend_requests,
+        'rsvps': [rsvp for rsvp in rsvps.values() if rsvp['old_status'] != rsvp['new_status']],
+    }
@@ -0,0 +1,173 @@
+"""
+Presence and Typing
+
+Who is online is kept in memory, never in the database. Every open
+WebSocket (chat or presence) registers itself in this process's
+PresenceRegistry and refreshes its entry with heartbeats from the browser.
+
+How it works:
+1. connect() / disconnect() track the open connections of each user; the
+   first connection brings a user online, closing the last takes them offline
+2. Those transitions are broadcast to the channel layer group
+   presence_<user_id>, which pages showing that user listen to
+3. Other processes learn about users they don't host from those broadcasts
+   (observe()), and forget them once the announced TTL runs out
+4. A connection that stops heart-beating without disconnecting (a dropped
+   network) expires after PRESENCE_TIMEOUT
+
+Limit: a process only knows about remote users from broadcasts it has
+received, and it only receives a user's broadcasts once something here
+watches them. So the snapshot a page gets when it starts watching shows a
+user connected to another daphne process as offline until that process
+re-announces them on a heartbeat, up to HEARTBEAT_INTERVAL later; the
+"presence" event that follows corrects it.
+
+TypingThrottle coalesces a burst of keystrokes into at most one "typing"
+event per TYPING_INTERVAL, and only announces "stopped" if "typing" was sent.
+"""
+
+import threading
+import time
+
+# Browsers send a heartbeat this often (seconds)
+HEARTBEAT_INTERVAL = 25
+
+# A connection (or a remote user) with no heartbeat for this long is gone
+PRESENCE_TIMEOUT = 60
+
+# At most one "typing" event per user per conversation in this window
+TYPING_INTERVAL = 3
+
+# Upper bound on how many users a single page may watch
+MAX_WATCHED_USERS = 200
+
+
+def presence_group(user_id):
+    """Channel layer group that carries a user's presence changes"""
+    return f'presence_{user_id}'
+
+
+class PresenceRegistry:
+    """
+    In-memory record of which users are online, for one process.
+    """
+
+    def __init__(self, timeout=PRESENCE_TIMEOUT, heartbeat_interval=HEARTBEAT_INTERVAL, clock=time.monotonic):
+        self.timeout = timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        # user_id -> {channel_name: last heartbeat}
+        self._local = {}
+        # user_id -> when a remote process's announcement runs out
+        self._remote = {}
+        # user_id -> when this process last announced the user as online
+        self._announced = {}
+
+    def connect(self, user_id, channel_name):
+        """Register a connection; True if that brought the user online"""
+        with self._lock:
+            was_online = self._is_online(user_id)
+            self._local.setdefault(user_id, {})[channel_name] = self.clock()
+            if not was_online:
+                self._announced[user_id] = self.clock()
+            return not was_online
+
+    def disconnect(self, user_id, channel_name):
+        """Forget a connection; True if that took the user offline"""
+        with self._lock:
+            channels = self._local.get(user_id)
+            if not channels or channels.pop(channel_name, None) is None:
+                return False
+            if not channels:
+                del self._local[user_id]
+                self._announced.pop(user_id, None)
+                # We were hosting them, so whatever we heard second hand
+                # about them came from our own broadcasts
+                self._remote.pop(user_id, None)
+            return not self._is_online(user_id)
+
+    def heartbeat(self, user_id, channel_name):
+        """
+        Refresh a connection. True if it's time to re-announce the user so
+        other processes don't let them expire.
+        """
+        with self._lock:
+            now = self.clock()
+            # Expired meanwhile (e.g. a long network stall): back online
+            was_online = self._is_online(user_id)
+            self._local.setdefault(user_id, {})[channel_name] = now
+            if not was_online or now - self._announced.get(user_id, float('-inf')) >= self.heartbeat_interval:
+                self._announced[user_id] = now
+                return True
+            return False
+
+    def observe(self, user_id, online):
+        """Record a presence broadcast, usually from another process"""
+        with self._lock:
+            if online:
+                self._remote[user_id] = self.clock() + self.timeout
+            else:
+                self._remote.pop(user_id, None)
+
+    def expire(self):
+        """Drop silent connections and stale remote users; returns users we took offline"""
+        with self._lock:
+            now = self.clock()
+            gone = []
+            for user_id, channels in list(self._local.items()):
+                for channel_name, seen in list(channels.items()):
+                    if now - seen > self.timeout:
+                        del channels[channel_name]
+                if not channels:
+                    del self._local[user_id]
+                    self._announced.pop(user_id, None)
+                    gone.append(user_id)
+            for user_id, until in list(self._remote.items()):
+                if until <= now:
+                    del self._remote[user_id]
+            return [user_id for user_id in gone if not self._is_online(user_id)]
+
+    def is_online(self, user_id):
+        with self._lock:
+            return self._is_online(user_id)
+
+    def online(self, user_ids):
+        """The subset of user_ids that are online"""
+        with self._lock:
+            return {user_id for user_id in user_ids if self._is_online(user_id)}
+
+    def _is_online(self, user_id):
+        if self._local.get(user_id):
+            return True
+        return self._remote.get(user_id, float('-inf')) > self.clock()
+
+
+class TypingThrottle:
+    """
+    Coalesces one connection's typing signals into rate-limited events.
+    """
+
+    def __init__(self, interval=TYPING_INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self._last_sent = None
+
+    def typing(self):
+        """True if a "typing" event should go out now"""
+        now = self.clock()
+        if self._last_sent is not None and now - self._last_sent < self.interval:
+            return False
+        self._last_sent = now
+        return True
+
+    def stopped(self):
+        """True if a "stopped typing" event should go out now"""
+        if self._last_sent is None:
+            return False
+        self._last_sent = None
+        return True
+
+
+# One registry per process; consumers share it
+registry = PresenceRegistry()
@@ -0,0 +1,73 @@
+"""
+Read/Write Database Routing
+
+settings.DATABASES has two aliases:
+- 'default': the primary; every write, and every read that isn't routed
+  below
+- 'replica': a read-only connection (PRAGMA query_only). Today it opens the
+  same SQLite file, so under WAL its reads never wait on writers; point it
+  at a real replica later without touching any view
+
+Only the queries of read-only requests (GET/HEAD/OPTIONS) go to the
+replica, and only outside transactions. Everything that might need to read
+its own writes stays on the primary: POST handlers, atomic blocks,
+consumers and background threads.
+"""
+
+import contextvars
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+READ_ONLY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return REPLICA_DB_ALIAS
+        # Explicit, or Django would follow an instance read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadReplicaMiddleware:
+    """Lets the router send a read-only request's queries to the replica"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _use_replica.set(request.method in READ_ONLY_METHODS)
+        try:
+            return self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+    async def __acall__(self, request):
+        token = _use_replica.set(request.method in READ_ONLY_METHODS)
+        try:
+            return await self.get_response(request)
+        finally:
+            _use_replica.reset(token)
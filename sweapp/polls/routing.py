@@ -14,4 +14,10 @@ websocket_urlpatterns = [
     # When a user connects to ws://localhost:8000/ws/chat/5/
     # It will connect to ChatConsumer and pass user_id=5
     re_path(r'ws/chat/(?P<user_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    # Online/offline status for the people shown on a page
+    re_path(r'ws/presence/$', consumers.PresenceConsumer.as_asgi()),
+    # Per-user live notifications (unread counts, friend requests, RSVPs)
+    re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
+    # New posts pushed to an open feed
+    re_path(r'ws/feed/$', consumers.FeedConsumer.as_asgi()),
 ]
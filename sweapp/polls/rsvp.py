@@ -0,0 +1,110 @@
+"""
+RSVPs, Capacity and the Waitlist
+
+An event with a capacity has that many seats; going_count is how many are
+taken. When tickets open a few hundred students can RSVP within a second,
+so a seat is claimed by one conditional UPDATE on the event row,
+
+    UPDATE polls_event SET going_count = going_count + 1, ...
+    WHERE event_id = ? AND (capacity IS NULL OR going_count < capacity)
+
+which either takes a seat or changes nothing, and the event can't be
+oversold however the RSVPs interleave. Nothing is read and then written
+back, and nothing is locked beyond that one short transaction.
+
+Someone who asks to go to a full event is waitlisted instead, stamped with
+waitlisted_at. Whenever a seat is given up (going -> maybe/not_going, or
+the RSVP deleted with its user) the longest-waiting people are promoted to
+going, again through the conditional UPDATE, so a seat freed twice at once
+can't be handed out twice.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .agenda import invalidate_agendas
+from .models import Event, EventRSVP
+from .notifications import notify_rsvp
+
+
+def set_rsvp(event, user, status):
+    """
+    Change the user's RSVP to `status` and return what it became: asking
+    for 'going' to a full event gives 'waitlisted' (or stays waitlisted).
+    Returns None if a concurrent request for the same user changed it
+    first, in which case nothing was changed.
+    """
+    with transaction.atomic():
+        current = EventRSVP.objects.filter(user=user, event=event).values_list('pk', 'rsvp_status').first()
+        old_status = current[1] if current else None
+
+        new_status = status
+        if status == 'going' and old_status != 'going':
+            if not Event.adjust_rsvp_counts(event.event_id, old_status, 'going', claim_seat=True):
+                new_status = 'waitlisted'
+        if new_status == old_status:
+            return old_status
+        if new_status != 'going':
+            Event.adjust_rsvp_counts(event.event_id, old_status, new_status)
+
+        fields = {
+            'rsvp_status': new_status,
+            'waitlisted_at': timezone.now() if new_status == 'waitlisted' else None,
+        }
+        if current:
+            # Only the request that actually flips the row keeps its counter
+            # changes, so concurrent double-submits can't drift them
+            changed = EventRSVP.objects.filter(pk=current[0], rsvp_status=old_status).update(**fields)
+        else:
+            try:
+                with transaction.atomic():
+                    EventRSVP.objects.create(user=user, event=event, **fields)
+                changed = True
+            except IntegrityError:
+                changed = False
+        if not changed:
+            transaction.set_rollback(True)
+            return None
+
+        notify_rsvp(event, user, old_status, new_status)
+        if 'going' in (old_status, new_status):
+            invalidate_agendas([user.id])
+        if old_status == 'going' and event.capacity is not None:
+            promote_waitlist(event)
+    return new_status
+
+
+def promote_waitlist(event):
+    """
+    Move the longest-waiting waitlisted RSVPs to going while there are
+    seats; returns the promoted users' ids. Call it in the transaction that
+    gave up the seat.
+    """
+    promoted = []
+    while True:
+        rsvp = (
+            EventRSVP.objects
+            .filter(event_id=event.event_id, rsvp_status='waitlisted')
+            .select_related('user')
+            .order_by('waitlisted_at', 'id')
+            .first()
+        )
+        if rsvp is None or not Event.adjust_rsvp_counts(event.event_id, 'waitlisted', 'going', claim_seat=True):
+            break
+        EventRSVP.objects.filter(pk=rsvp.pk).update(rsvp_status='going', waitlisted_at=None)
+        notify_rsvp(event, rsvp.user, 'waitlisted', 'going')
+        promoted.append(rsvp.user_id)
+    invalidate_agendas(promoted)
+    return promoted
+
+
+def waitlist_position(event, user):
+    """1 for the next person to be promoted, or None if not waitlisted"""
+    rsvp = EventRSVP.objects.filter(event=event, user=user, rsvp_status='waitlisted').first()
+    if rsvp is None:
+        return None
+    ahead = EventRSVP.objects.filter(event=event, rsvp_status='waitlisted').filter(
+        Q(waitlisted_at__lt=rsvp.waitlisted_at) | Q(waitlisted_at=rsvp.waitlisted_at, id__lt=rsvp.id)
+    )
+    return ahead.count() + 1
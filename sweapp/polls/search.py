@@ -0,0 +1,286 @@
+"""
+Full-Text Search (SQLite FTS5)
+
+One FTS5 table, search_index, holds every searchable document:
+- post: Post.content
+- event: Event.title, description and location
+- person: username and name, plus UserProfile.major, year, bio, hometown
+  and workplace
+
+Each row's rowid is the object's primary key with its kind code in the
+high bits ((code << KIND_SHIFT) + pk), so keeping the index in sync is a
+single rowid upsert or delete from the signal handlers in
+polls/signals.py, with no lookup table, and each kind is a contiguous
+rowid range that FTS5 seeks to directly when filtering by kind.
+`manage.py rebuild_search_index` refills it from scratch with set-based
+INSERT ... SELECTs.
+
+User input is never passed through as FTS5 syntax: it's split into words,
+each quoted, and the last one is a prefix match so results appear as the
+user types. FTS5 answers a prefix from a prefix index only if one exists
+for exactly that length; any other length merges every matching document
+first, O(matches). So there are indexes for 2-6 characters (about 60% more
+index), a longer last word is cut to 6 (a slightly wider match) and a
+one-letter last word is matched whole.
+
+Ranking and its cost:
+bm25 (titles weighted above bodies, configured once as the table's default
+rank) must score every match and count each term's documents, so a query
+matching a large share of millions of rows takes seconds. Instead:
+1. Count the query's newest matches, up to SEARCH_RANK_LIMIT. Walking the
+   index in rowid order and stopping early costs well under a millisecond
+2. If that's all of them, rank them by bm25 (a few ms)
+3. Otherwise the query is too broad for relevance to mean much; serve the
+   newest matches first (people, then events, then posts, as rowids
+   sort), which is just as cheap
+Words like "the" and "for" are dropped from multi-word queries, since even
+one very common word makes bm25 count a huge document list.
+"""
+
+import re
+
+from django.contrib.auth.models import User
+from django.db import connections, router
+from django.urls import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .events import event_url
+from .models import Event, Post
+
+SEARCH_TABLE = 'search_index'
+
+KINDS = {'post': 0, 'event': 1, 'person': 2}
+KIND_SHIFT = 40
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE = 50
+
+# Words of a query that are used; anything beyond is ignored
+SEARCH_MAX_TERMS = 8
+
+# Queries with more matches than this are ordered newest first, not by bm25
+SEARCH_RANK_LIMIT = 1000
+
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have i in is it its of on or so that the this to was we were '
+    'will with you'.split()
+)
+
+SNIPPET_TOKENS = 24
+
+PREFIX_LENGTHS = (2, 3, 4, 5, 6)
+
+# Markers FTS5 wraps matches in; the text is HTML-escaped before they're
+# turned into <mark> tags, so user content can't inject markup
+_OPEN, _CLOSE = '\x02', '\x03'
+
+_WORD = re.compile(r'\w+')
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        title, body, kind UNINDEXED,
+        tokenize = 'porter unicode61 remove_diacritics 2',
+        prefix = '{' '.join(map(str, PREFIX_LENGTHS))}'
+    )
+    """,
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0, 0.0)')",
+]
+
+DROP_SQL = f'DROP TABLE IF EXISTS {SEARCH_TABLE}'
+
+# Column order: rowid, title, body, kind
+REBUILD_SQL = [
+    f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, title, body, kind)
+    SELECT ({KINDS['post']} << {KIND_SHIFT}) + post_id, '', content, 'post'
+    FROM polls_post
+    """,
+    f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, title, body, kind)
+    SELECT ({KINDS['event']} << {KIND_SHIFT}) + event_id, title,
+           description || ' ' || location, 'event'
+    FROM polls_event
+    """,
+    f"""
+    INSERT INTO {SEARCH_TABLE}(rowid, title, body, kind)
+    SELECT ({KINDS['person']} << {KIND_SHIFT}) + u.id,
+           u.username || ' ' || u.first_name || ' ' || u.last_name,
+           COALESCE(p.major || ' ' || p.year || ' ' || p.bio || ' ' || p.hometown || ' ' || p.workplace, ''),
+           'person'
+    FROM auth_user u LEFT JOIN polls_userprofile p ON p.user_id = u.id
+    """,
+]
+
+
+def rebuild_index(cursor):
+    """
+    (Re)create the index and fill it from the posts, events and users
+    tables. Dropping it is much faster than deleting every row, and picks
+    up changes to CREATE_SQL.
+    """
+    cursor.execute(DROP_SQL)
+    for sql in CREATE_SQL:
+        cursor.execute(sql)
+    counts = {}
+    for kind, sql in zip(KINDS, REBUILD_SQL):
+        cursor.execute(sql)
+        counts[kind] = cursor.rowcount
+    # Merge the b-trees the bulk insert left behind into one
+    cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return counts
+
+
+def _rowid(kind, pk):
+    return (KINDS[kind] << KIND_SHIFT) + pk
+
+
+def _pk(rowid):
+    return rowid & ((1 << KIND_SHIFT) - 1)
+
+
+def _write(kind, pk, title, body):
+    with connections[router.db_for_write(Post)].cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {SEARCH_TABLE}(rowid, title, body, kind) VALUES (%s, %s, %s, %s)',
+            [_rowid(kind, pk), title, body, kind],
+        )
+
+
+def remove(kind, pk):
+    with connections[router.db_for_write(Post)].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [_rowid(kind, pk)])
+
+
+def index_post(post):
+    _write('post', post.post_id, '', post.content)
+
+
+def index_event(event):
+    _write('event', event.event_id, event.title, f'{event.description} {event.location}')
+
+
+def index_person(user, profile=None):
+    title = f'{user.username} {user.first_name} {user.last_name}'
+    body = ''
+    if profile is not None:
+        body = ' '.join([profile.major, profile.year, profile.bio, profile.hometown, profile.workplace])
+    _write('person', user.id, title, body)
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH expression for free text typed by a user, or None if it has
+    no words. Every word must match; the last one may be a prefix.
+    """
+    words = _WORD.findall(query.lower())
+    words = [word for word in words if word not in STOPWORDS] or words
+    words = words[:SEARCH_MAX_TERMS]
+    if not words:
+        return None
+    *words, last = words
+    terms = [f'"{word}"' for word in words]
+    if len(last) < PREFIX_LENGTHS[0]:
+        terms.append(f'"{last}"')
+    else:
+        terms.append(f'"{last[:PREFIX_LENGTHS[-1]]}"*')
+    return ' '.join(terms)
+
+
+def _highlighted(text):
+    return mark_safe(escape(text).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>'))
+
+
+class SearchResult:
+    __slots__ = ('kind', 'object', 'title', 'snippet', 'url')
+
+    def __init__(self, kind, obj, title, snippet, url):
+        self.kind = kind
+        self.object = obj
+        self.title = title
+        self.snippet = snippet
+        self.url = url
+
+    def as_dict(self):
+        return {
+            'type': self.kind,
+            'id': self.object.pk,
+            'title': str(self.title),
+            'snippet': str(self.snippet),
+            'url': self.url,
+        }
+
+
+def search(query, kind=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    (results, has_more): up to `limit` matches for `query`, optionally of
+    one kind, best first (see the module docstring), as SearchResults with
+    their objects loaded, and whether there are matches after them. Two FTS
+    queries plus one query per kind present in the page.
+
+    Rows whose object has gone (e.g. deleted by a raw SQL cleanup) are
+    skipped, so a page can come back short; has_more counts FTS rows, so
+    it isn't thrown off by those.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return [], False
+    where = f'{SEARCH_TABLE} MATCH %s'
+    params = [expression]
+    if kind is not None:
+        where += ' AND rowid BETWEEN %s AND %s'
+        params += [_rowid(kind, 0), _rowid(kind, (1 << KIND_SHIFT) - 1)]
+
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT count(*) FROM (
+                SELECT rowid FROM {SEARCH_TABLE} WHERE {where} ORDER BY rowid DESC LIMIT %s
+            )
+            """,
+            params + [SEARCH_RANK_LIMIT + 1],
+        )
+        order = 'rank' if cursor.fetchone()[0] <= SEARCH_RANK_LIMIT else 'rowid DESC'
+        cursor.execute(
+            f"""
+            SELECT rowid, kind,
+                   highlight({SEARCH_TABLE}, 0, %s, %s),
+                   snippet({SEARCH_TABLE}, 1, %s, %s, '…', %s)
+            FROM {SEARCH_TABLE}
+            WHERE {where}
+            ORDER BY {order}
+            LIMIT %s OFFSET %s
+            """,
+            # One extra row tells us whether there's a next page
+            [_OPEN, _CLOSE, _OPEN, _CLOSE, SNIPPET_TOKENS] + params + [limit + 1, offset],
+        )
+        rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    ids = {name: [] for name in KINDS}
+    for rowid, row_kind, _, _ in rows:
+        ids[row_kind].append(_pk(rowid))
+    objects = {
+        'post': Post.objects.select_related('created_by__profile').in_bulk(ids['post']) if ids['post'] else {},
+        'event': Event.objects.in_bulk(ids['event']) if ids['event'] else {},
+        'person': User.objects.select_related('profile').in_bulk(ids['person']) if ids['person'] else {},
+    }
+
+    results = []
+    for rowid, row_kind, title, snippet in rows:
+        obj = objects[row_kind].get(_pk(rowid))
+        if obj is None:
+            continue
+        if row_kind == 'post':
+            title = escape(obj.created_by.username)
+            url = None
+        elif row_kind == 'event':
+            title = _highlighted(title)
+            url = event_url(obj)
+        else:
+            title = _highlighted(title.strip())
+            url = f"{reverse('messages')}?user_id={obj.pk}"
+        results.append(SearchResult(row_kind, obj, title, _highlighted(snippet), url))
+    return results, has_more
@@ -0,0 +1,136 @@
+"""
+Model signal handlers
+
+Keeps denormalized data (like the RSVP counters on Event, the per-user
+timelines, the search index, the matching index and the friend graph) and
+the cached request.user in sync with writes that don't go through a single
+view, e.g. cascades from deleting a User or edits in the admin.
+"""
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import friend_graph, matching, search
+from .backends import invalidate_user
+from .models import Event, EventRSVP, Friendship, GroupMembership, Post, UserProfile
+
+
+@receiver(post_delete, sender=EventRSVP)
+def release_rsvp_count(sender, instance, origin=None, **kwargs):
+    """Take a deleted RSVP back out of its event's counters"""
+    # When the event itself is being deleted its counters go with it, so
+    # skip the per-RSVP UPDATEs for that cascade.
+    if isinstance(origin, Event) or getattr(origin, 'model', None) is Event:
+        return
+    Event.adjust_rsvp_counts(instance.event_id, old_status=instance.rsvp_status)
+    if instance.rsvp_status == 'going':
+        # A seat came free (e.g. the user was deleted); give it to the waitlist
+        from .rsvp import promote_waitlist
+        event = Event.objects.filter(event_id=instance.event_id, waitlist_count__gt=0).first()
+        if event is not None:
+            promote_waitlist(event)
+
+
+@receiver(post_save, sender=GroupMembership)
+def backfill_group_timeline(sender, instance, created, **kwargs):
+    """Copy a group's recent posts into a new member's timeline"""
+    if created:
+        from .timeline import backfill_timeline
+        backfill_timeline(instance.user_id, group_ids=[instance.group_id])
+
+
+# Search index (see polls/search.py). Cascades (deleting a user deletes
+# their posts and events) send post_delete per object, so those rows go too.
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove('post', instance.post_id)
+
+
+@receiver(post_save, sender=Event)
+def index_event(sender, instance, update_fields=None, **kwargs):
+    # Counter-only saves don't touch the indexed text
+    if update_fields and not {'title', 'description', 'location'} & set(update_fields):
+        return
+    search.index_event(instance)
+
+
+@receiver(post_delete, sender=Event)
+def unindex_event(sender, instance, **kwargs):
+    search.remove('event', instance.event_id)
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, update_fields=None, **kwargs):
+    # Every login saves last_login alone; skip those
+    if update_fields and not {'username', 'first_name', 'last_name'} & set(update_fields):
+        return
+    try:
+        profile = instance.profile
+    except UserProfile.DoesNotExist:
+        profile = None
+    search.index_person(instance, profile)
+
+
+@receiver(post_save, sender=UserProfile)
+def index_profile(sender, instance, **kwargs):
+    search.index_person(instance.user, instance)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    search.remove('person', instance.id)
+
+
+# Matching index (see polls/matching.py); other processes catch up through
+# UserProfile.updated_at
+
+@receiver(post_save, sender=UserProfile)
+def update_match_profile(sender, instance, **kwargs):
+    # Not before commit: a rolled-back edit would otherwise stay in the index
+    transaction.on_commit(lambda: matching.update_profile(instance))
+
+
+@receiver(post_delete, sender=UserProfile)
+def remove_match_profile(sender, instance, **kwargs):
+    matching.remove_user(instance.user_id)
+
+
+# Friend graph (see polls/friend_graph.py); other processes catch up through
+# Friendship.updated_at
+
+@receiver(post_save, sender=Friendship)
+def update_friend_graph(sender, instance, **kwargs):
+    transaction.on_commit(lambda: friend_graph.apply_friendship(instance))
+
+
+# Deleting a user cascades to their Friendship rows, so this covers them too
+@receiver(post_delete, sender=Friendship)
+def remove_from_friend_graph(sender, instance, **kwargs):
+    transaction.on_commit(lambda: friend_graph.remove_friendship(instance))
+
+
+# Cached request.user (see polls/backends.py): a password change, a
+# deactivated account or a deleted user must take effect on the next
+# request, not when the cache entry times out
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Read now: deleting clears instance.id before the commit
+    user_id = instance.id
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user(user_id))
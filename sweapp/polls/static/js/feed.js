@@ -0,0 +1,178 @@
+/*
+ * FEED: topic tags, search filter, infinite scroll and live posts
+ *
+ * The first page of posts is rendered by the server. When the sentinel under
+ * the posts scrolls into view we ask /polls/feed/posts/ for the next page,
+ * passing back the opaque cursor from the previous response, and append the
+ * returned posts. The server sends next_cursor = null on the last page.
+ *
+ * New posts are pushed over a WebSocket (FeedConsumer) in batched frames and
+ * prepended, so the feed stays current without re-fetching the page.
+ */
+
+const tags = document.querySelectorAll('.tag');
+const searchInput = document.getElementById('searchInput');
+const postsContainer = document.getElementById('postsMasonry');
+const sentinel = document.getElementById('feedSentinel');
+
+let nextCursor = postsContainer.dataset.nextCursor || null;
+let loading = false;
+
+function activeTopic() {
+  return document.querySelector('.tag.active')?.dataset.topic || 'all';
+}
+
+function setActiveTag(topic) {
+  tags.forEach(t => t.classList.toggle('active', t.dataset.topic === topic));
+  filterPosts(topic, searchInput.value.trim());
+}
+
+function filterPosts(topic, search) {
+  // Query the DOM each time so posts loaded by scrolling are included
+  postsContainer.querySelectorAll('.post').forEach(p => applyFilter(p, topic, search));
+}
+
+function applyFilter(post, topic, search) {
+  const matchesTopic = (topic === 'all') || (post.dataset.topic === topic);
+  const text = post.innerText.toLowerCase();
+  const matchesSearch = !search || text.includes(search.toLowerCase());
+  post.style.display = (matchesTopic && matchesSearch) ? 'inline-block' : 'none';
+}
+
+// Build a post card matching the server-rendered markup in feed.html.
+// Text goes in through textContent so post content can't inject HTML.
+function renderPost(post) {
+  const article = document.createElement('article');
+  article.className = 'post';
+  article.dataset.topic = 'all';
+  article.dataset.postId = post.post_id;
+
+  const head = document.createElement('div');
+  head.className = 'post-head';
+
+  const avatarWrap = document.createElement('div');
+  avatarWrap.className = 'post-avatar';
+  if (post.author.profile_picture) {
+    const img = document.createElement('img');
+    img.src = post.author.profile_picture;
+    img.alt = post.author.username;
+    img.loading = 'lazy';
+    img.style.cssText = 'width:40px;height:40px;border-radius:50%;object-fit:cover;';
+    if (post.author.profile_picture_webp !== post.author.profile_picture) {
+      // Same markup as the {% avatar %} tag: WebP first, JPEG fallback
+      const picture = document.createElement('picture');
+      picture.style.display = 'contents';
+      const source = document.createElement('source');
+      source.type = 'image/webp';
+      source.srcset = post.author.profile_picture_webp;
+      picture.append(source, img);
+      avatarWrap.appendChild(picture);
+    } else {
+      avatarWrap.appendChild(img);
+    }
+  } else {
+    const initial = document.createElement('div');
+    initial.style.cssText = 'width:40px;height:40px;border-radius:50%;background:#ffd7bf;display:flex;align-items:center;justify-content:center;font-weight:700;color:#8b5a3c;';
+    initial.textContent = post.author.username.slice(0, 1).toUpperCase();
+    avatarWrap.appendChild(initial);
+  }
+
+  const who = document.createElement('div');
+  const name = document.createElement('strong');
+  name.textContent = post.author.username;
+  const meta = document.createElement('div');
+  meta.className = 'meta';
+  meta.textContent = '@' + post.author.username + ' · ' + post.timesince + ' ago';
+  who.appendChild(name);
+  who.appendChild(meta);
+
+  head.appendChild(avatarWrap);
+  head.appendChild(who);
+
+  const text = document.createElement('div');
+  text.className = 'text';
+  text.textContent = post.content;
+
+  article.appendChild(head);
+  article.appendChild(text);
+  return article;
+}
+
+async function loadNextPage() {
+  if (loading || !nextCursor) return;
+  loading = true;
+  sentinel.textContent = 'Loading…';
+
+  try {
+    const url = postsContainer.dataset.postsUrl + '?cursor=' + encodeURIComponent(nextCursor);
+    const response = await fetch(url, { headers: { 'Accept': 'application/json' } });
+    if (!response.ok) throw new Error('HTTP ' + response.status);
+    const data = await response.json();
+
+    const topic = activeTopic();
+    const search = searchInput.value.trim();
+    data.posts.forEach(post => {
+      const article = renderPost(post);
+      applyFilter(article, topic, search);
+      postsContainer.appendChild(article);
+    });
+
+    nextCursor = data.next_cursor;
+    sentinel.textContent = nextCursor ? '' : 'You\'re all caught up';
+    loading = false;
+    // The observer only fires on changes, so keep going while the sentinel
+    // is still on screen (e.g. a tall window with short pages)
+    if (nextCursor && sentinel.getBoundingClientRect().top < window.innerHeight + 600) {
+      loadNextPage();
+    }
+  } catch (err) {
+    console.error('Failed to load more posts:', err);
+    sentinel.textContent = '';
+    loading = false;
+  }
+}
+
+tags.forEach(t => t.addEventListener('click', () => setActiveTag(t.dataset.topic)));
+searchInput.addEventListener('input', () => {
+  filterPosts(activeTopic(), searchInput.value.trim());
+});
+
+if (nextCursor && 'IntersectionObserver' in window) {
+  const observer = new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+  }, { rootMargin: '600px 0px' });
+  observer.observe(sentinel);
+}
+
+// Live posts: each frame carries every post published since the last one,
+// newest first. Insert oldest first so the newest ends up on top.
+function prependPosts(posts) {
+  const placeholder = postsContainer.querySelector('.post[data-placeholder]');
+  if (placeholder && posts.length) placeholder.remove();
+
+  const topic = activeTopic();
+  const search = searchInput.value.trim();
+  posts.slice().reverse().forEach(post => {
+    if (postsContainer.querySelector('.post[data-post-id="' + post.post_id + '"]')) return;
+    const article = renderPost(post);
+    applyFilter(article, topic, search);
+    postsContainer.prepend(article);
+  });
+}
+
+function connectFeedSocket() {
+  const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+  const socket = new WebSocket(protocol + '//' + window.location.host + '/ws/feed/');
+
+  socket.onmessage = function(e) {
+    const data = JSON.parse(e.data);
+    if (data.type === 'posts') prependPosts(data.posts);
+  };
+
+  // Reconnect after a dropped connection
+  socket.onclose = function() {
+    setTimeout(connectFeedSocket, 5000);
+  };
+}
+
+connectFeedSocket();
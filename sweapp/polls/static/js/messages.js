@@ -0,0 +1,63 @@
+/*
+ * LIVE PRESENCE FOR THE CONVERSATIONS SIDEBAR
+ *
+ * Opens a WebSocket to PresenceConsumer, tells it which users the sidebar
+ * shows, then flips their dots as they come online or go offline. The
+ * server pushes every change, so nothing here polls.
+ */
+
+// Match HEARTBEAT_INTERVAL in presence.py
+const PRESENCE_HEARTBEAT_MS = 25000;
+
+// Typing timings for the chat script in messages.html: stop announcing
+// after a pause, and hide the other side's indicator if it isn't refreshed
+// (the server re-sends "typing" at most every 3 seconds)
+const TYPING_IDLE_MS = 4000;
+const TYPING_EXPIRY_MS = 6000;
+
+(function() {
+    const items = document.querySelectorAll('.user-item[data-user-id]');
+    if (!items.length) return;
+
+    const userIds = Array.from(items, item => Number(item.dataset.userId));
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    let socket = null;
+    let heartbeat = null;
+
+    function setOnline(userId, online) {
+        document.querySelectorAll('.user-item[data-user-id="' + userId + '"] .presence-dot').forEach(dot => {
+            dot.classList.toggle('online', online);
+            dot.title = online ? 'Online' : 'Offline';
+        });
+    }
+
+    function connect() {
+        socket = new WebSocket(protocol + '//' + window.location.host + '/ws/presence/');
+
+        socket.onopen = function() {
+            socket.send(JSON.stringify({'type': 'watch', 'user_ids': userIds}));
+            heartbeat = setInterval(function() {
+                socket.send(JSON.stringify({'type': 'heartbeat'}));
+            }, PRESENCE_HEARTBEAT_MS);
+        };
+
+        socket.onmessage = function(e) {
+            const data = JSON.parse(e.data);
+            if (data.type === 'presence_snapshot') {
+                const online = new Set(data.online);
+                userIds.forEach(userId => setOnline(userId, online.has(userId)));
+            } else if (data.type === 'presence') {
+                setOnline(data.user_id, data.online);
+            }
+        };
+
+        // Reconnect after a dropped connection; the snapshot on reconnect
+        // catches up on anything missed meanwhile
+        socket.onclose = function() {
+            clearInterval(heartbeat);
+            setTimeout(connect, 5000);
+        };
+    }
+
+    connect();
+})();
@@ -0,0 +1,119 @@
+/*
+ * LIVE NOTIFICATIONS
+ *
+ * Connects to NotificationConsumer and applies the small delta frames it
+ * pushes to whatever the current page shows:
+ * - the bell in the header counts everything new since the page loaded
+ * - messages: bumps the unread badge of the sender in the sidebar
+ * - profile: adds incoming friend requests to the Friend Requests panel
+ * - events: moves the "attending" count on events you host
+ *
+ * The server already merges bursts into one frame, so this just renders.
+ */
+
+(function() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const bell = document.getElementById('notifyBell');
+    let unseen = 0;
+
+    function bumpBell(count) {
+        if (!bell || !count) return;
+        unseen += count;
+        let badge = bell.querySelector('.notify-count');
+        if (!badge) {
+            badge = document.createElement('span');
+            badge.className = 'notify-count';
+            bell.appendChild(badge);
+        }
+        badge.textContent = unseen;
+    }
+
+    if (bell) {
+        bell.addEventListener('click', function() {
+            unseen = 0;
+            const badge = bell.querySelector('.notify-count');
+            if (badge) badge.remove();
+        });
+    }
+
+    function applyUnread(bump) {
+        const item = document.querySelector('.user-item[data-user-id="' + bump.sender_id + '"]');
+        // The open chat shows the messages themselves
+        if (item && item.classList.contains('active')) return 0;
+        if (item) {
+            let badge = item.querySelector('.unread-badge');
+            if (!badge) {
+                badge = document.createElement('span');
+                badge.className = 'unread-badge';
+                badge.textContent = '0';
+                item.appendChild(badge);
+            }
+            badge.textContent = Number(badge.textContent) + bump.count;
+        }
+        return bump.count;
+    }
+
+    function applyFriendRequest(request) {
+        const panel = document.getElementById('friend-requests-panel');
+        if (!panel) return;
+        const list = panel.querySelector('.friend-requests');
+        const respondUrl = action => panel.dataset[action + 'Url'].replace('/0/', '/' + request.friendship_id + '/');
+
+        const row = document.createElement('div');
+        row.className = 'friend-request';
+        const avatar = document.createElement('div');
+        avatar.className = 'friend-avatar';
+        avatar.textContent = request.username.slice(0, 1).toUpperCase();
+        const info = document.createElement('div');
+        info.style.flex = '1';
+        const name = document.createElement('strong');
+        name.textContent = request.username;
+        const note = document.createElement('div');
+        note.style.cssText = 'font-size:12px;color:var(--muted);';
+        note.textContent = 'wants to be friends';
+        info.append(name, note);
+        const actions = document.createElement('div');
+        actions.className = 'friend-actions';
+        const accept = document.createElement('a');
+        accept.className = 'accept-btn';
+        accept.href = respondUrl('accept');
+        accept.textContent = '✓';
+        const reject = document.createElement('a');
+        reject.className = 'reject-btn';
+        reject.href = respondUrl('reject');
+        reject.textContent = '✕';
+        actions.append(accept, reject);
+        row.append(avatar, info, actions);
+
+        list.prepend(row);
+        panel.hidden = false;
+    }
+
+    function applyRsvp(rsvp) {
+        const count = document.querySelector('.event-card[data-event-id="' + rsvp.event_id + '"] .rsvp-going');
+        if (!count) return;
+        const delta = (rsvp.new_status === 'going') - (rsvp.old_status === 'going');
+        count.textContent = Math.max(0, Number(count.textContent) + delta);
+    }
+
+    function connect() {
+        const socket = new WebSocket(protocol + '//' + window.location.host + '/ws/notifications/');
+
+        socket.onmessage = function(e) {
+            const data = JSON.parse(e.data);
+            if (data.type !== 'notifications') return;
+
+            let fresh = 0;
+            data.unread.forEach(bump => { fresh += applyUnread(bump); });
+            data.friend_requests.forEach(applyFriendRequest);
+            data.rsvps.forEach(applyRsvp);
+            bumpBell(fresh + data.friend_requests.length + data.rsvps.length);
+        };
+
+        socket.onclose = function() {
+            setTimeout(connect, 5000);
+        };
+    }
+
+    connect();
+})();
@@ -0,0 +1,95 @@
+"""
+Content-Addressed Media Storage
+
+Uploads are stored under the SHA-256 of their bytes instead of the name the
+browser sent, e.g. profile_pics/3f/3fa9...c1.jpg. Two people uploading the
+same photo share one file, and since a name can only ever hold one content,
+media.py can tell browsers to cache these files forever.
+
+How it works:
+1. _save() streams the upload chunk by chunk into a temporary file next to
+   its destination, hashing as it goes (never holding the file in memory)
+2. The temp file is renamed to its hash name; if that name already exists
+   the bytes are identical, so the copy is simply dropped
+3. delete() is a no-op, because other rows may point at the same file;
+   unreferenced files can be swept offline
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_ALGORITHM = 'sha256'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names files by the hash of their content.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content is hashed in
+        # _save(); identical content is meant to land on the same name
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+
+        digest = hashlib.new(HASH_ALGORITHM)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        fd, temp_path = tempfile.mkstemp(dir=full_directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            name = posixpath.join(directory, hexdigest[:2], hexdigest + extension)
+            final_path = self.path(name)
+            if os.path.exists(final_path):
+                # Same bytes already stored: dedupe
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                # mkstemp creates files readable by the owner only
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, final_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return name.replace('\\', '/')
+
+    def delete(self, name):
+        # Content is shared between every row that uploaded the same bytes
+        pass
+
+
+def is_content_addressed(name):
+    """True for names produced by ContentAddressedStorage (<dir>/<aa>/<hash>.<ext>)"""
+    parts = name.split('/')
+    if len(parts) < 2:
+        return False
+    stem = posixpath.splitext(parts[-1])[0]
+    return (
+        len(stem) == hashlib.new(HASH_ALGORITHM).digest_size * 2
+        and parts[-2] == stem[:2]
+        and all(c in '0123456789abcdef' for c in stem)
+    )
+
+
+def media_storage():
+    """Storage for user uploads; a callable so migrations don't pin settings"""
+    return ContentAddressedStorage()
@@ -0,0 +1,56 @@
+"""
+Avatar template helpers
+
+    {% load avatars %}
+    {% avatar profile 40 alt=user.username style="border-radius:50%" %}
+    <img src="{{ profile|thumbnail:96 }}">
+
+Both pick the smallest thumbnail that covers the requested display size
+and fall back to the original upload until thumbnails exist.
+"""
+
+from django import template
+from django.utils.html import format_html
+
+from ..thumbnails import pick_size, thumbnail_url
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(profile, size):
+    """JPEG thumbnail URL for a display size in pixels"""
+    return thumbnail_url(profile, int(size)) or ''
+
+
+@register.simple_tag
+def avatar(profile, size, alt='', style='', css_class=''):
+    """
+    <picture> with a WebP source and JPEG fallback, 1x and 2x.
+
+    Renders nothing if the profile has no picture.
+    """
+    if not profile or not profile.profile_picture:
+        return ''
+
+    size = int(size)
+    if not profile.thumbnail_key:
+        return format_html(
+            '<img src="{}" alt="{}" width="{}" height="{}" class="{}" style="{}" loading="lazy" decoding="async">',
+            profile.profile_picture.url, alt, size, size, css_class, style,
+        )
+
+    def srcset(extension):
+        one_x = thumbnail_url(profile, size, extension)
+        two_x = thumbnail_url(profile, pick_size(size) + 1, extension)
+        return one_x if one_x == two_x else f'{one_x} 1x, {two_x} 2x'
+
+    return format_html(
+        # display:contents keeps <picture> out of the parent's layout, so
+        # the <img> sizes against the avatar container like before
+        '<picture style="display:contents">'
+        '<source type="image/webp" srcset="{}">'
+        '<img src="{}" srcset="{}" alt="{}" width="{}" height="{}" class="{}" style="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        srcset('webp'), thumbnail_url(profile, size), srcset('jpg'), alt, size, size, css_class, style,
+    )
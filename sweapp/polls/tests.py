@@ -1,3 +1,1756 @@
-from django.test import TestCase
+"""
+Query budgets, database concurrency and search
 
-# Create your tests here.
+Every page and the chat socket are rendered against a realistically sized
+dataset and must stay within a fixed number of queries. The budgets don't
+depend on how much data there is, so a change that adds a query per post,
+event, conversation or friend request (an N+1) fails here.
+
+Requests are measured warm (session and user already cached), which is
+what nearly every request in production is. When a budget legitimately
+changes, update it together with the change and say why in the commit.
+
+SQLiteConcurrencyTests checks that the connection settings keep concurrent
+writers from failing with "database is locked".
+
+SearchTests covers the FTS5 index: kept in sync by signals, ranked,
+highlighted and safe against FTS syntax and markup in what users type.
+
+MatchingTests covers study/friend matching: ranking, the two toggles and
+incremental updates of the in-process index.
+
+FriendGraphTests covers mutual friends and friend-of-friend suggestions:
+live from the in-process graph, and stored by the nightly command.
+
+EventListingTests covers the events page and API (date windows, category
+filters, keyset paging) and the streamed iCalendar export.
+
+EventCapacityTests covers capacity-limited RSVPs: the ordered waitlist
+and its promotion, and hundreds of concurrent RSVPs never overbooking.
+
+AgendaTests covers the cached upcoming-events agenda shared by the feed and
+profile pages: when it's invalidated and when it expires.
+
+ChannelLayerTests covers the SQLite channel layer between two instances on
+one file: sends, groups, expiry, capacity and flush.
+
+MessageWriterTests covers write-behind chat persistence: batching by size
+and interval, retries without duplicates, and draining on stop().
+
+MediaServingTests covers serve_media's conditional and Range requests.
+
+UserCacheTests covers the cached request.user being dropped on any change
+to the User or its profile.
+
+LoginLoggingTests checks failed logins don't write the address to the log.
+
+TimelineTests covers the fan-out timelines behind the feed: paging across
+pushed and pulled posts, trimming, and backfills on new friends and groups.
+
+ConversationTests covers the inbox summaries: kept up to date as messages
+are sent and read, and equal to what rebuild_conversations computes.
+
+PresenceTests covers online tracking (tabs, heartbeats, expiry) and the
+typing throttle, on a fake clock.
+
+NotificationTests covers merging notification bursts into one frame, and
+the notification socket hearing about changes only once they commit.
+
+LiveFeedTests covers new posts pushed to an open feed: only from friends
+and the user's groups, and a burst merged into one frame.
+
+ThumbnailTests covers avatar thumbnails: sizes, formats, EXIF rotation,
+keys that change with the picture, and the backfill command.
+
+ContentAddressedStorageTests covers hash-named uploads: dedupe, distinct
+names for distinct bytes, and no temp files left by failed uploads.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from datetime import timedelta
+from io import BytesIO, StringIO
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from polls.management.commands.rebuild_conversations import build_conversations
+from polls import agenda, events as event_listing, friend_graph, matching, notifications, search, thumbnails
+from polls.backends import user_cache_key
+from polls.chat_writer import MessageWriter
+from polls.consumers import FeedConsumer, NotificationConsumer
+from polls.layers import SQLiteChannelLayer
+from polls.live_feed import broadcast_post
+from polls.log import email_fields
+from polls.presence import PresenceRegistry, TypingThrottle
+from polls.storage import ContentAddressedStorage, is_content_addressed
+from polls.models import (
+    Conversation, Event, EventRSVP, FriendSuggestion, Friendship, Group, GroupMembership, Message, Post,
+    TimelineEntry, UserProfile,
+)
+from polls.timeline import TIMELINE_MAX_LENGTH, get_timeline_page, publish, rebuild_timeline, trim_timeline
+
+USERS = 60
+POSTS_PER_USER = 8
+EVENTS = 40
+MESSAGES_PER_CONVERSATION = 15
+
+TEST_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'CHAT_WRITE_BEHIND': False,
+    'WARM_INDEXES_ON_STARTUP': False,
+}
+
+
+def seed_dataset():
+    """
+    A campus slice around `me`: friends and pending requests, groups, posts,
+    past and upcoming events with RSVPs, and conversations with history.
+    """
+    rng = random.Random(2024)
+    now = timezone.now()
+
+    users = User.objects.bulk_create([
+        User(username=f'student{i}', email=f'student{i}@example.edu') for i in range(USERS)
+    ])
+    me, others = users[0], users[1:]
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, major=rng.choice(['CS', 'Math', 'Biology']), bio='Hello') for user in users
+    ])
+
+    friends, requesters = others[:25], others[25:35]
+    Friendship.objects.bulk_create(
+        [Friendship(user=me, friend=friend, status='accepted') for friend in friends]
+        + [Friendship(user=friend, friend=me, status='accepted') for friend in friends]
+        + [Friendship(user=user, friend=me, status='pending') for user in requesters]
+    )
+
+    groups = [Group.objects.create(name=f'Group {i}', description='Study group', created_by=me) for i in range(4)]
+    GroupMembership.objects.bulk_create([
+        GroupMembership(user=user, group=group) for group in groups for user in [me] + rng.sample(others, 10)
+    ])
+
+    Post.objects.bulk_create([
+        Post(content=f'Post {i} by {user.username}', created_by=user, group=rng.choice(groups + [None] * 4))
+        for user in users for i in range(POSTS_PER_USER)
+    ])
+    rebuild_timeline(me.id)
+
+    events = Event.objects.bulk_create([
+        Event(
+            title=f'Event {i}',
+            description='Campus event',
+            date=now + timedelta(days=i - EVENTS // 4),
+            hosted_by_user=me if i % 5 == 0 else rng.choice(others),
+        )
+        for i in range(EVENTS)
+    ])
+    rsvps = [
+        EventRSVP(user=user, event=event, rsvp_status=rng.choice(['going', 'going', 'maybe', 'not_going']))
+        for event in events for user in rng.sample(users, 12)
+    ]
+    EventRSVP.objects.bulk_create(rsvps)
+    for rsvp in rsvps:
+        Event.adjust_rsvp_counts(rsvp.event_id, new_status=rsvp.rsvp_status)
+
+    messages = []
+    for other in friends[:12]:
+        for i in range(MESSAGES_PER_CONVERSATION):
+            sender, receiver = (me, other) if i % 2 else (other, me)
+            messages.append(Message(
+                sender=sender,
+                receiver=receiver,
+                content=f'Message {i}',
+                pair_key=Message.make_pair_key(sender.id, receiver.id),
+                is_read=i < MESSAGES_PER_CONVERSATION - 3,
+            ))
+    Message.objects.bulk_create(messages)
+    build_conversations(Message, Conversation)
+
+    return me, friends, events
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.me, cls.friends, cls.events = seed_dataset()
+
+    def setUp(self):
+        # The locmem cache outlives each test's rollback, and ids are reused
+        cache.clear()
+        self.client.force_login(self.me)
+        # Warm the session and user caches, as for any returning visitor,
+        # and the friend graph, as server startup does
+        self.client.get('/polls/feed/')
+        friend_graph.reset_graph()
+        friend_graph.get_graph()
+
+    def assertMaxQueries(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = func(*args, **kwargs)
+        executed = '\n'.join(query['sql'] for query in queries.captured_queries)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{len(queries)} queries, budget is {budget}:\n{executed}'
+        )
+        return result
+
+    def test_feed_view(self):
+        # The upcoming events come from the cached agenda
+        response = self.assertMaxQueries(2, self.client.get, '/polls/feed/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['posts']), 20)
+
+    def test_feed_posts_api(self):
+        first = self.client.get('/polls/feed/posts/').json()
+        response = self.assertMaxQueries(2, self.client.get, '/polls/feed/posts/', {'cursor': first['next_cursor']})
+        self.assertEqual(len(response.json()['posts']), 20)
+
+    def test_events_view(self):
+        response = self.assertMaxQueries(2, self.client.get, '/polls/events/')
+        self.assertEqual(response.status_code, 200)
+        # One page of the upcoming events
+        self.assertEqual(len(response.context['events_with_data']), event_listing.EVENT_PAGE_SIZE)
+        self.assertTrue(response.context['next_params'])
+
+    def test_messages_view(self):
+        response = self.assertMaxQueries(1, self.client.get, '/polls/messages/')
+        self.assertEqual(len(response.context['conversations']), 12)
+
+    def test_messages_view_open_conversation(self):
+        response = self.assertMaxQueries(
+            5, self.client.get, '/polls/messages/', {'user_id': self.friends[0].id}
+        )
+        self.assertEqual(len(response.context['conversation_messages']), MESSAGES_PER_CONVERSATION)
+
+    def test_profile_view(self):
+        # The friend count comes from the friend graph and the upcoming
+        # events from the cached agenda
+        response = self.assertMaxQueries(4, self.client.get, '/polls/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['friend_count'], 25)
+        self.assertEqual(len(response.context['pending_requests']), 10)
+
+    def test_event_rsvp(self):
+        event = self.events[-1]
+        self.assertMaxQueries(8, self.client.post, f'/polls/event/{event.event_id}/rsvp/', {'status': 'going'})
+        # Changing an existing RSVP
+        self.assertMaxQueries(6, self.client.post, f'/polls/event/{event.event_id}/rsvp/', {'status': 'maybe'})
+        event.refresh_from_db()
+        self.assertEqual(EventRSVP.objects.get(user=self.me, event=event).rsvp_status, 'maybe')
+
+    def test_search_view(self):
+        with connection.cursor() as cursor:
+            search.rebuild_index(cursor)
+        response = self.assertMaxQueries(5, self.client.get, '/polls/search/', {'q': 'even'})
+        self.assertEqual(len(response.context['results']), search.SEARCH_PAGE_SIZE)
+        self.assertTrue(response.context['has_more'])
+
+    def chat_session(self, friend, count):
+        """Queries for one ChatConsumer connection that sends `count` messages"""
+        from sweapp.asgi import application
+
+        async def chat():
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{friend.id}/')
+            communicator.scope['user'] = self.me
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            for i in range(count):
+                await communicator.send_to(text_data=json.dumps({'message': f'hi {i}'}))
+                reply = json.loads(await communicator.receive_from())
+                self.assertEqual(reply['message'], f'hi {i}')
+            await communicator.disconnect()
+
+        # database_sync_to_async runs on this thread under async_to_sync,
+        # so the consumer's queries are captured on this connection
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(chat)()
+        return len(queries)
+
+    def test_chat_consumer_message(self):
+        friend = self.friends[0]
+        sent_before = Message.objects.filter(sender=self.me, receiver=friend).count()
+
+        one = self.chat_session(friend, 1)
+        eleven = self.chat_session(friend, 11)
+        # Connecting resolves the peer once
+        self.assertLessEqual(one, 1 + 4)
+        # Each further message is the insert plus the inbox summary update,
+        # in a transaction; no lookups
+        self.assertLessEqual((eleven - one) / 10, 4)
+        self.assertEqual(Message.objects.filter(sender=self.me, receiver=friend).count(), sent_before + 12)
+
+
+class SQLiteConcurrencyTests(unittest.TestCase):
+    """
+    Many threads writing at once, as under daphne: each transaction reads a
+    counter, does a little work and writes it back. With SQLite's defaults
+    some of them fail with "database is locked"; with the settings in
+    DATABASES none do and no update is lost.
+
+    Each run uses its own throwaway database file, not the test database
+    (a plain unittest.TestCase, so Django doesn't block the extra alias).
+    """
+
+    THREADS = 8
+    TRANSACTIONS = 20
+
+    def run_writers(self, options):
+        """(errors, final counter) after THREADS x TRANSACTIONS concurrent read-modify-writes"""
+        alias = 'concurrency'
+        with tempfile.TemporaryDirectory() as directory:
+            database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'db.sqlite3'),
+                        'OPTIONS': options}
+            # configure_settings() fills in the defaults; it insists on a 'default'
+            connections.settings[alias] = connections.configure_settings({'default': database, alias: database})[alias]
+            try:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('CREATE TABLE counter (id integer PRIMARY KEY, value integer NOT NULL)')
+                    cursor.execute('INSERT INTO counter VALUES (1, 0)')
+                connections[alias].close()
+
+                errors = []
+                start = threading.Barrier(self.THREADS)
+
+                def writer():
+                    start.wait()
+                    try:
+                        for _ in range(self.TRANSACTIONS):
+                            try:
+                                with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                                    cursor.execute('SELECT value FROM counter WHERE id = 1')
+                                    value = cursor.fetchone()[0]
+                                    time.sleep(0.001)
+                                    cursor.execute('UPDATE counter SET value = %s WHERE id = 1', [value + 1])
+                            except OperationalError as e:
+                                errors.append(str(e))
+                    finally:
+                        connections[alias].close()
+
+                threads = [threading.Thread(target=writer) for _ in range(self.THREADS)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('SELECT value FROM counter WHERE id = 1')
+                    value = cursor.fetchone()[0]
+                connections[alias].close()
+                return errors, value
+            finally:
+                del connections[alias]
+                del connections.settings[alias]
+
+    def test_default_sqlite_settings_lock(self):
+        errors, value = self.run_writers({})
+        self.assertTrue(any('locked' in error for error in errors))
+        self.assertLess(value, self.THREADS * self.TRANSACTIONS)
+
+    def test_tuned_settings_do_not_lock(self):
+        errors, value = self.run_writers(settings.DATABASES['default']['OPTIONS'])
+        self.assertEqual(errors, [])
+        self.assertEqual(value, self.THREADS * self.TRANSACTIONS)
+
+
+@override_settings(**TEST_SETTINGS)
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = User.objects.create_user('searcher', first_name='Sam')
+        UserProfile.objects.create(user=cls.me, major='Biology', bio='Birdwatching on weekends')
+        cls.post = Post.objects.create(content='Anyone up for a chemistry study session tonight?', created_by=cls.me)
+        cls.event = Event.objects.create(
+            title='Chemistry review', description='Final exam prep', location='Library 2F',
+            date=timezone.now() + timedelta(days=3), hosted_by_user=cls.me,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.me)
+
+    def api(self, **params):
+        return self.client.get('/polls/search/api/', params).json()['results']
+
+    def test_ranks_titles_above_bodies(self):
+        results = self.api(q='chemistry')
+        self.assertEqual([(r['type'], r['id']) for r in results], [('event', self.event.event_id), ('post', self.post.post_id)])
+        self.assertEqual(results[0]['title'], '<mark>Chemistry</mark> review')
+        self.assertIn('<mark>chemistry</mark> study', results[1]['snippet'])
+
+    def test_prefix_stemming_and_kind_filter(self):
+        self.assertEqual([r['type'] for r in self.api(q='studying chem')], ['post'])
+        self.assertEqual([r['id'] for r in self.api(q='bio', type='person')], [self.me.id])
+        self.assertEqual(self.api(q='chemistry', type='person'), [])
+
+    def test_broad_queries_newest_first(self):
+        posts = [Post.objects.create(content=f'Lab notes {i}', created_by=self.me) for i in range(3)]
+        with mock.patch.object(search, 'SEARCH_RANK_LIMIT', 2):
+            results = self.api(q='lab')
+        self.assertEqual([r['id'] for r in results], [post.post_id for post in reversed(posts)])
+
+    def test_next_page_despite_vanished_rows(self):
+        posts = [Post.objects.create(content=f'Lab notes {i}', created_by=self.me) for i in range(3)]
+        # Gone without a signal, so its index row stays
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM polls_post WHERE post_id = %s', [posts[1].post_id])
+        with mock.patch.object(search, 'SEARCH_RANK_LIMIT', 0), mock.patch.object(search, 'SEARCH_PAGE_SIZE', 2):
+            first = self.client.get('/polls/search/api/', {'q': 'lab'}).json()
+            second = self.client.get('/polls/search/api/', {'q': 'lab', 'page': 2}).json()
+        self.assertEqual([r['id'] for r in first['results']], [posts[2].post_id])
+        self.assertEqual(first['next_page'], 2)
+        self.assertEqual([r['id'] for r in second['results']], [posts[0].post_id])
+        self.assertIsNone(second['next_page'])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.post.content = 'Lost my calculator'
+        self.post.save()
+        self.assertEqual([r['type'] for r in self.api(q='chemistry')], ['event'])
+        self.assertEqual(len(self.api(q='calculator')), 1)
+
+        self.event.delete()
+        self.assertEqual(self.api(q='chemistry'), [])
+
+        self.me.delete()
+        self.assertEqual(self.api(q='calculator'), [])
+        self.assertEqual(self.api(q='sam'), [])
+
+    def test_user_input_is_not_fts_syntax_or_markup(self):
+        Post.objects.create(content='<script>alert(1)</script> chemistry', created_by=self.me)
+        for q in ['"chem', 'chemistry OR', 'title:chemistry', 'NEAR(chemistry', '*', ')(']:
+            response = self.client.get('/polls/search/api/', {'q': q})
+            self.assertIn(response.status_code, (200, 400), q)
+        snippets = [r['snippet'] for r in self.api(q='chemistry alert')]
+        self.assertEqual(snippets, ['&lt;script&gt;<mark>alert</mark>(1)&lt;/script&gt; <mark>chemistry</mark>'])
+
+
+@override_settings(**TEST_SETTINGS)
+class MatchingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        def student(name, classes, interests, **fields):
+            user = User.objects.create_user(name)
+            UserProfile.objects.create(user=user, classes=classes, interests=interests, **fields)
+            return user
+
+        cls.me = student('me', 'CSCI 3340, MATH 2413', 'hiking, chess', major='Computer Science')
+        cls.classmate = student('classmate', 'csci 3340,  math 2413', 'chess')
+        cls.hiker = student('hiker', 'CSCI 3340', 'Hiking, Chess', study_matching=False)
+        cls.friend = student('friend', 'HIST 1301', 'hiking')
+        cls.stranger = student('stranger', 'BIOL 1301', 'poetry', major='Computer Science')
+        Friendship.objects.bulk_create([
+            Friendship(user=cls.me, friend=cls.friend, status='accepted'),
+            Friendship(user=cls.friend, friend=cls.me, status='accepted'),
+        ])
+
+    def setUp(self):
+        # The index lives in the process, outside each test's transaction
+        matching.reset_index()
+        cache.clear()
+        self.client.force_login(self.me)
+
+    def matches(self, mode):
+        response = self.client.get('/polls/matches/api/', {'mode': mode})
+        return [(match['username'], match['shared']) for match in response.json()['matches']]
+
+    def test_study_matching(self):
+        # hiker has study matching off; friend and stranger share no class
+        self.assertEqual(self.matches('study'), [('classmate', ['CSCI 3340', 'MATH 2413'])])
+        response = self.client.get('/polls/matches/')
+        self.assertEqual([m.user for m in response.context['sections'][0]['matches']], [self.classmate])
+        self.assertContains(response, 'MATH 2413')
+
+    def test_friend_matching_leaves_out_friends(self):
+        self.assertEqual(self.matches('friend'), [('hiker', ['hiking', 'chess']), ('classmate', ['chess'])])
+
+    def test_edit_profile_updates_index_incrementally(self):
+        self.matches('study')
+        index = matching.get_index()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/polls/profile/edit/', {'classes': 'hist 1301', 'interests': 'chess', 'friend_matching': 'on'})
+        with CaptureQueriesContext(connection) as queries:
+            found = self.matches('study')
+        self.assertIs(matching.get_index(), index)
+        # No reload: the edit was applied to the row in place
+        self.assertFalse(any('FROM "polls_userprofile"' in query['sql'] for query in queries.captured_queries))
+        # Study matching was unticked, so no study matches and no appearing in others'
+        self.assertEqual(found, [])
+        self.assertEqual(index.top(self.friend.id, 'study'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/polls/profile/edit/', {'classes': 'hist 1301', 'study_matching': 'on'})
+        self.assertEqual(self.matches('study'), [('friend', ['HIST 1301'])])
+
+    def test_edits_from_other_processes_are_synced(self):
+        self.matches('study')
+        # As another process would: saved without this process's signal
+        UserProfile.objects.filter(user=self.stranger).update(classes='CSCI 3340', updated_at=timezone.now())
+        matching.get_index().checked_at = 0
+        self.assertEqual([name for name, _ in self.matches('study')], ['classmate', 'stranger'])
+
+    def test_equal_profiles_score_equally_across_batches(self):
+        twin = User.objects.create_user('twin')
+        UserProfile.objects.create(user=twin, classes='CSCI 3340, MATH 2413', interests='chess')
+        index = matching.get_index()
+        index.sync()
+        # classmate is in the first batch, twin in a later one
+        with mock.patch.object(matching, 'MATCH_BATCH_ROWS', 2):
+            found = {user_id: score for user_id, score, _ in index.top(self.me.id, 'study')}
+        self.assertAlmostEqual(found[twin.id], found[self.classmate.id])
+        self.assertAlmostEqual(found[twin.id], 1.0)
+
+
+@override_settings(**TEST_SETTINGS)
+class FriendGraphTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        names = ['me', 'ann', 'bob', 'cat', 'xena', 'yuri', 'pat']
+        cls.users = {name: User.objects.create_user(name) for name in names}
+        u = cls.users
+        rows = []
+        for a, b in [('me', 'ann'), ('me', 'bob'), ('me', 'cat'), ('ann', 'xena'), ('bob', 'xena'),
+                     ('cat', 'yuri'), ('ann', 'pat')]:
+            rows += [Friendship(user=u[a], friend=u[b], status='accepted'),
+                     Friendship(user=u[b], friend=u[a], status='accepted')]
+        # pat (friends with ann) has asked to be friends with me
+        rows.append(Friendship(user=u['pat'], friend=u['me'], status='pending'))
+        Friendship.objects.bulk_create(rows)
+
+    def setUp(self):
+        # The graph lives in the process, outside each test's transaction
+        friend_graph.reset_graph()
+        cache.clear()
+        self.client.force_login(self.users['me'])
+
+    def suggestions(self):
+        response = self.client.get('/polls/friends/suggestions/')
+        return [(s['username'], s['mutual_friends']) for s in response.json()['suggestions']]
+
+    def test_mutual_friends_and_suggestions(self):
+        # pat has a request pending with me, so isn't suggested
+        self.assertEqual(self.suggestions(), [('xena', 2), ('yuri', 1)])
+        response = self.client.get(f"/polls/friends/mutual/{self.users['xena'].id}/")
+        self.assertEqual(response.json()['mutual_friends'], 2)
+        response = self.client.get('/polls/profile/')
+        self.assertEqual(response.context['friend_count'], 3)
+        self.assertEqual([r.mutual_friends for r in response.context['pending_requests']], [1])
+        self.assertContains(response, '1 mutual friend')
+
+    def test_accepting_a_request_updates_the_graph(self):
+        graph = friend_graph.get_graph()
+        request = Friendship.objects.get(user=self.users['pat'], friend=self.users['me'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f'/polls/friend/respond/{request.id}/accept/')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIs(friend_graph.get_graph(), graph)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(graph.friend_count(self.users['me'].id), 4)
+        self.assertEqual(graph.mutual_count(self.users['me'].id, self.users['ann'].id), 1)
+        self.assertEqual(self.suggestions(), [('xena', 2), ('yuri', 1)])
+
+    def test_changes_from_other_processes_are_synced(self):
+        graph = friend_graph.get_graph()
+        # As another process would: saved without this process's signal
+        Friendship.objects.filter(user=self.users['pat']).update(status='rejected', updated_at=timezone.now())
+        graph.checked_at = 0
+        self.assertEqual(friend_graph.get_graph().mutual_count(self.users['me'].id, self.users['pat'].id), 0)
+
+    def test_recompute_command_stores_suggestions(self):
+        call_command('recompute_friend_suggestions', stdout=open(os.devnull, 'w'))
+        stored = FriendSuggestion.objects.filter(user=self.users['me']).order_by('-mutual_friends')
+        self.assertEqual([(s.suggested.username, s.mutual_friends) for s in stored], [('xena', 2), ('yuri', 1)])
+        stored = FriendSuggestion.objects.filter(user=self.users['xena']).order_by('-mutual_friends')
+        self.assertEqual([(s.suggested.username, s.mutual_friends) for s in stored], [('me', 2), ('pat', 1)])
+
+        # Stored suggestions leave out anyone a request has been sent to since
+        self.client.post(f"/polls/friend/request/{self.users['xena'].id}/")
+        self.assertEqual(self.suggestions(), [('yuri', 1)])
+        response = self.client.get('/polls/matches/')
+        self.assertEqual([s.user for s in response.context['suggestions']], [self.users['yuri']])
+
+
+@override_settings(**TEST_SETTINGS)
+class EventListingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = User.objects.create_user('me')
+        host = User.objects.create_user('host')
+        now = timezone.now()
+
+        def event(title, days, category, hosted_by_user=host, **fields):
+            return Event.objects.create(
+                title=title, description=fields.pop('description', 'Campus event'), category=category,
+                date=now + timedelta(days=days), hosted_by_user=hosted_by_user, **fields
+            )
+
+        cls.old = event('Old Lecture', -3, 'academic')
+        cls.study = event('Study Jam', 1, 'academic', hosted_by_user=cls.me)
+        cls.soccer = event('Pickup Soccer', 2, 'sports')
+        cls.open_mic = event(
+            'Open Mic', 3, 'arts', location='Union, Room 2',
+            description='Sign up at the door; bring your own instrument.\n' + 'Poetry, music and comedy café. ' * 4,
+        )
+        cls.fair = event('Career Fair', 40, 'career')
+        EventRSVP.objects.bulk_create([
+            EventRSVP(user=cls.me, event=cls.soccer, rsvp_status='going'),
+            EventRSVP(user=cls.me, event=cls.open_mic, rsvp_status='maybe'),
+            EventRSVP(user=cls.me, event=cls.fair, rsvp_status='not_going'),
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.me)
+
+    def titles(self, **params):
+        response = self.client.get('/polls/events/api/', params)
+        self.assertEqual(response.status_code, 200)
+        return [event['title'] for event in response.json()['events']]
+
+    def test_windows_and_categories(self):
+        # Upcoming only by default, soonest first
+        self.assertEqual(self.titles(), ['Study Jam', 'Pickup Soccer', 'Open Mic', 'Career Fair'])
+        self.assertEqual(self.titles(category=['sports', 'arts']), ['Pickup Soccer', 'Open Mic'])
+        # An end date includes that whole day
+        soccer_day = timezone.localdate(self.soccer.date).isoformat()
+        past = timezone.localdate(self.old.date).isoformat()
+        self.assertEqual(self.titles(start=past, end=soccer_day), ['Old Lecture', 'Study Jam', 'Pickup Soccer'])
+
+        for params in ({'start': 'yesterday'}, {'category': 'parties'}, {'cursor': 'bogus'}):
+            self.assertEqual(self.client.get('/polls/events/api/', params).status_code, 400, params)
+        response = self.client.get('/polls/events/', {'start': 'yesterday'})
+        self.assertTrue(response.context['filter_error'])
+        self.assertEqual(len(response.context['events']), 4)
+
+    def test_paging(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 1, 'category': ['academic', 'arts', 'sports']}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.client.get('/polls/events/api/', params).json()
+            seen += [event['title'] for event in page['events']]
+            if not (cursor := page['next_cursor']):
+                break
+        self.assertEqual(seen, ['Study Jam', 'Pickup Soccer', 'Open Mic'])
+
+        with mock.patch.object(event_listing, 'EVENT_PAGE_SIZE', 2):
+            response = self.client.get('/polls/events/', {'category': 'academic'})
+        # Only Study Jam is upcoming, so no next page
+        self.assertEqual([e.title for e in response.context['events']], ['Study Jam'])
+        self.assertIsNone(response.context['next_params'])
+
+    async def test_calendar_streams_ics(self):
+        token = event_listing.calendar_token(self.me)
+        with mock.patch.object(event_listing, 'ICAL_CHUNK_SIZE', 1):
+            response = await self.async_client.get(f'/polls/events/calendar/{token}.ics')
+            self.assertTrue(response.streaming)
+            chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        # Header, one chunk per event, footer
+        self.assertEqual(len(chunks), 5)
+
+        body = b''.join(chunks).decode()
+        lines = body.split('\r\n')
+        self.assertEqual((lines[0], lines[-2], lines[-1]), ('BEGIN:VCALENDAR', 'END:VCALENDAR', ''))
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        unfolded = body.replace('\r\n ', '')
+        # Hosted, going and maybe; not the not-going or someone else's event
+        self.assertEqual(
+            [line[len('SUMMARY:'):] for line in unfolded.split('\r\n') if line.startswith('SUMMARY:')],
+            ['Study Jam', 'Pickup Soccer', 'Open Mic'],
+        )
+        self.assertIn('LOCATION:Union\\, Room 2\r\n', unfolded)
+        self.assertIn('instrument.\\nPoetry\\, music', unfolded)
+        self.assertIn('STATUS:TENTATIVE', unfolded)
+
+        response = await self.async_client.get(f'/polls/events/calendar/{token[:-1]}x.ics')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(**TEST_SETTINGS)
+class EventCapacityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user('host')
+        cls.students = [User.objects.create_user(f'student{i}') for i in range(4)]
+        cls.event = Event.objects.create(
+            title='Hack Night', description='Bring a laptop', date=timezone.now() + timedelta(days=1),
+            hosted_by_user=cls.host, capacity=2,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def rsvp(self, user, status):
+        self.client.force_login(user)
+        self.client.post(f'/polls/event/{self.event.event_id}/rsvp/', {'status': status})
+
+    def statuses(self):
+        rsvps = EventRSVP.objects.filter(event=self.event).order_by('user__username')
+        return {rsvp.user.username: rsvp.rsvp_status for rsvp in rsvps}
+
+    def test_waitlist_is_promoted_in_order(self):
+        a, b, c, d = self.students
+        for student in self.students:
+            self.rsvp(student, 'going')
+        self.assertEqual(self.statuses(), {
+            'student0': 'going', 'student1': 'going', 'student2': 'waitlisted', 'student3': 'waitlisted',
+        })
+        # Asking again while full keeps your place
+        self.rsvp(d, 'going')
+        self.rsvp(c, 'going')
+
+        self.rsvp(b, 'not_going')
+        self.assertEqual(self.statuses()['student2'], 'going')
+        self.assertEqual(self.statuses()['student3'], 'waitlisted')
+        self.rsvp(a, 'maybe')
+        self.assertEqual(self.statuses()['student3'], 'going')
+
+        self.event.refresh_from_db()
+        counts = (self.event.going_count, self.event.maybe_count, self.event.not_going_count, self.event.waitlist_count)
+        self.assertEqual(counts, (2, 1, 1, 0))
+        # Nobody can put themselves on the waitlist directly
+        self.rsvp(a, 'waitlisted')
+        self.assertEqual(self.statuses()['student0'], 'maybe')
+
+    def test_deleting_a_going_user_frees_their_seat(self):
+        a, b, c, _ = self.students
+        for student in (a, b, c):
+            self.rsvp(student, 'going')
+        a.delete()
+        self.assertEqual(self.statuses(), {'student1': 'going', 'student2': 'going'})
+        self.event.refresh_from_db()
+        self.assertEqual((self.event.going_count, self.event.waitlist_count), (2, 0))
+
+
+class EventCapacityConcurrencyTests(unittest.TestCase):
+    """
+    Hundreds of students RSVP to one capped event at the same moment, each
+    on their own thread and connection, as under daphne.
+
+    The test database is in memory, where SQLite fails a writer that finds
+    another one mid-transaction instead of letting it wait, so this runs on
+    a copy of it in a file, with the production connection settings.
+    """
+
+    STUDENTS = 300
+    CAPACITY = 50
+    THREADS = 32
+
+    def run_on_file_database(self, func):
+        """func() on a thread whose connection opens a file copy of the test database"""
+        settings_dict = connections.settings['default']
+        memory_name = settings_dict['NAME']
+        result = {}
+
+        def target():
+            try:
+                result['value'] = func()
+            except BaseException as e:
+                result['error'] = e
+            finally:
+                connection.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'db.sqlite3')
+            connection.ensure_connection()
+            with sqlite3.connect(path) as target_db:
+                connection.connection.backup(target_db)
+            target_db.close()
+            settings_dict['NAME'] = path
+            try:
+                thread = threading.Thread(target=target)
+                thread.start()
+                thread.join()
+            finally:
+                settings_dict['NAME'] = memory_name
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def test_concurrent_rsvps_never_overbook(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from polls.rsvp import set_rsvp
+
+        def scenario():
+            host = User.objects.create_user('host')
+            User.objects.bulk_create([User(username=f'student{i}') for i in range(self.STUDENTS)])
+            students = list(User.objects.filter(username__startswith='student'))
+            event = Event.objects.create(
+                title='Concert', description='Free tickets', date=timezone.now() + timedelta(days=1),
+                hosted_by_user=host, capacity=self.CAPACITY,
+            )
+            start = threading.Barrier(self.THREADS)
+            errors = []
+            changed_minds = set()
+
+            def rsvp(index):
+                student = students[index]
+                try:
+                    if index < self.THREADS:
+                        start.wait()
+                    set_rsvp(event, student, 'going')
+                    # Some change their minds, freeing seats for the waitlist
+                    if index % 7 == 0:
+                        set_rsvp(event, student, 'not_going')
+                        changed_minds.add(student.id)
+                except Exception as e:
+                    errors.append(repr(e))
+                finally:
+                    connection.close()
+
+            with ThreadPoolExecutor(self.THREADS) as pool:
+                list(pool.map(rsvp, range(self.STUDENTS)))
+
+            event.refresh_from_db()
+            statuses = dict(EventRSVP.objects.filter(event=event).values_list('user_id', 'rsvp_status'))
+            return errors, event, statuses, changed_minds
+
+        with override_settings(**TEST_SETTINGS):
+            errors, event, statuses, changed_minds = self.run_on_file_database(scenario)
+
+        self.assertEqual(errors, [])
+        tally = {status: list(statuses.values()).count(status) for status in ('going', 'waitlisted', 'not_going')}
+        # Full, not overbooked, and every seat given up went to the waitlist
+        self.assertEqual(tally['going'], self.CAPACITY)
+        self.assertEqual(tally['not_going'], len(changed_minds))
+        self.assertEqual(sum(tally.values()), self.STUDENTS)
+        self.assertEqual(
+            (event.going_count, event.waitlist_count, event.not_going_count),
+            (tally['going'], tally['waitlisted'], tally['not_going']),
+        )
+
+
+@override_settings(**TEST_SETTINGS)
+class AgendaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = User.objects.create_user('me')
+        cls.host = User.objects.create_user('host')
+        now = timezone.now()
+        cls.mine = Event.objects.create(
+            title='My Study Group', description='Chapter 4', date=now + timedelta(days=2), hosted_by_user=cls.me,
+        )
+        cls.talk = Event.objects.create(
+            title='Guest Talk', description='Robotics', date=now + timedelta(days=1), hosted_by_user=cls.host,
+            capacity=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def titles(self, user):
+        self.client.force_login(user)
+        response = self.client.get('/polls/feed/')
+        return [event['title'] for event in response.context['events']]
+
+    def post(self, user, path, data=None):
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(path, data or {})
+
+    def test_feed_and_profile_share_the_cached_agenda(self):
+        self.assertEqual(self.titles(self.me), ['My Study Group'])
+        with CaptureQueriesContext(connection) as queries:
+            cached = agenda.get_agenda(self.me)
+        self.assertEqual(len(queries), 0)
+        response = self.client.get('/polls/profile/')
+        self.assertEqual(response.context['hosted_events'], cached['hosted'])
+        self.assertEqual(cached['hosted'][0]['host_username'], 'me')
+        self.assertEqual(response.context['attending_events'], [])
+
+    def test_writes_invalidate_the_affected_agendas(self):
+        talk = f'/polls/event/{self.talk.event_id}/rsvp/'
+        self.assertEqual(self.titles(self.me), ['My Study Group'])
+
+        self.post(self.me, talk, {'status': 'going'})
+        self.assertEqual(self.titles(self.me), ['Guest Talk', 'My Study Group'])
+
+        # The talk is full, so the host's friend is waitlisted; when I drop
+        # out they're promoted, and their agenda is dropped too
+        friend = User.objects.create_user('friend')
+        self.post(friend, talk, {'status': 'going'})
+        self.assertEqual(self.titles(friend), [])
+        self.post(self.me, talk, {'status': 'not_going'})
+        self.assertEqual(self.titles(self.me), ['My Study Group'])
+        self.assertEqual(self.titles(friend), ['Guest Talk'])
+
+        date = (timezone.localdate() + timedelta(days=3)).isoformat()
+        self.post(self.me, '/polls/create_event/', {'title': 'Review Session', 'date': date, 'description': 'Finals'})
+        self.assertEqual(self.titles(self.me), ['My Study Group', 'Review Session'])
+
+        self.post(self.host, f'/polls/event/{self.talk.event_id}/delete/')
+        self.assertEqual(self.titles(friend), [])
+
+    def test_expires_when_the_soonest_event_starts(self):
+        Event.objects.filter(pk=self.mine.pk).update(date=timezone.now() + timedelta(seconds=90))
+        with mock.patch.object(agenda.cache, 'set', wraps=agenda.cache.set) as cache_set:
+            agenda.get_agenda(self.me)
+        timeout = cache_set.call_args.args[2]
+        self.assertTrue(89 <= timeout <= 91, timeout)
+
+
+
+class ChannelLayerTests(unittest.TestCase):
+    """
+    SQLiteChannelLayer between two layer instances on one file, as two
+    daphne processes would have (TEST_SETTINGS swaps in the in-memory layer
+    everywhere else).
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sqlite3')
+
+    def layer(self, **config):
+        config = {'poll_interval': 0.01, 'cleanup_interval': 0.01, **config}
+        return SQLiteChannelLayer(path=self.path, **config)
+
+    async def receive(self, layer, channel, timeout=2):
+        """The next message on the channel, or None if none arrives in time"""
+        try:
+            return await asyncio.wait_for(layer.receive(channel), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def test_send_and_receive_across_layers(self):
+        sender, receiver = self.layer(), self.layer()
+
+        async def scenario():
+            specific = await receiver.new_channel()
+            await sender.send(specific, {'type': 'chat.message', 'text': 'hi'})
+            await sender.send('worker', {'type': 'task', 'n': 1})
+            received = [await self.receive(receiver, specific), await self.receive(receiver, 'worker')]
+            await receiver.close()
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), [
+            {'type': 'chat.message', 'text': 'hi'},
+            {'type': 'task', 'n': 1},
+        ])
+
+    def test_group_add_send_and_discard(self):
+        sender, receiver = self.layer(), self.layer()
+
+        async def scenario():
+            first, second = await receiver.new_channel(), await receiver.new_channel()
+            await receiver.group_add('room', first)
+            await receiver.group_add('room', second)
+            await sender.group_send('room', {'type': 'hello'})
+            both = [await self.receive(receiver, first), await self.receive(receiver, second)]
+
+            await receiver.group_discard('room', second)
+            await sender.group_send('room', {'type': 'again'})
+            after = [await self.receive(receiver, first), await self.receive(receiver, second, timeout=0.2)]
+            await receiver.close()
+            return both, after
+
+        both, after = async_to_sync(scenario)()
+        self.assertEqual(both, [{'type': 'hello'}, {'type': 'hello'}])
+        self.assertEqual(after, [{'type': 'again'}, None])
+
+    def test_messages_and_groups_expire(self):
+        layer = self.layer(expiry=0.05, group_expiry=0.05)
+
+        async def scenario():
+            await layer.send('worker', {'type': 'stale'})
+            channel = await layer.new_channel()
+            await layer.group_add('room', channel)
+            await asyncio.sleep(0.1)
+            await layer.group_send('room', {'type': 'too late'})
+            received = [await self.receive(layer, 'worker', timeout=0.2), await self.receive(layer, channel, timeout=0.2)]
+            await layer.close()
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), [None, None])
+
+    def test_channel_full(self):
+        layer = self.layer(capacity=2)
+
+        async def scenario():
+            await layer.send('worker', {'type': 'one'})
+            await layer.send('worker', {'type': 'two'})
+            await layer.send('worker', {'type': 'three'})
+
+        with self.assertRaises(ChannelFull):
+            async_to_sync(scenario)()
+
+    def test_flush(self):
+        layer = self.layer()
+
+        async def scenario():
+            channel = await layer.new_channel()
+            await layer.send('worker', {'type': 'queued'})
+            await layer.group_add('room', channel)
+            await layer.flush()
+            await layer.group_send('room', {'type': 'after flush'})
+            received = [await self.receive(layer, 'worker', timeout=0.2), await self.receive(layer, channel, timeout=0.2)]
+            await layer.close()
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), [None, None])
+
+    def test_poller_stops_once_its_channels_are_idle(self):
+        layer = self.layer(expiry=0.05)
+
+        async def scenario():
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'hello'})
+            await self.receive(layer, channel)
+            poller = layer._poller
+            await asyncio.sleep(0.3)
+            stopped = poller.done()
+            # The next receive starts it again
+            await layer.send(channel, {'type': 'back'})
+            received = await self.receive(layer, channel)
+            await layer.close()
+            return stopped, received
+
+        self.assertEqual(async_to_sync(scenario)(), (True, {'type': 'back'}))
+
+
+@override_settings(**TEST_SETTINGS)
+class MessageWriterTests(TestCase):
+    """
+    The write-behind chat writer (off in TEST_SETTINGS). Batching runs on
+    the real writer thread with flush() recorded instead of saving; saving
+    and retries run flush() on this thread, inside the test's transaction.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice')
+        cls.bob = User.objects.create_user('bob')
+
+    def message(self, n, **fields):
+        fields = {'content': f'Message {n}', **fields}
+        return Message(sender=self.alice, receiver=self.bob, client_id=f'client-{n}', **fields)
+
+    def recording_writer(self, **options):
+        """The writer, with flush() recording batches in self.batches instead of saving them"""
+        writer = MessageWriter(**options)
+        self.batches = []
+        self.flushed = threading.Condition()
+
+        def record(batch):
+            with self.flushed:
+                self.batches.append([message.client_id for message in batch])
+                self.flushed.notify_all()
+
+        writer.flush = record
+        return writer
+
+    def wait_for_batches(self, count):
+        with self.flushed:
+            self.assertTrue(self.flushed.wait_for(lambda: len(self.batches) >= count, timeout=2))
+
+    def test_flushes_full_batches_without_waiting(self):
+        writer = self.recording_writer(batch_size=3, flush_interval=10)
+        for n in range(7):
+            writer.submit(self.message(n))
+        self.wait_for_batches(2)
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3])
+        # stop() flushes the last one rather than waiting out the interval
+        writer.stop()
+        self.assertEqual(self.batches[2], ['client-6'])
+
+    def test_flushes_a_partial_batch_after_the_interval(self):
+        writer = self.recording_writer(batch_size=100, flush_interval=0.05)
+        writer.submit(self.message(1))
+        writer.submit(self.message(2))
+        self.wait_for_batches(1)
+        self.assertEqual(self.batches, [['client-1', 'client-2']])
+        writer.stop()
+
+    def test_stop_flushes_everything_queued(self):
+        writer = self.recording_writer(batch_size=2, flush_interval=10)
+        for n in range(5):
+            writer.submit(self.message(n))
+        writer.stop()
+        self.assertEqual(sorted(client_id for batch in self.batches for client_id in batch),
+                         [f'client-{n}' for n in range(5)])
+
+    @mock.patch('polls.chat_writer.close_old_connections')
+    def test_retried_batch_is_not_duplicated(self, close_old_connections):
+        writer = MessageWriter(retry_delay=0)
+        batch = [self.message(n) for n in range(3)]
+        real_flush = writer.flush
+
+        def commit_then_fail(messages):
+            # The first attempt saves, then the connection errors anyway
+            writer.flush = real_flush
+            real_flush(messages)
+            raise OperationalError('disk I/O error')
+
+        writer.flush = commit_then_fail
+        with self.assertLogs('polls.chat_writer', 'WARNING'):
+            writer._flush_with_retry(batch)
+        self.assertEqual(Message.objects.filter(client_id__startswith='client-').count(), 3)
+
+    @mock.patch('polls.chat_writer.close_old_connections')
+    def test_unsaveable_message_does_not_drop_its_batch(self, close_old_connections):
+        writer = MessageWriter(retry_delay=0)
+        batch = [self.message(1), self.message(2, content=None), self.message(3)]
+        with self.assertLogs('polls.chat_writer', 'ERROR') as logs:
+            writer._flush_with_retry(batch)
+        self.assertEqual(sorted(Message.objects.values_list('client_id', flat=True)), ['client-1', 'client-3'])
+        self.assertIn('dropping message', logs.output[0])
+
+
+@override_settings(**TEST_SETTINGS)
+class MediaServingTests(TestCase):
+    """Conditional and Range requests against serve_media, on a throwaway MEDIA_ROOT"""
+
+    BODY = b'0123456789'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        for name, body in [('notes.txt', self.BODY), ('empty.txt', b'')]:
+            with open(os.path.join(directory.name, name), 'wb') as f:
+                f.write(body)
+
+    def fetch(self, name, **headers):
+        """(response, body)"""
+        async def fetch():
+            response = await self.async_client.get(f'/media/{name}', headers=headers)
+            if not response.streaming:
+                return response, response.content
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(fetch)()
+
+    def test_whole_file_and_byte_ranges(self):
+        response, body = self.fetch('notes.txt')
+        self.assertEqual((response.status_code, body), (200, self.BODY))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        response, body = self.fetch('notes.txt', Range='bytes=2-4')
+        self.assertEqual((response.status_code, body), (206, b'234'))
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+
+        response, body = self.fetch('notes.txt', Range='bytes=-3')
+        self.assertEqual((response.status_code, body), (206, b'789'))
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+
+        response, _ = self.fetch('notes.txt', Range='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_suffix_range_of_an_empty_file_is_unsatisfiable(self):
+        response, _ = self.fetch('empty.txt', Range='bytes=-5')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_if_range(self):
+        current, _ = self.fetch('notes.txt')
+        response, body = self.fetch('notes.txt', Range='bytes=2-4', If_Range=current['Last-Modified'])
+        self.assertEqual((response.status_code, body), (206, b'234'))
+
+        stale = 'Mon, 01 Jan 2001 00:00:00 GMT'
+        response, body = self.fetch('notes.txt', Range='bytes=2-4', If_Range=stale)
+        self.assertEqual((response.status_code, body), (200, self.BODY))
+        # A stale copy gets the whole file even if its range no longer fits
+        response, body = self.fetch('notes.txt', Range='bytes=20-', If_Range=stale)
+        self.assertEqual((response.status_code, body), (200, self.BODY))
+
+    def test_not_modified(self):
+        current, _ = self.fetch('notes.txt')
+        response, _ = self.fetch('notes.txt', If_None_Match=current['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], current['ETag'])
+
+        response, _ = self.fetch('notes.txt', If_Modified_Since=current['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        # If-None-Match wins over If-Modified-Since
+        response, _ = self.fetch('notes.txt', If_None_Match='"other"', If_Modified_Since=current['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(**TEST_SETTINGS)
+class UserCacheTests(TestCase):
+    """The cached request.user is dropped whenever the User or profile changes, wherever from"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('sam', 'sam@example.edu', 'old password')
+        UserProfile.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/polls/feed/').status_code, 200)
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.id)))
+
+    def change(self, func):
+        # As the admin would: saved outside any of our views
+        with self.captureOnCommitCallbacks(execute=True):
+            func(User.objects.get(pk=self.user.pk))
+
+    def assertLoggedOut(self):
+        self.assertRedirects(self.client.get('/polls/feed/'), '/', fetch_redirect_response=False)
+
+    def test_password_change_ends_other_sessions(self):
+        def change_password(user):
+            user.set_password('new password')
+            user.save()
+        self.change(change_password)
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+        self.assertLoggedOut()
+
+    def test_deactivated_user_is_logged_out(self):
+        def deactivate(user):
+            user.is_active = False
+            user.save()
+        self.change(deactivate)
+        self.assertLoggedOut()
+
+    def test_deleted_user_is_logged_out(self):
+        self.change(lambda user: user.delete())
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+        self.assertLoggedOut()
+
+    def test_profile_change_is_seen(self):
+        def change_major(user):
+            user.profile.major = 'Physics'
+            user.profile.save()
+        self.change(change_major)
+        self.assertIsNone(cache.get(user_cache_key(self.user.id)))
+
+
+@override_settings(**TEST_SETTINGS)
+class LoginLoggingTests(TestCase):
+
+    def test_failed_login_logs_no_address(self):
+        with self.assertLogs('polls.views', 'WARNING') as logs:
+            self.client.post('/', {'email': 'Someone@Example.edu', 'password': 'wrong'})
+        record = logs.records[0]
+        self.assertEqual(record.email_domain, 'example.edu')
+        self.assertEqual(record.email_hash, email_fields('someone@example.edu')['email_hash'])
+        self.assertNotIn('someone', json.dumps(vars(record), default=str).lower())
+
+
+@override_settings(**TEST_SETTINGS)
+class TimelineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.me, cls.friend, cls.stranger = [User.objects.create_user(name) for name in ['me', 'friend', 'stranger']]
+        Friendship.objects.bulk_create([
+            Friendship(user=cls.me, friend=cls.friend, status='accepted'),
+            Friendship(user=cls.friend, friend=cls.me, status='accepted'),
+        ])
+        cls.group = Group.objects.create(name='Chess Club', description='Chess', created_by=cls.stranger)
+        GroupMembership.objects.create(user=cls.stranger, group=cls.group)
+        GroupMembership.objects.create(user=cls.me, group=cls.group)
+        cls.start = timezone.now() - timedelta(days=1)
+
+    def setUp(self):
+        # The cached request.user outlives each test's rollback, and ids are reused
+        cache.clear()
+
+    def post(self, author, minute, group=None, pulled=False):
+        """A post `minute` minutes into the day, pushed with publish() unless it's fan-out-on-read"""
+        post = Post.objects.create(content=f'{author.username} at {minute}', created_by=author, group=group)
+        Post.objects.filter(pk=post.pk).update(timestamp=self.start + timedelta(minutes=minute), fanout_on_read=pulled)
+        post.refresh_from_db()
+        if not pulled:
+            publish(post)
+        return post
+
+    def walk(self, user, limit):
+        """Every post id on the user's timeline, page by page"""
+        post_ids, cursor = [], None
+        while True:
+            posts, cursor = get_timeline_page(user, cursor, limit)
+            post_ids += [post.post_id for post in posts]
+            if not cursor:
+                return post_ids
+
+    def timeline_ids(self, user):
+        return set(TimelineEntry.objects.filter(user=user).values_list('post_id', flat=True))
+
+    def test_pages_merge_pushed_and_pulled_posts(self):
+        visible = [
+            self.post(self.friend, 1), self.post(self.friend, 2, pulled=True), self.post(self.me, 3),
+            self.post(self.stranger, 4, group=self.group), self.post(self.friend, 5, pulled=True),
+            self.post(self.stranger, 6, group=self.group, pulled=True), self.post(self.friend, 7),
+        ]
+        # Same timestamp as a visible post: the cursor has to break the tie by id
+        visible.append(self.post(self.friend, 7, pulled=True))
+        self.post(self.stranger, 8)
+        self.post(self.stranger, 9, pulled=True)
+
+        expected = [post.post_id for post in sorted(visible, key=lambda p: (p.timestamp, p.post_id), reverse=True)]
+        for limit in (1, 2, 3, 20):
+            self.assertEqual(self.walk(self.me, limit), expected)
+
+    def test_trim_keeps_the_newest_entries(self):
+        posts = Post.objects.bulk_create([
+            Post(content=f'Post {i}', created_by=self.friend) for i in range(TIMELINE_MAX_LENGTH + 5)
+        ])
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user=self.me, post=post, timestamp=self.start + timedelta(seconds=i))
+            for i, post in enumerate(posts)
+        ])
+        self.assertEqual(trim_timeline(self.me.id), 5)
+        self.assertEqual(self.timeline_ids(self.me), {post.post_id for post in posts[5:]})
+
+    def test_accepting_a_friend_request_backfills_both_timelines(self):
+        theirs = self.post(self.stranger, 1)
+        mine = self.post(self.me, 2)
+        request = Friendship.objects.create(user=self.stranger, friend=self.me, status='pending')
+        self.assertNotIn(theirs.post_id, self.timeline_ids(self.me))
+
+        self.client.force_login(self.me)
+        self.client.post(f'/polls/friend/respond/{request.id}/accept/')
+        self.assertIn(theirs.post_id, self.timeline_ids(self.me))
+        self.assertIn(mine.post_id, self.timeline_ids(self.stranger))
+
+    def test_joining_a_group_backfills_its_posts(self):
+        in_group = self.post(self.stranger, 1, group=self.group)
+        outside = self.post(self.stranger, 2)
+        GroupMembership.objects.create(user=self.friend, group=self.group)
+        self.assertIn(in_group.post_id, self.timeline_ids(self.friend))
+        self.assertNotIn(outside.post_id, self.timeline_ids(self.friend))
+
+
+@override_settings(**TEST_SETTINGS)
+class ConversationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ann, cls.bob, cls.cat = [User.objects.create_user(name) for name in ['ann', 'bob', 'cat']]
+
+    def setUp(self):
+        # The cached request.user outlives each test's rollback, and ids are reused
+        cache.clear()
+
+    def send(self, sender, receiver, content):
+        self.client.force_login(sender)
+        self.client.post('/polls/messages/', {'receiver_id': receiver.id, 'content': content})
+
+    def inbox(self, user, **params):
+        """{other username: (last message text, unread)} from the messages page"""
+        self.client.force_login(user)
+        response = self.client.get('/polls/messages/', params)
+        return {
+            c['user'].username: (c['last_message'].content if c['last_message'] else None, c['unread'])
+            for c in response.context['conversations']
+        }
+
+    def rows(self):
+        return list(Conversation.objects.order_by('user_a', 'user_b').values(
+            'user_a', 'user_b', 'last_message', 'last_message_at', 'unread_a', 'unread_b',
+        ))
+
+    def test_sending_updates_both_sides(self):
+        self.send(self.ann, self.bob, 'hi')
+        self.send(self.ann, self.bob, 'are you there?')
+        self.send(self.bob, self.ann, 'yes')
+        self.send(self.cat, self.bob, 'lunch?')
+
+        self.assertEqual(self.inbox(self.bob), {'cat': ('lunch?', 1), 'ann': ('yes', 2)})
+        self.assertEqual(self.inbox(self.ann), {'bob': ('yes', 1)})
+
+    def test_opening_a_conversation_marks_it_read(self):
+        self.send(self.ann, self.bob, 'hi')
+        self.send(self.bob, self.ann, 'hey')
+        self.send(self.ann, self.bob, 'how are you?')
+
+        self.assertEqual(self.inbox(self.bob, user_id=self.ann.id), {'ann': ('how are you?', 0)})
+        # Only bob's side was read
+        self.assertEqual(self.inbox(self.ann), {'bob': ('how are you?', 1)})
+
+    def test_rebuild_matches_incremental_rows(self):
+        self.send(self.ann, self.bob, 'hi')
+        self.send(self.bob, self.ann, 'hey')
+        self.send(self.ann, self.bob, 'how are you?')
+        self.send(self.cat, self.ann, 'lunch?')
+        self.inbox(self.bob, user_id=self.ann.id)
+
+        incremental = self.rows()
+        self.assertEqual(len(incremental), 2)
+        call_command('rebuild_conversations', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.rows(), incremental)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class PresenceTests(unittest.TestCase):
+    """PresenceRegistry and TypingThrottle against a clock the test moves"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.registry = PresenceRegistry(timeout=60, heartbeat_interval=25, clock=self.clock)
+
+    def at(self, now):
+        self.clock.now = now
+        return self.registry
+
+    def test_heartbeats_and_expiry(self):
+        self.assertTrue(self.at(0).connect(1, 'tab'))
+        self.assertTrue(self.registry.is_online(1))
+        # Re-announced only once per heartbeat interval
+        self.assertFalse(self.at(10).heartbeat(1, 'tab'))
+        self.assertTrue(self.at(30).heartbeat(1, 'tab'))
+
+        self.assertEqual(self.at(80).expire(), [])
+        self.assertEqual(self.at(91).expire(), [1])
+        self.assertFalse(self.registry.is_online(1))
+        # A heartbeat after a stall brings them back, announced
+        self.assertTrue(self.at(95).heartbeat(1, 'tab'))
+        self.assertEqual(self.registry.online([1, 2]), {1})
+
+    def test_last_tab_closing_takes_the_user_offline(self):
+        self.assertTrue(self.at(0).connect(1, 'first'))
+        self.assertFalse(self.registry.connect(1, 'second'))
+        self.assertFalse(self.registry.disconnect(1, 'first'))
+        self.assertTrue(self.registry.is_online(1))
+        self.assertTrue(self.registry.disconnect(1, 'second'))
+        self.assertFalse(self.registry.is_online(1))
+        self.assertFalse(self.registry.disconnect(1, 'second'))
+
+    def test_one_silent_tab_expires_alone(self):
+        self.at(0).connect(1, 'stalled')
+        self.registry.connect(1, 'active')
+        self.at(50).heartbeat(1, 'active')
+        self.assertEqual(self.at(70).expire(), [])
+        self.assertTrue(self.registry.is_online(1))
+        self.assertTrue(self.registry.disconnect(1, 'active'))
+
+    def test_remote_users_expire_unless_reannounced(self):
+        self.at(0).observe(2, True)
+        self.assertTrue(self.registry.is_online(2))
+        self.at(50).observe(2, True)
+        self.assertTrue(self.at(100).is_online(2))
+        self.assertFalse(self.at(110).is_online(2))
+        self.registry.observe(2, True)
+        self.registry.observe(2, False)
+        self.assertFalse(self.registry.is_online(2))
+
+    def test_typing_throttle(self):
+        throttle = TypingThrottle(interval=3, clock=self.clock)
+        self.assertFalse(throttle.stopped())
+        self.clock.now = 0
+        self.assertTrue(throttle.typing())
+        self.clock.now = 2.9
+        self.assertFalse(throttle.typing())
+        self.clock.now = 3
+        self.assertTrue(throttle.typing())
+        self.assertTrue(throttle.stopped())
+        self.assertFalse(throttle.stopped())
+        # After a stop the next keystroke is announced straight away
+        self.clock.now = 3.5
+        self.assertTrue(throttle.typing())
+
+
+@override_settings(**TEST_SETTINGS)
+class NotificationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user('host')
+        cls.student = User.objects.create_user('student')
+        cls.event = Event.objects.create(
+            title='Hack Night', description='Bring a laptop', date=timezone.now() + timedelta(days=1),
+            hosted_by_user=cls.host,
+        )
+
+    def setUp(self):
+        # The cached request.user outlives each test's rollback, and ids are reused
+        cache.clear()
+
+    def rsvp_event(self, user_id, old_status, new_status):
+        return {
+            'kind': 'rsvp', 'event_id': self.event.event_id, 'title': 'Hack Night',
+            'from_user_id': user_id, 'from_username': f'user{user_id}',
+            'old_status': old_status, 'new_status': new_status,
+        }
+
+    def test_coalesce_adds_unread_per_sender(self):
+        frame = notifications.coalesce([
+            {'kind': 'unread', 'sender_id': 1, 'count': 2},
+            {'kind': 'unread', 'sender_id': 2, 'count': 1},
+            {'kind': 'unread', 'sender_id': 1, 'count': 3},
+        ])
+        self.assertEqual(frame['unread'], [{'sender_id': 1, 'count': 5}, {'sender_id': 2, 'count': 1}])
+
+    def test_coalesce_nets_rsvp_changes(self):
+        frame = notifications.coalesce([
+            self.rsvp_event(1, 'maybe', 'going'),
+            self.rsvp_event(2, None, 'going'),
+            self.rsvp_event(1, 'going', 'not_going'),
+            self.rsvp_event(1, 'not_going', 'maybe'),
+            self.rsvp_event(2, 'going', 'maybe'),
+        ])
+        # User 1 ended where they started; user 2's two changes are one
+        self.assertEqual([(r['user_id'], r['old_status'], r['new_status']) for r in frame['rsvps']],
+                         [(2, None, 'maybe')])
+
+    def test_group_hosted_events_notify_nobody(self):
+        group = Group.objects.create(name='Chess Club', description='Chess', created_by=self.host)
+        event = Event.objects.create(title='Blitz', description='', date=timezone.now(), hosted_by_group=group)
+        with mock.patch.object(notifications, 'notify') as notify:
+            notifications.notify_rsvp(event, self.student, None, 'going')
+        notify.assert_not_called()
+
+    @mock.patch.object(NotificationConsumer, 'coalesce_interval', 0.05)
+    def test_socket_hears_only_after_commit(self):
+        from sweapp.asgi import application
+
+        def act():
+            self.client.force_login(self.student)
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post(f'/polls/event/{self.event.event_id}/rsvp/', {'status': 'going'})
+                self.client.post(f'/polls/friend/request/{self.host.id}/')
+            return callbacks
+
+        async def scenario():
+            communicator = WebsocketCommunicator(application, '/ws/notifications/')
+            communicator.scope['user'] = self.host
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            callbacks = await sync_to_async(act)()
+            # Nothing has committed yet
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await sync_to_async(lambda: [callback() for callback in callbacks])()
+            frame = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return frame
+
+        frame = async_to_sync(scenario)()
+        self.assertEqual([(r['username'], r['new_status']) for r in frame['rsvps']], [('student', 'going')])
+        self.assertEqual([r['username'] for r in frame['friend_requests']], ['student'])
+
+
+@override_settings(**TEST_SETTINGS)
+class LiveFeedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.me, cls.friend, cls.stranger = [User.objects.create_user(name) for name in ['me', 'friend', 'stranger']]
+        Friendship.objects.bulk_create([
+            Friendship(user=cls.me, friend=cls.friend, status='accepted'),
+            Friendship(user=cls.friend, friend=cls.me, status='accepted'),
+        ])
+        cls.my_group = Group.objects.create(name='Chess Club', description='Chess', created_by=cls.stranger)
+        cls.other_group = Group.objects.create(name='Rowing', description='Rowing', created_by=cls.stranger)
+        GroupMembership.objects.create(user=cls.me, group=cls.my_group)
+
+    def setUp(self):
+        # The cached request.user outlives each test's rollback, and ids are reused
+        cache.clear()
+
+    def write_posts(self):
+        """Post as friend (three in a row) and stranger; the ids that belong in my feed"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(self.friend)
+            for i in range(3):
+                self.client.post('/polls/feed/', {'content': f'friend {i}'})
+            self.client.force_login(self.stranger)
+            self.client.post('/polls/feed/', {'content': 'not my friend'})
+            for group in (self.my_group, self.other_group):
+                with transaction.atomic():
+                    broadcast_post(Post.objects.create(content=group.name, created_by=self.stranger, group=group))
+        return list(
+            Post.objects.filter(Q(created_by=self.friend) | Q(group=self.my_group))
+            .order_by('-post_id').values_list('post_id', flat=True)
+        )
+
+    @mock.patch.object(FeedConsumer, 'coalesce_interval', 0.5)
+    def test_burst_reaches_friends_and_members_in_one_frame(self):
+        from sweapp.asgi import application
+
+        async def scenario():
+            communicator = WebsocketCommunicator(application, '/ws/feed/')
+            communicator.scope['user'] = self.me
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            expected = await sync_to_async(self.write_posts)()
+            frame = json.loads(await communicator.receive_from())
+            # Everything went out in that one frame
+            self.assertTrue(await communicator.receive_nothing(timeout=0.6))
+            await communicator.disconnect()
+            return expected, frame
+
+        expected, frame = async_to_sync(scenario)()
+        self.assertEqual(frame['type'], 'posts')
+        self.assertEqual([post['post_id'] for post in frame['posts']], expected)
+        self.assertEqual(len(expected), 4)
+
+
+def picture_bytes(size=(300, 200), orientation=None, image_format='PNG'):
+    """An image whose stored left half is red and right half blue"""
+    from PIL import Image
+
+    image = Image.new('RGB', size, 'blue')
+    image.paste('red', (0, 0, size[0] // 2, size[1]))
+    options = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        options['exif'] = exif
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+@override_settings(**TEST_SETTINGS)
+class ThumbnailTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('sam')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.profile = UserProfile.objects.create(user=self.user)
+
+    def upload(self, data, name='me.png'):
+        self.profile.profile_picture.save(name, ContentFile(data))
+        self.profile.thumbnail_key = ''
+        self.profile.save()
+
+    def test_renders_every_size_and_format(self):
+        from PIL import Image
+
+        rendered = list(thumbnails.render_thumbnails(BytesIO(picture_bytes())))
+        self.assertEqual(
+            sorted((size, extension) for size, extension, _ in rendered),
+            sorted((size, extension) for size in thumbnails.THUMBNAIL_SIZES for extension in ('webp', 'jpg')),
+        )
+        for size, extension, data in rendered:
+            with Image.open(BytesIO(data)) as image:
+                self.assertEqual(image.format, {'webp': 'WEBP', 'jpg': 'JPEG'}[extension])
+                self.assertEqual(image.size, (size, size))
+
+    def test_exif_orientation_is_applied(self):
+        from PIL import Image
+
+        # Orientation 6: shown rotated 90 degrees clockwise, so the stored
+        # left (red) half is the top of the picture people see
+        source = BytesIO(picture_bytes(orientation=6, image_format='JPEG'))
+        data = next(data for size, extension, data in thumbnails.render_thumbnails(source)
+                    if size == 256 and extension == 'jpg')
+        with Image.open(BytesIO(data)) as image:
+            top, bottom = image.getpixel((128, 20)), image.getpixel((128, 236))
+        self.assertGreater(top[0], 200)
+        self.assertGreater(bottom[2], 200)
+
+    def test_generate_publishes_a_key_per_picture(self):
+        self.assertIsNone(thumbnails.thumbnail_url(self.profile, 40))
+        self.upload(picture_bytes())
+        # Until they're generated, the original upload is used
+        self.assertEqual(thumbnails.thumbnail_url(self.profile, 40), self.profile.profile_picture.url)
+
+        key = thumbnails.generate_thumbnails(self.profile.pk)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.thumbnail_key, key)
+        self.assertTrue(thumbnails.thumbnails_exist(key))
+        self.assertTrue(thumbnails.thumbnail_url(self.profile, 40).endswith(f'/{key}/40.jpg'))
+        self.assertTrue(thumbnails.thumbnail_url(self.profile, 100, 'webp').endswith(f'/{key}/256.webp'))
+
+        self.upload(picture_bytes(size=(200, 300)))
+        self.assertNotEqual(thumbnails.generate_thumbnails(self.profile.pk), key)
+
+    def test_backfill_command(self):
+        self.upload(picture_bytes())
+        other = UserProfile.objects.create(
+            user=User.objects.create_user('kim'), profile_picture=self.profile.profile_picture.name,
+        )
+        UserProfile.objects.create(user=User.objects.create_user('no_picture'))
+
+        out = StringIO()
+        call_command('backfill_thumbnails', stdout=out)
+        self.assertIn('Generated thumbnails for 2 profiles (0 failed)', out.getvalue())
+        keys = set(UserProfile.objects.exclude(thumbnail_key='').values_list('thumbnail_key', flat=True))
+        # Same picture, same set
+        self.assertEqual(keys, {thumbnails.thumbnail_key(other)})
+
+
+class ContentAddressedStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name)
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.storage.location)
+            for root, _, names in os.walk(self.storage.location) for name in names
+        )
+
+    def test_identical_uploads_share_a_file(self):
+        first = self.storage.save('profile_pics/me.jpg', ContentFile(b'same bytes'))
+        second = self.storage.save('profile_pics/copy.JPG', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertTrue(is_content_addressed(first))
+        self.assertEqual(self.files(), [first])
+        with self.storage.open(first) as f:
+            self.assertEqual(f.read(), b'same bytes')
+
+    def test_different_bytes_get_different_names(self):
+        first = self.storage.save('profile_pics/me.jpg', ContentFile(b'one'))
+        second = self.storage.save('profile_pics/me.jpg', ContentFile(b'two'))
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.files(), sorted([first, second]))
+
+    def test_failed_upload_leaves_no_temp_file(self):
+        upload = ContentFile(b'partial')
+
+        def chunks(chunk_size=None):
+            yield b'part'
+            raise OSError('connection reset')
+
+        upload.chunks = chunks
+        with self.assertRaises(OSError):
+            self.storage.save('profile_pics/me.jpg', upload)
+        self.assertEqual(self.files(), [])
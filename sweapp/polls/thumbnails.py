@@ -0,0 +1,160 @@
+"""
+Profile Picture Thumbnails
+
+Avatars are shown at 40px in the feed and event cards and ~120px on the
+profile page, but uploads are full-size phone photos. Instead of sending
+those, we pre-render square derivatives at THUMBNAIL_SIZES in WebP, plus a
+JPEG fallback for browsers without WebP.
+
+How it works:
+1. edit_profile saves the upload and calls schedule_thumbnails()
+2. After the transaction commits, a small thread pool renders every size
+   and format into profile_pics/thumbs/<key>/ and records the key on the
+   profile (until then templates keep using the original upload)
+3. Templates ask for a display size through the avatar tags in
+   templatetags/avatars.py, which pick the smallest derivative that is big
+   enough (and the next one up for 2x screens)
+4. `manage.py backfill_thumbnails` renders missing sets for old profiles
+
+The key is a hash of the source file name, which storage.py already derives
+from the file's content. So a new upload gets new URLs, identical uploads
+share one set, and a thumbnail URL never changes meaning, which lets
+media.py serve them as immutable. Bump THUMBNAIL_VERSION when the rendering
+changes so the new renders get new URLs too.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps
+
+from .backends import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = (40, 96, 256)
+
+# (format, file extension, Pillow save options)
+THUMBNAIL_FORMATS = (
+    ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+THUMBNAIL_DIR = 'profile_pics/thumbs'
+
+THUMBNAIL_VERSION = 1
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnails')
+
+
+def thumbnail_key(profile):
+    """Directory name for the thumbnails of a profile's current picture"""
+    digest = hashlib.sha1(profile.profile_picture.name.encode()).hexdigest()[:16]
+    return f'v{THUMBNAIL_VERSION}-{digest}'
+
+
+def thumbnail_name(key, size, extension):
+    return f'{THUMBNAIL_DIR}/{key}/{size}.{extension}'
+
+
+def pick_size(size):
+    """Smallest generated size that covers `size` pixels (or the largest)"""
+    for candidate in THUMBNAIL_SIZES:
+        if candidate >= size:
+            return candidate
+    return THUMBNAIL_SIZES[-1]
+
+
+def thumbnail_url(profile, size, extension='jpg'):
+    """
+    URL of the derivative for a display size, or of the original upload if
+    thumbnails haven't been generated yet. None if there is no picture.
+    """
+    if not profile or not profile.profile_picture:
+        return None
+    if not profile.thumbnail_key:
+        return profile.profile_picture.url
+    return default_storage.url(thumbnail_name(profile.thumbnail_key, pick_size(size), extension))
+
+
+def render_thumbnails(source):
+    """Yield (size, extension, bytes) for every size and format of an image file"""
+    with Image.open(source) as image:
+        # Phones store rotation in EXIF; bake it in before cropping
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            # JPEG has no alpha; flatten transparent PNGs onto white
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        image = image.convert('RGB')
+
+        # Largest first, each step resized from the previous one
+        for size in sorted(THUMBNAIL_SIZES, reverse=True):
+            image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            for image_format, extension, options in THUMBNAIL_FORMATS:
+                buffer = BytesIO()
+                image.save(buffer, image_format, **options)
+                yield size, extension, buffer.getvalue()
+
+
+def thumbnails_exist(key):
+    return all(
+        default_storage.exists(thumbnail_name(key, size, extension))
+        for size in THUMBNAIL_SIZES
+        for _, extension, _ in THUMBNAIL_FORMATS
+    )
+
+
+def generate_thumbnails(profile_id, force=False):
+    """
+    Render and store the thumbnails of a profile's current picture.
+
+    Returns the key, or None if there was nothing to do. A set that already
+    exists (someone uploaded the same picture) is reused unless force=True,
+    which overwrites the files in place.
+    """
+    from .models import UserProfile
+
+    profile = UserProfile.objects.filter(pk=profile_id).first()
+    if profile is None or not profile.profile_picture:
+        return None
+
+    key = thumbnail_key(profile)
+    if force or not thumbnails_exist(key):
+        with profile.profile_picture.open('rb') as source:
+            for size, extension, data in render_thumbnails(source):
+                name = thumbnail_name(key, size, extension)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                default_storage.save(name, ContentFile(data))
+
+    # Only publish the key if the picture wasn't replaced meanwhile
+    updated = UserProfile.objects.filter(
+        pk=profile_id,
+        profile_picture=profile.profile_picture.name
+    ).update(thumbnail_key=key)
+    if updated:
+        invalidate_user(profile.user_id)
+    return key
+
+
+def _generate_in_background(profile_id):
+    close_old_connections()
+    try:
+        generate_thumbnails(profile_id)
+    except Exception:
+        logger.exception('thumbnail generation failed', extra={'profile_id': profile_id})
+    finally:
+        connection.close()
+
+
+def schedule_thumbnails(profile):
+    """Generate thumbnails off the request path once the upload is committed"""
+    profile_id = profile.pk
+    transaction.on_commit(lambda: _executor.submit(_generate_in_background, profile_id))
@@ -0,0 +1,176 @@
+"""
+Personal Timelines (fan-out on write)
+
+Each user has a materialized timeline in TimelineEntry holding the posts of
+their accepted friends, the groups they belong to and their own posts.
+
+How it works:
+1. When a post is created, publish() pushes one TimelineEntry per reader
+2. If the post's audience is larger than TIMELINE_FANOUT_LIMIT we skip the
+   push and flag the post fanout_on_read; readers pull those posts in at
+   read time and merge them with their pushed entries (hybrid fan-out)
+3. When someone gains a new friend or joins a group, backfill_timeline()
+   copies in that author's/group's recent posts
+4. Timelines are trimmed to TIMELINE_MAX_LENGTH so they stay bounded
+"""
+
+from django.db.models import Q
+
+from .feed import FEED_PAGE_SIZE, after_cursor, encode_cursor
+from .models import Friendship, GroupMembership, Post, TimelineEntry
+
+# Newest entries kept per user; older posts fall off the timeline
+TIMELINE_MAX_LENGTH = 800
+
+# Readers above this count switch a post from push to pull
+TIMELINE_FANOUT_LIMIT = 1000
+
+# How many recent posts a new friendship or group membership copies in
+TIMELINE_BACKFILL_SIZE = 200
+
+# Each reader's timeline is trimmed on roughly every Nth post pushed to it
+TIMELINE_TRIM_INTERVAL = 50
+
+INSERT_BATCH_SIZE = 500
+
+
+def friend_ids(user_id):
+    return Friendship.objects.filter(user_id=user_id, status='accepted').values_list('friend_id', flat=True)
+
+
+def group_ids(user_id):
+    return GroupMembership.objects.filter(user_id=user_id).values_list('group_id', flat=True)
+
+
+def audience_size(post):
+    """Upper bound on the number of readers of a post, without loading them"""
+    size = Friendship.objects.filter(user_id=post.created_by_id, status='accepted').count()
+    if post.group_id:
+        size += GroupMembership.objects.filter(group_id=post.group_id).count()
+    return size
+
+
+def audience_ids(post):
+    """Everyone whose timeline should receive this post, including the author"""
+    readers = set(friend_ids(post.created_by_id))
+    if post.group_id:
+        readers.update(
+            GroupMembership.objects.filter(group_id=post.group_id).values_list('user_id', flat=True)
+        )
+    readers.add(post.created_by_id)
+    return readers
+
+
+def publish(post):
+    """
+    Fan a freshly created post out to its readers' timelines.
+
+    Returns the reader ids that received a pushed entry. For high fan-out
+    posts that is just the author; everyone else picks the post up on read.
+    """
+    if audience_size(post) > TIMELINE_FANOUT_LIMIT:
+        Post.objects.filter(post_id=post.post_id).update(fanout_on_read=True)
+        post.fanout_on_read = True
+        readers = {post.created_by_id}
+    else:
+        readers = audience_ids(post)
+
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=post.post_id, timestamp=post.timestamp) for user_id in readers],
+        batch_size=INSERT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+    # Spread trimming across posts instead of trimming every reader every time
+    for user_id in readers:
+        if (post.post_id + user_id) % TIMELINE_TRIM_INTERVAL == 0:
+            trim_timeline(user_id)
+
+    return readers
+
+
+def backfill_timeline(user_id, author_ids=(), group_ids=(), limit=TIMELINE_BACKFILL_SIZE):
+    """
+    Copy recent posts from the given authors and groups into a user's timeline.
+
+    Called when a friendship is accepted or a user joins a group. Posts that
+    are served fan-out-on-read are skipped since readers already pull them.
+    """
+    sources = []
+    for author_id in author_ids:
+        sources.append(Post.objects.filter(created_by_id=author_id))
+    for group_id in group_ids:
+        sources.append(Post.objects.filter(group_id=group_id))
+
+    entries = []
+    for posts in sources:
+        recent = (
+            posts.filter(fanout_on_read=False)
+            .order_by('-timestamp', '-post_id')
+            .values_list('post_id', 'timestamp')[:limit]
+        )
+        entries.extend(
+            TimelineEntry(user_id=user_id, post_id=post_id, timestamp=timestamp)
+            for post_id, timestamp in recent
+        )
+
+    TimelineEntry.objects.bulk_create(entries, batch_size=INSERT_BATCH_SIZE, ignore_conflicts=True)
+    trim_timeline(user_id)
+    return len(entries)
+
+
+def rebuild_timeline(user_id, limit=TIMELINE_BACKFILL_SIZE):
+    """Backfill a user's timeline from all of their friends, groups and own posts"""
+    authors = [user_id, *friend_ids(user_id)]
+    return backfill_timeline(user_id, author_ids=authors, group_ids=list(group_ids(user_id)), limit=limit)
+
+
+def trim_timeline(user_id, max_length=TIMELINE_MAX_LENGTH):
+    """Delete everything older than the user's newest max_length entries"""
+    boundary = (
+        TimelineEntry.objects.filter(user_id=user_id)
+        .order_by('-timestamp', '-post_id')
+        .values_list('timestamp', 'post_id')[max_length:max_length + 1]
+    )
+    boundary = list(boundary)
+    if not boundary:
+        return 0
+    timestamp, post_id = boundary[0]
+    deleted, _ = TimelineEntry.objects.filter(user_id=user_id).filter(
+        Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, post_id__lte=post_id)
+    ).delete()
+    return deleted
+
+
+def get_timeline_page(user, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    Return (posts, next_cursor) for one page of a user's timeline.
+
+    Merges the pushed TimelineEntry rows with fan-out-on-read posts from the
+    user's friends and groups. Both sides are keyset range scans over the
+    same (timestamp, post_id) order so the cursor works across the merge.
+    """
+    pushed = (
+        TimelineEntry.objects
+        .filter(user=user)
+        .select_related('post__created_by__profile')
+        .order_by('-timestamp', '-post_id')
+    )
+    pulled = (
+        Post.objects
+        .filter(fanout_on_read=True)
+        .filter(Q(created_by__in=friend_ids(user.id)) | Q(group__in=group_ids(user.id)))
+        .select_related('created_by__profile')
+        .order_by('-timestamp', '-post_id')
+    )
+    if cursor:
+        pushed = pushed.filter(after_cursor(cursor))
+        pulled = pulled.filter(after_cursor(cursor))
+
+    posts = {entry.post_id: entry.post for entry in pushed[:limit + 1]}
+    for post in pulled[:limit + 1]:
+        posts.setdefault(post.post_id, post)
+
+    page = sorted(posts.values(), key=lambda p: (p.timestamp, p.post_id), reverse=True)
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
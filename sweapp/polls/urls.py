@@ -9,15 +9,24 @@ from . import views
 urlpatterns = [
     path('', views.feed_view, name='feed'),
     path('feed/', views.feed_view, name='feed-page'),
+    path('feed/posts/', views.feed_posts_api, name='feed_posts'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
+    path('search/', views.search_view, name='search'),
+    path('search/api/', views.search_api, name='search_api'),
     path('events/', views.events_view, name='events'),
+    path('events/api/', views.events_api, name='events_api'),
+    path('events/calendar/<str:token>.ics', views.event_calendar, name='event_calendar'),
     path('create_event/', views.create_event_view, name='create_event'),
     path('event/<int:event_id>/rsvp/', views.event_rsvp, name='event_rsvp'),
     path('event/<int:event_id>/delete/', views.delete_event, name='delete_event'),
     path('messages/', views.messages_view, name='messages'),
     path('profile/', views.profile_view, name='profile'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
+    path('matches/', views.matches_view, name='matches'),
+    path('matches/api/', views.matches_api, name='matches_api'),
+    path('friends/suggestions/', views.friend_suggestions_api, name='friend_suggestions'),
+    path('friends/mutual/<int:user_id>/', views.mutual_friends_api, name='mutual_friends'),
     path('friend/request/<int:user_id>/', views.send_friend_request, name='send_friend_request'),
     path('friend/respond/<int:friendship_id>/<str:action>/', views.respond_friend_request, name='respond_friend_request'),
 ]
\ No newline at end of file
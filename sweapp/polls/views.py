@@ -1,14 +1,20 @@
-from django.http import HttpResponse
+import logging
+
+from django.http import Http404, HttpResponse, JsonResponse, QueryDict, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 from .models import Event
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
+from .backends import invalidate_user
+from .log import email_fields
 from .models import Message
 
+logger = logging.getLogger(__name__)
+
 def index(request):
     return HttpResponse("Hello world. You're at the polls index.")
 
@@ -20,118 +26,264 @@ def login_view(request):
         email = request.POST.get('email')
         password = request.POST.get('password')
         
-        print(f"[LOGIN] Attempting login for email: {email}")
-        
-        from django.contrib.auth.models import User
-        try:
-            user_obj = User.objects.filter(email=email).first()
-            if not user_obj:
-                raise User.DoesNotExist
-            username = user_obj.username
-            print(f"[LOGIN] Found user: {username}")
-        except User.DoesNotExist:
-            print(f"[LOGIN] No user found with email: {email}")
-            messages.error(request, 'Invalid email or password.')
-            return render(request, 'main/login.html')
-        
-        user = authenticate(request, username=username, password=password)
-        print(f"[LOGIN] Authentication result: {user}")
+        # One indexed lookup by email (see polls/backends.py)
+        user = authenticate(request, email=email, password=password)
         
         if user is not None:
             login(request, user)
-            print(f"[LOGIN] User logged in successfully. Authenticated: {request.user.is_authenticated}")
+            logger.info('login', extra={'user_id': user.id})
             return redirect('/polls/feed/')
         else:
-            print(f"[LOGIN] Authentication failed for user: {username}")
+            # Failures are never sampled away
+            logger.warning('login failed', extra=email_fields(email))
             messages.error(request, 'Invalid email or password.')
     
     return render(request, 'main/login.html')
 
 def feed_view(request):
-    print(f"[FEED] User: {request.user}, Authenticated: {request.user.is_authenticated}")
-    
     if not request.user.is_authenticated:
-        print(f"[FEED] User not authenticated, redirecting to login")
         return redirect('/')
     
     if request.method == 'POST':
         content = request.POST.get('content')
         if content:
+            from .live_feed import broadcast_post
             from .models import Post
-            Post.objects.create(
-                content=content,
-                created_by=request.user
-            )
+            from .timeline import publish
+            with transaction.atomic():
+                post = Post.objects.create(
+                    content=content,
+                    created_by=request.user
+                )
+                publish(post)
+                broadcast_post(post)
             return redirect('feed')
     
-    from .models import Post, Event, EventRSVP
-    posts = Post.objects.all().order_by('-timestamp')[:50]
+    from .agenda import get_agenda, upcoming
+    from .timeline import get_timeline_page
+    posts, next_cursor = get_timeline_page(request.user)
     
-    hosted_events = Event.objects.filter(
-        date__gte=timezone.now(),
-        hosted_by_user=request.user
-    ).order_by('date')[:3]
+    context = {
+        'posts': posts,
+        'next_cursor': next_cursor,
+        'events': upcoming(get_agenda(request.user), 3),
+    }
+    return render(request, 'main/feed.html', context)
+
+def feed_posts_api(request):
+    """Return one cursor-paginated page of the feed as JSON"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    
+    from .feed import FEED_MAX_PAGE_SIZE, FEED_PAGE_SIZE, InvalidCursor, serialize_post
+    from .timeline import get_timeline_page
     
-    attending_event_ids = EventRSVP.objects.filter(
-        user=request.user,
-        rsvp_status='going'
-    ).values_list('event_id', flat=True)
+    try:
+        limit = int(request.GET.get('limit', FEED_PAGE_SIZE))
+    except ValueError:
+        limit = FEED_PAGE_SIZE
+    limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
     
-    attending_events = Event.objects.filter(
-        date__gte=timezone.now(),
-        event_id__in=attending_event_ids
-    ).exclude(hosted_by_user=request.user).order_by('date')[:3]
+    try:
+        posts, next_cursor = get_timeline_page(request.user, request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    
+    return JsonResponse({
+        'posts': [serialize_post(post) for post in posts],
+        'next_cursor': next_cursor,
+    })
+
+def search_params(request):
+    """(query, kind, page) from the query string, clamped to what we serve"""
+    from .search import KINDS, SEARCH_MAX_PAGE
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('type')
+    if kind not in KINDS:
+        kind = None
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
+    return query, kind, max(1, min(page, SEARCH_MAX_PAGE))
+
+def run_search(query, kind, page):
+    """One page of results and whether there is another"""
+    from .search import SEARCH_MAX_PAGE, SEARCH_PAGE_SIZE, search
+    results, has_more = search(query, kind, SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE)
+    return results, has_more and page < SEARCH_MAX_PAGE
+
+def search_view(request):
+    if not request.user.is_authenticated:
+        return redirect('login')
     
-    all_user_events = list(hosted_events) + list(attending_events)
-    all_user_events.sort(key=lambda e: e.date)
+    query, kind, page = search_params(request)
+    results, has_more = run_search(query, kind, page) if query else ([], False)
     
-    print(f"[FEED] Rendering feed for user: {request.user.username}")
-    print(f"[FEED] Hosted events: {len(hosted_events)}, Attending events: {len(attending_events)}")
     context = {
-        'posts': posts,
-        'events': all_user_events[:3],
+        'query': query,
+        'kind': kind,
+        'page': page,
+        'results': results,
+        'has_more': has_more,
     }
-    return render(request, 'main/feed.html', context)
+    return render(request, 'main/search.html', context)
+
+def search_api(request):
+    """Ranked search results with highlighted snippets as JSON"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    
+    query, kind, page = search_params(request)
+    if not query:
+        return JsonResponse({'error': 'Missing q.'}, status=400)
+    results, has_more = run_search(query, kind, page)
+    
+    return JsonResponse({
+        'results': [result.as_dict() for result in results],
+        'page': page,
+        'next_page': page + 1 if has_more else None,
+    })
 
 def events_view(request):
+    """One page of events in a date window (upcoming by default), optionally by category"""
+    from .events import (
+        CATEGORIES, InvalidCursor, InvalidEventFilter, calendar_token, event_filters, get_events_page,
+    )
     from .models import EventRSVP
     
-    events = Event.objects.all().order_by('date')
+    params = request.GET
+    filter_error = None
+    try:
+        start, end, categories = event_filters(params)
+        events, next_cursor = get_events_page(start, end, categories, params.get('cursor'))
+    except (InvalidEventFilter, InvalidCursor):
+        filter_error = "Those filters didn't make sense, so here are the upcoming events."
+        params = QueryDict()
+        categories = []
+        events, next_cursor = get_events_page(timezone.now())
     
     user_rsvps = {}
-    if request.user.is_authenticated:
-        rsvps = EventRSVP.objects.filter(user=request.user)
-        user_rsvps = {rsvp.event_id: rsvp.rsvp_status for rsvp in rsvps}
+    if request.user.is_authenticated and events:
+        rsvps = EventRSVP.objects.filter(
+            user=request.user,
+            event_id__in=[event.event_id for event in events]
+        ).values_list('event_id', 'rsvp_status')
+        user_rsvps = dict(rsvps)
     
     events_with_data = []
     for event in events:
-        rsvp_count = EventRSVP.objects.filter(event=event, rsvp_status='going').count()
         events_with_data.append({
             'event': event,
-            'rsvp_count': rsvp_count,
+            'rsvp_count': event.going_count,
             'user_rsvp': user_rsvps.get(event.event_id)
         })
     
+    # The next page link keeps the filters and swaps in the new cursor
+    next_params = None
+    if next_cursor:
+        next_params = params.copy()
+        next_params['cursor'] = next_cursor
+        next_params = next_params.urlencode()
+    
     context = {
         'events_with_data': events_with_data,
         'events': events,
+        'categories': CATEGORIES,
+        'selected_categories': categories,
+        'start': params.get('start', ''),
+        'end': params.get('end', ''),
+        'filter_error': filter_error,
+        'is_later_page': bool(params.get('cursor')),
+        'next_params': next_params,
+        'calendar_token': calendar_token(request.user) if request.user.is_authenticated else None,
     }
     return render(request, 'main/events.html', context)
 
+
+def events_api(request):
+    """One cursor-paginated page of events as JSON, filtered like events_view"""
+    from .events import (
+        EVENT_MAX_PAGE_SIZE, EVENT_PAGE_SIZE, InvalidCursor, InvalidEventFilter, event_filters,
+        get_events_page, serialize_event,
+    )
+    from .models import EventRSVP
+    
+    try:
+        limit = int(request.GET.get('limit', EVENT_PAGE_SIZE))
+    except ValueError:
+        limit = EVENT_PAGE_SIZE
+    limit = max(1, min(limit, EVENT_MAX_PAGE_SIZE))
+    
+    try:
+        start, end, categories = event_filters(request.GET)
+    except InvalidEventFilter as e:
+        return JsonResponse({'error': f'Invalid filter: {e}'}, status=400)
+    try:
+        events, next_cursor = get_events_page(start, end, categories, request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    
+    user_rsvps = {}
+    if request.user.is_authenticated and events:
+        user_rsvps = dict(EventRSVP.objects.filter(
+            user=request.user,
+            event_id__in=[event.event_id for event in events]
+        ).values_list('event_id', 'rsvp_status'))
+    
+    return JsonResponse({
+        'events': [serialize_event(event, user_rsvps.get(event.event_id)) for event in events],
+        'next_cursor': next_cursor,
+    })
+
+
+def event_calendar(request, token):
+    """
+    A user's hosted and RSVP'd events as a streamed .ics file. The token in
+    the URL stands in for a login, so calendar apps can subscribe to it.
+    """
+    from .events import calendar_user_id, stream_calendar
+    
+    user_id = calendar_user_id(token)
+    if user_id is None or not User.objects.filter(id=user_id).exists():
+        raise Http404('Unknown calendar')
+    
+    base_url = f'{request.scheme}://{request.get_host()}'
+    response = StreamingHttpResponse(
+        stream_calendar(user_id, base_url, request.get_host().split(':')[0]),
+        content_type='text/calendar; charset=utf-8',
+    )
+    response['Content-Disposition'] = 'attachment; filename="events.ics"'
+    return response
+
 def create_event_view(request):
     if request.method == "POST":
         title = request.POST.get("title")
         date = request.POST.get("date")
         description = request.POST.get("description")
         location = request.POST.get("location")
+        category = request.POST.get("category")
+        if category not in dict(Event.CATEGORY_CHOICES):
+            category = 'other'
+        # Blank for no limit
+        try:
+            capacity = max(1, int(request.POST.get("capacity")))
+        except (TypeError, ValueError):
+            capacity = None
         
-        event = Event(
-            title=title,
-            date=date,
-            description=description,
-            hosted_by_user=request.user,
-        )
-        event.save()
+        from .agenda import invalidate_agendas
+        
+        with transaction.atomic():
+            event = Event(
+                title=title,
+                date=date,
+                description=description,
+                category=category,
+                capacity=capacity,
+                hosted_by_user=request.user,
+            )
+            event.save()
+            invalidate_agendas([request.user.id])
         return redirect('/polls/events/')
     return render(request, 'main/create_event.html')
 
@@ -139,27 +291,28 @@ def messages_view(request):
     if not request.user.is_authenticated:
         return redirect('login')
     
-    users = User.objects.exclude(id=request.user.id)
+    from .chat import get_history
+    from .models import Conversation
+    from .notifications import notify_unread
     
     conversation_with = None  
     conversation_messages = []  
+    has_older_messages = False
     
     if 'user_id' in request.GET:
         try:
             conversation_with = User.objects.get(id=request.GET['user_id'])
             
-            conversation_messages = Message.objects.filter(
-                Q(sender=request.user, receiver=conversation_with) |
-                Q(sender=conversation_with, receiver=request.user)
-            ).order_by('timestamp') 
+            conversation_messages, has_older_messages = get_history(request.user.id, conversation_with.id)
             
             Message.objects.filter(
                 sender=conversation_with,
                 receiver=request.user,
                 is_read=False
             ).update(is_read=True)
+            Conversation.mark_read(request.user.id, conversation_with.id)
             
-        except User.DoesNotExist:
+        except (User.DoesNotExist, ValueError):
             pass 
     
     if request.method == 'POST':
@@ -170,20 +323,39 @@ def messages_view(request):
             try:
                 receiver = User.objects.get(id=receiver_id)
 
-                Message.objects.create(
-                    sender=request.user,
-                    receiver=receiver,
-                    content=content
-                )
+                with transaction.atomic():
+                    message = Message.objects.create(
+                        sender=request.user,
+                        receiver=receiver,
+                        content=content
+                    )
+                    Conversation.record_message(message)
+                    notify_unread([message])
 
                 return redirect(f'/polls/messages/?user_id={receiver_id}')
-            except User.DoesNotExist:
+            except (User.DoesNotExist, ValueError):
                 pass
     
+    # Sidebar: one indexed query over the user's conversation summaries
+    conversations = []
+    for conversation in Conversation.for_user(request.user).select_related('user_a', 'user_b', 'last_message'):
+        conversations.append({
+            'user': conversation.other_user(request.user),
+            'last_message': conversation.last_message,
+            'unread': conversation.unread_for(request.user),
+        })
+    
+    # Starting a new chat: show the person even before the first message
+    if conversation_with and conversation_with != request.user and not any(
+        c['user'].id == conversation_with.id for c in conversations
+    ):
+        conversations.insert(0, {'user': conversation_with, 'last_message': None, 'unread': 0})
+    
     context = {
-        'users': users,  
+        'conversations': conversations,  
         'conversation_with': conversation_with, 
         'conversation_messages': conversation_messages,  
+        'has_older_messages': has_older_messages,
     }
     
     return render(request, 'main/messages.html', context)
@@ -192,7 +364,9 @@ def profile_view(request):
     if not request.user.is_authenticated:
         return redirect('login')
     
-    from .models import Post, Group, Event, UserProfile, Friendship, EventRSVP
+    from .agenda import get_agenda
+    from .friend_graph import get_graph
+    from .models import Post, Group, UserProfile, Friendship
     
     profile, created = UserProfile.objects.get_or_create(user=request.user)
     
@@ -200,46 +374,25 @@ def profile_view(request):
     
     user_groups = request.user.user_groups.all()
     
-    friend_count = Friendship.objects.filter(
-        user=request.user,
-        status='accepted'
-    ).count()
+    graph = get_graph()
+    friend_count = graph.friend_count(request.user.id)
     
-    pending_requests = Friendship.objects.filter(
+    # The template shows each requester's name and avatar, and how many
+    # friends they have in common
+    pending_requests = list(Friendship.objects.filter(
         friend=request.user,
         status='pending'
-    )
-    
-    hosted_events = Event.objects.filter(
-        date__gte=timezone.now(),
-        hosted_by_user=request.user
-    ).order_by('date')[:5]
-    
-    print(f"[PROFILE] Hosted events count: {hosted_events.count()}")
-    for evt in hosted_events:
-        print(f"[PROFILE] Hosted: {evt.title} on {evt.date}")
-    
-    attending_event_ids = EventRSVP.objects.filter(
-        user=request.user,
-        rsvp_status='going'
-    ).values_list('event_id', flat=True)
+    ).select_related('user__profile'))
+    for friend_request in pending_requests:
+        friend_request.mutual_friends = graph.mutual_count(request.user.id, friend_request.user_id)
     
-    print(f"[PROFILE] Attending event IDs: {list(attending_event_ids)}")
-    
-    attending_events = Event.objects.filter(
-        date__gte=timezone.now(),
-        event_id__in=attending_event_ids
-    ).exclude(hosted_by_user=request.user).order_by('date')[:5]
-    
-    print(f"[PROFILE] Attending events count: {attending_events.count()}")
-    for evt in attending_events:
-        print(f"[PROFILE] Attending: {evt.title} on {evt.date}")
+    agenda = get_agenda(request.user)
     
     context = {
         'user_posts': user_posts,
         'user_groups': user_groups,
-        'hosted_events': hosted_events,
-        'attending_events': attending_events,
+        'hosted_events': agenda['hosted'],
+        'attending_events': agenda['attending'],
         'profile': profile,
         'friend_count': friend_count,
         'pending_requests': pending_requests,
@@ -251,11 +404,12 @@ def navbar(request):
     return HttpResponse("This is the navbar component.")
 
 def logout_view(request):
-    print(f"[LOGOUT] User {request.user.username} logging out")
     storage = messages.get_messages(request)
     storage.used = True
+    if request.user.is_authenticated:
+        invalidate_user(request.user.id)
+        logger.info('logout', extra={'user_id': request.user.id})
     logout(request)
-    print(f"[LOGOUT] User logged out. Authenticated: {request.user.is_authenticated}")
     return redirect('/')
 
 def sign_up(request):
@@ -284,11 +438,17 @@ def delete_event(request, event_id):
     if not request.user.is_authenticated:
         return redirect('login')
     
+    from .agenda import invalidate_agendas
+    from .models import EventRSVP
+    
     try:
         event = Event.objects.get(event_id=event_id)
         
         if event.hosted_by_user == request.user:
-            event.delete()
+            with transaction.atomic():
+                going = EventRSVP.objects.filter(event=event, rsvp_status='going').values_list('user_id', flat=True)
+                invalidate_agendas([request.user.id, *going])
+                event.delete()
             messages.success(request, 'Event deleted successfully!')
         else:
             messages.error(request, 'You can only delete events you host!')
@@ -303,22 +463,21 @@ def event_rsvp(request, event_id):
         return redirect('login')
     
     from .models import EventRSVP
+    from .rsvp import set_rsvp, waitlist_position
     
     try:
         event = Event.objects.get(event_id=event_id)
         
         if request.method == 'POST':
             status = request.POST.get('status', 'going')
+            # Waitlisting is what happens to 'going' when the event is full
+            if status not in dict(EventRSVP.STATUS_CHOICES) or status == 'waitlisted':
+                messages.error(request, 'Invalid RSVP status.')
+                return redirect('events')
             
-            rsvp, created = EventRSVP.objects.get_or_create(
-                user=request.user,
-                event=event,
-                defaults={'rsvp_status': status}
-            )
-            
-            if not created:
-                rsvp.rsvp_status = status
-                rsvp.save()
+            if set_rsvp(event, request.user, status) == 'waitlisted':
+                position = waitlist_position(event, request.user)
+                messages.info(request, f"{event.title} is full. You're #{position} on the waitlist.")
         
     except Event.DoesNotExist:
         messages.error(request, 'Event not found.')
@@ -332,6 +491,7 @@ def edit_profile(request):
         return redirect('login')
     
     from .models import UserProfile
+    from .thumbnails import schedule_thumbnails
     
     profile, created = UserProfile.objects.get_or_create(user=request.user)
     
@@ -346,6 +506,12 @@ def edit_profile(request):
         profile.workplace = request.POST.get('workplace', '')
         profile.hometown = request.POST.get('hometown', '')
         
+        from .matching import parse_classes, parse_interests
+        profile.classes = ', '.join(parse_classes(request.POST.get('classes', '')))
+        profile.interests = ', '.join(parse_interests(request.POST.get('interests', '')))
+        profile.study_matching = 'study_matching' in request.POST
+        profile.friend_matching = 'friend_matching' in request.POST
+        
         birthday = request.POST.get('birthday')
         if birthday:
             from datetime import datetime
@@ -354,10 +520,15 @@ def edit_profile(request):
             except:
                 pass
         
-        if 'profile_picture' in request.FILES:
+        new_picture = 'profile_picture' in request.FILES
+        if new_picture:
             profile.profile_picture = request.FILES['profile_picture']
+            # Serve the original until the new thumbnails are ready
+            profile.thumbnail_key = ''
         
         profile.save()
+        if new_picture:
+            schedule_thumbnails(profile)
         messages.success(request, 'Profile updated successfully!')
         return redirect('profile')
     
@@ -367,12 +538,105 @@ def edit_profile(request):
     return render(request, 'main/edit_profile.html', context)
 
 
+def matches_view(request):
+    """Study and friend matches for the current user"""
+    if not request.user.is_authenticated:
+        return redirect('login')
+    
+    from .friend_graph import suggestions_for
+    from .matching import find_matches
+    from .models import UserProfile
+    
+    profile = UserProfile.objects.filter(user=request.user).first()
+    sections = []
+    if profile:
+        matches = find_matches(request.user)
+        sections = [
+            {
+                'mode': 'study',
+                'title': 'Study Matching',
+                'enabled': profile.study_matching,
+                'matches': matches['study'],
+                'empty': 'No one shares your classes yet. Add your classes to your profile.',
+            },
+            {
+                'mode': 'friend',
+                'title': 'Friend Matching',
+                'enabled': profile.friend_matching,
+                'matches': matches['friend'],
+                'empty': 'No matches yet. Add your interests and hobbies to your profile.',
+            },
+        ]
+    
+    context = {
+        'profile': profile,
+        'sections': sections,
+        'suggestions': suggestions_for(request.user),
+    }
+    return render(request, 'main/matches.html', context)
+
+
+def matches_api(request):
+    """Top matches in one mode (?mode=study|friend) as JSON"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    
+    from .matching import MATCH_LIMIT, MATCH_MAX_LIMIT, MODES, find_matches
+    
+    mode = request.GET.get('mode', 'study')
+    if mode not in MODES:
+        return JsonResponse({'error': 'mode must be study or friend.'}, status=400)
+    try:
+        limit = int(request.GET.get('limit', MATCH_LIMIT))
+    except ValueError:
+        limit = MATCH_LIMIT
+    limit = max(1, min(limit, MATCH_MAX_LIMIT))
+    
+    matches = find_matches(request.user, [mode], limit)[mode]
+    return JsonResponse({
+        'mode': mode,
+        'matches': [match.as_dict() for match in matches],
+    })
+
+
+def friend_suggestions_api(request):
+    """People the current user may know, most mutual friends first, as JSON"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    
+    from .friend_graph import FRIEND_SUGGESTION_LIMIT, FRIEND_SUGGESTION_MAX_LIMIT, suggestions_for
+    
+    try:
+        limit = int(request.GET.get('limit', FRIEND_SUGGESTION_LIMIT))
+    except ValueError:
+        limit = FRIEND_SUGGESTION_LIMIT
+    limit = max(1, min(limit, FRIEND_SUGGESTION_MAX_LIMIT))
+    
+    return JsonResponse({
+        'suggestions': [suggestion.as_dict() for suggestion in suggestions_for(request.user, limit)],
+    })
+
+
+def mutual_friends_api(request, user_id):
+    """How many friends the current user has in common with another user"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    
+    from .friend_graph import get_graph
+    
+    return JsonResponse({
+        'user_id': user_id,
+        'mutual_friends': get_graph().mutual_count(request.user.id, user_id),
+    })
+
+
 def send_friend_request(request, user_id):
     """Send a friend request to another user"""
     if not request.user.is_authenticated:
         return redirect('login')
     
     from .models import Friendship
+    from .notifications import notify_friend_request
     
     try:
         friend = User.objects.get(id=user_id)
@@ -389,11 +653,12 @@ def send_friend_request(request, user_id):
         if existing:
             messages.info(request, 'Friend request already sent or you are already friends.')
         else:
-            Friendship.objects.create(
+            friendship = Friendship.objects.create(
                 user=request.user,
                 friend=friend,
                 status='pending'
             )
+            notify_friend_request(friendship)
             messages.success(request, f'Friend request sent to {friend.username}!')
         
     except User.DoesNotExist:
@@ -413,13 +678,20 @@ def respond_friend_request(request, friendship_id, action):
         friendship = Friendship.objects.get(id=friendship_id, friend=request.user)
         
         if action == 'accept':
-            friendship.status = 'accepted'
-            friendship.save()
-            Friendship.objects.get_or_create(
-                user=request.user,
-                friend=friendship.user,
-                defaults={'status': 'accepted'}
-            )
+            from .timeline import backfill_timeline
+            
+            with transaction.atomic():
+                friendship.status = 'accepted'
+                friendship.save()
+                Friendship.objects.get_or_create(
+                    user=request.user,
+                    friend=friendship.user,
+                    defaults={'status': 'accepted'}
+                )
+                
+                # Each side's timeline picks up the other's recent posts
+                backfill_timeline(request.user.id, author_ids=[friendship.user_id])
+                backfill_timeline(friendship.user_id, author_ids=[request.user.id])
             messages.success(request, f'You are now friends with {friendship.user.username}!')
         elif action == 'reject':
             friendship.status = 'rejected'
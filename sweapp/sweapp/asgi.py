@@ -7,8 +7,11 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import logging
 import os
+import threading
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
@@ -18,6 +21,24 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sweapp.settings')
 
 django_asgi_app = get_asgi_application()
 
+
+def warm_indexes():
+    """Load the friend graph and matching index before a request needs them"""
+    from django.db import connection
+    from polls import friend_graph, matching
+
+    try:
+        friend_graph.get_graph()
+        matching.get_index().sync()
+    except Exception:
+        logging.getLogger(__name__).exception('Loading the in-memory indexes failed')
+    finally:
+        connection.close()
+
+
+if settings.WARM_INDEXES_ON_STARTUP:
+    threading.Thread(target=warm_indexes, name='warm-indexes', daemon=True).start()
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
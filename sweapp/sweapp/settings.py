@@ -33,6 +33,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings and query counts cover everything below it
+    'polls.metrics.MetricsMiddleware',
+    'polls.routers.ReadReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -62,13 +65,71 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'sweapp.wsgi.application'
 
+# SQLite tuned for daphne's many threads:
+# - WAL lets readers run alongside the single writer
+# - timeout is SQLite's busy_timeout: a writer waits this many seconds for
+#   the lock instead of failing with "database is locked"
+# - IMMEDIATE takes the write lock when a transaction starts, so two
+#   transactions can't both read and then deadlock upgrading to write
+#   (which fails at once, whatever the timeout)
+# - synchronous=NORMAL is durable under WAL except on power loss
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA cache_size=-20000;'  # KiB, ~20 MB per connection
+    'PRAGMA temp_store=MEMORY'
+)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Reuse connections (consumers and worker threads would otherwise
+        # reconnect and rerun the pragmas on every database_sync_to_async call)
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS,
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # Reads of GET requests (polls/routers.py). Same file for now; point it
+    # at a replica when there is one
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS + ';PRAGMA query_only=ON',
+            'timeout': 20,
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['polls.routers.ReadReplicaRouter']
+
+# Email + password logins go through EmailBackend, which also serves
+# request.user from the cache; ModelBackend keeps username logins (admin)
+AUTHENTICATION_BACKENDS = [
+    'polls.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# File-based so every daphne process sees the same entries (and the same
+# invalidations); a local-memory cache would go stale across processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
+# Sessions are read from the cache and only fall back to the database on a miss
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -101,16 +162,71 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Stream every upload straight to a temp file instead of holding small ones
+# in memory; ContentAddressedStorage then hashes it chunk by chunk
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ASGI_APPLICATION = 'sweapp.asgi.application'
 
+# Shared through a local SQLite file so several daphne processes on this
+# host can reach each other's WebSocket groups (see polls/layers.py)
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        'BACKEND': 'polls.layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': BASE_DIR / 'channels.sqlite3',
+            'expiry': 60,
+            'group_expiry': 86400,
+            'capacity': 100,
+        },
     }
 }
 
+# Write-behind chat persistence (polls/chat_writer.py): broadcast chat
+# messages immediately and bulk insert them from a background thread in
+# batches of up to CHAT_WRITE_BATCH_SIZE or every CHAT_WRITE_FLUSH_INTERVAL
+# seconds. A hard crash can lose the messages still queued.
+CHAT_WRITE_BEHIND = False
+CHAT_WRITE_BATCH_SIZE = 100
+CHAT_WRITE_FLUSH_INTERVAL = 0.05
+
+# Load the friend graph and matching index (polls/friend_graph.py,
+# polls/matching.py) in the background as the ASGI app starts, instead of
+# on the first request that needs them
+WARM_INDEXES_ON_STARTUP = True
+
+# /metrics (polls/metrics.py) answers these addresses and staff users
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# JSON lines on stderr, written from a background thread (polls/log.py).
+# WARNING and above are always kept; of the DEBUG/INFO lines on hot paths
+# (logins, chat messages) only LOG_SAMPLE_RATE are.
+POLLS_LOG_LEVEL = 'INFO'
+LOG_SAMPLE_RATE = 0.1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'polls.log.JsonFormatter'},
+    },
+    'filters': {
+        'sampled': {'()': 'polls.log.SamplingFilter', 'rate': LOG_SAMPLE_RATE},
+    },
+    'handlers': {
+        'console': {
+            '()': 'polls.log.QueuedStreamHandler',
+            'formatter': 'json',
+            'filters': ['sampled'],
+        },
+    },
+    'loggers': {
+        'polls': {'handlers': ['console'], 'level': POLLS_LOG_LEVEL, 'propagate': False},
+    },
+}
+
 CSRF_COOKIE_SECURE = False
 CSRF_COOKIE_HTTPONLY = False
 CSRF_COOKIE_SAMESITE = 'Lax'
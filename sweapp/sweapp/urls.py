@@ -17,17 +17,20 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 from polls import views
+from polls.media import serve_media
+from polls.metrics import metrics_view
 from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('', views.login_view, name='login'),  # Default page is login
     path('signup/', views.sign_up, name='sign_up'),
     path('logout/', views.logout_view, name='logout'),  # Logout at root level
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),  # Prometheus scrape target
     path('polls/', include('polls.urls')),  # Other pages under /polls/
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Serve uploaded media (async, with ETag/Range/immutable caching)
+urlpatterns += [
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name='media'),
+]